@@ -0,0 +1,221 @@
+import argparse
+import asyncio
+import json
+from sqlalchemy import select, update, func, case, text, values, column, Integer
+from sqlalchemy.ext.asyncio import AsyncSession
+from . import models, cache
+from .database import SessionLocal, engine
+
+#Aggregates kept up to date by the routers instead of being recomputed on read.
+#
+#service_requests.total_cost of a sale - the sum of quantity * unit_price of its item requests.
+#Item request writes add the difference they make (adjust_service_total), the client's total_cost is ignored for sales.
+#Product and variant deletes take off the items they cascade into (remove_items_totals).
+#Repair totals are still entered by hand.
+#
+#products.stock_quantity - the sum of stock_quantity of its variants.
+#Variant writes and stock reservations add the difference they make (adjust_product_stock), the client's value is ignored.
+#
+#   python -m app.aggregates verify     lists the rows that drifted from a full recount
+#   python -m app.aggregates rebuild    recomputes every aggregate in one set-based statement per aggregate
+
+#float totals are compared with this tolerance by verify, incremental float sums don't land on the exact recount
+TOLERANCE = 1e-6
+
+#rows listed by verify, the count is always exact
+MAX_REPORTED_ROWS = 100
+
+
+#SELECT id FROM service_requests WHERE id = service_id FOR NO KEY UPDATE - the lock adjust_service_total takes.
+#Item writes lock the sale before the variants and products whose stock they take (inventory.py), a writer that
+#only knows its total after taking stock locks the sale first with this.
+async def lock_service(db: AsyncSession, service_id: int):
+    await db.execute(select(models.ServiceRequest.id).where(models.ServiceRequest.id == service_id).with_for_update(key_share=True))
+
+
+#SELECT id FROM <table> WHERE ... ORDER BY id FOR UPDATE - rows a delete is about to remove.
+#Customer and service deletes lock their rows before the variants and products their items give stock back to
+#(inventory.restore_items_stock), in the sale -> variants -> products order of the item writes. FOR UPDATE, the lock
+#the DELETE takes, so an item write waits on its foreign key check instead of holding the sale against the delete.
+async def lock_deleted_rows(db: AsyncSession, model, *where):
+    await db.execute(select(model.id).where(*where).order_by(model.id).with_for_update())
+
+
+#adds delta (quantity * unit_price after - before) to the total of a sale
+async def adjust_service_total(db: AsyncSession, service_id: int, delta: float):
+    if not delta:
+        return
+
+    await db.execute(update(models.ServiceRequest).where(models.ServiceRequest.id == service_id)
+        .values(total_cost=func.coalesce(models.ServiceRequest.total_cost, 0) + delta)
+        .execution_options(synchronize_session=False))
+
+
+#SELECT id FROM <table> WHERE id IN (...) ORDER BY id FOR NO KEY UPDATE, as a CTE an UPDATE joins against.
+#Statements touching several rows lock them in id order first, so concurrent writes can't deadlock each other.
+#FOR NO KEY UPDATE is the lock the UPDATE itself takes, it doesn't block the FOR KEY SHARE of foreign key checks
+#(an item request inserted for a locked variant).
+def locked_rows(model, ids):
+    return (select(model.id)
+        .where(model.id.in_(ids))
+        .order_by(model.id)
+        .with_for_update(key_share=True)
+        .cte(f"locked_{model.__tablename__}")
+        .prefix_with("MATERIALIZED"))
+
+
+#takes the cost of every item request matched by item_filter off its sale's total, run before the item requests are deleted
+#through ON DELETE CASCADE from their product variant or product
+async def remove_items_totals(db: AsyncSession, *item_filter):
+    #(UPDATE service_requests SET total_cost = total_cost - totals.delta
+    # FROM (SELECT request_id, SUM(quantity * unit_price) AS delta FROM item_requests WHERE ... GROUP BY request_id) AS totals ...)
+    totals = (select(models.ItemRequest.request_id, func.sum(models.ItemRequest.quantity * models.ItemRequest.unit_price).label("delta"))
+        .where(*item_filter)
+        .group_by(models.ItemRequest.request_id)
+        .subquery())
+    locked = locked_rows(models.ServiceRequest, select(totals.c.request_id))
+
+    await db.execute(update(models.ServiceRequest).where(
+        models.ServiceRequest.id == locked.c.id,
+        models.ServiceRequest.id == totals.c.request_id
+        ).values(total_cost=func.coalesce(models.ServiceRequest.total_cost, 0) - totals.c.delta)
+        .execution_options(synchronize_session=False))
+
+
+#adds delta (variant stock after - before) to the stock of a product
+async def adjust_product_stock(db: AsyncSession, product_id: int, delta: int):
+    if not delta:
+        return
+
+    await db.execute(update(models.Product).where(models.Product.id == product_id)
+        .values(stock_quantity=models.Product.stock_quantity + delta)
+        .execution_options(synchronize_session=False))
+    cache.invalidate_product(db, product_id)
+
+
+#adjust_product_stock for several products in one statement, deltas - {product_id: delta}
+async def adjust_product_stocks(db: AsyncSession, deltas: dict):
+    deltas = {product_id: delta for product_id, delta in deltas.items() if delta}
+    if not deltas:
+        return
+
+    changes = values(column("id", Integer), column("delta", Integer), name="changes").data(list(deltas.items()))
+    locked = locked_rows(models.Product, list(deltas))
+
+    await db.execute(update(models.Product).where(
+        models.Product.id == locked.c.id,
+        models.Product.id == changes.c.id
+        ).values(stock_quantity=models.Product.stock_quantity + changes.c.delta)
+        .execution_options(synchronize_session=False))
+    for product_id in deltas:
+        cache.invalidate_product(db, product_id)
+
+
+#SELECT COALESCE(SUM(quantity * unit_price), 0) FROM item_requests WHERE request_id = service_requests.id
+def items_total():
+    return (select(func.coalesce(func.sum(models.ItemRequest.quantity * models.ItemRequest.unit_price), 0))
+        .where(models.ItemRequest.request_id == models.ServiceRequest.id)
+        .scalar_subquery())
+
+
+#total_cost of a service PUT/PATCH - a sale's total is recounted from its items, whatever the client sent
+def service_total_values(service_data: dict):
+    service_type = service_data.get("type")
+
+    if service_type == models.ServiceCreate.sale:
+        service_data["total_cost"] = items_total()
+    elif service_type is None:
+        #PATCH without a type, the row's own type decides
+        service_data["total_cost"] = case(
+            (models.ServiceRequest.type == models.ServiceCreate.sale, items_total()),
+            else_=service_data.get("total_cost", models.ServiceRequest.total_cost)
+        )
+
+    return service_data
+
+
+SERVICE_TOTALS = """
+    SELECT service_requests.id, service_requests.total_cost, COALESCE(totals.total, 0) AS expected
+    FROM service_requests
+    LEFT JOIN (
+        SELECT request_id, SUM(quantity * unit_price) AS total
+        FROM item_requests
+        GROUP BY request_id
+    ) AS totals ON totals.request_id = service_requests.id
+    WHERE service_requests.type = 'sale'
+"""
+
+PRODUCT_STOCKS = """
+    SELECT products.id, products.stock_quantity, COALESCE(stocks.total, 0) AS expected
+    FROM products
+    LEFT JOIN (
+        SELECT product_id, SUM(stock_quantity) AS total
+        FROM product_variants
+        GROUP BY product_id
+    ) AS stocks ON stocks.product_id = products.id
+"""
+
+
+async def verify(db: AsyncSession):
+    drifted = (await db.execute(text(f"""
+        SELECT id, total_cost, expected FROM ({SERVICE_TOTALS}) AS service_totals
+        WHERE total_cost IS NULL OR abs(total_cost - expected) > :tolerance
+        ORDER BY id
+    """), {"tolerance": TOLERANCE})).all()
+
+    stock_drifted = (await db.execute(text(f"""
+        SELECT id, stock_quantity, expected FROM ({PRODUCT_STOCKS}) AS product_stocks
+        WHERE stock_quantity != expected
+        ORDER BY id
+    """))).all()
+
+    return {
+        "service_total_cost": {
+            "drifted": len(drifted),
+            "rows": [{"id": id, "total_cost": total_cost, "expected": expected} for id, total_cost, expected in drifted[:MAX_REPORTED_ROWS]]
+        },
+        "product_stock_quantity": {
+            "drifted": len(stock_drifted),
+            "rows": [{"id": id, "stock_quantity": stock_quantity, "expected": expected} for id, stock_quantity, expected in stock_drifted[:MAX_REPORTED_ROWS]]
+        }
+    }
+
+
+async def rebuild(db: AsyncSession):
+    services = await db.execute(text(f"""
+        UPDATE service_requests SET total_cost = service_totals.expected
+        FROM ({SERVICE_TOTALS}) AS service_totals
+        WHERE service_requests.id = service_totals.id
+        AND service_requests.total_cost IS DISTINCT FROM service_totals.expected
+    """))
+
+    products = await db.execute(text(f"""
+        UPDATE products SET stock_quantity = product_stocks.expected
+        FROM ({PRODUCT_STOCKS}) AS product_stocks
+        WHERE products.id = product_stocks.id
+        AND products.stock_quantity != product_stocks.expected
+    """))
+
+    return {
+        "service_total_cost": {"updated": services.rowcount},
+        "product_stock_quantity": {"updated": products.rowcount}
+    }
+
+
+async def main(command: str):
+    try:
+        async with SessionLocal() as db:
+            report = await (verify(db) if command == "verify" else rebuild(db))
+            await db.commit()
+    finally:
+        await engine.dispose()
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Verify or rebuild the aggregates maintained by the API")
+    parser.add_argument("command", choices=["verify", "rebuild"])
+    args = parser.parse_args()
+
+    asyncio.run(main(args.command))
@@ -0,0 +1,104 @@
+import argparse
+import asyncio
+import json
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+from .config import settings
+from .database import SessionLocal, engine
+
+#Daily sales rollup behind the /analytics endpoints.
+#
+#sales_daily_rollup - quantity, revenue and item count of each variant per day (UTC) of the sale, from
+#item_requests JOIN service_requests (sales only) JOIN product_variants. The endpoints only read this table.
+#
+#sales_dirty_days - days whose rollup is out of date. Triggers (migrations/versions/0007_sales_rollup.py) append the day
+#of every sale whose items are inserted, updated or deleted, and of every sale moved to another day, deleted or retyped.
+#It is append only, writers never wait on each other for a day that is already dirty.
+#
+#refresh recomputes the rollup of the dirty days only, in one transaction:
+#   DELETE FROM sales_dirty_days RETURNING day, the rollup rows of those days are deleted and aggregated again.
+#Days marked dirty while it runs stay in sales_dirty_days for the next refresh.
+#Each worker refreshes every settings.analytics_refresh_seconds (refresh_forever, started in main.py), an advisory lock
+#lets one of them at a time do it, the others skip that round.
+#
+#   python -m app.analytics refresh     refreshes the dirty days, e.g. from cron with analytics_refresh_seconds = 0
+#   python -m app.analytics rebuild     marks every day with sales dirty and refreshes them
+
+#pg_try_advisory_xact_lock key of the refresh
+REFRESH_LOCK = 2025
+
+#the day of a sale, the same expression as the triggers
+SALE_DAY = "(service_requests.date AT TIME ZONE 'UTC')::date"
+
+ROLLUP_DAYS = """
+    INSERT INTO sales_daily_rollup (day, product_id, product_variant_id, quantity, revenue, items)
+    SELECT days.day, product_variants.product_id, item_requests.product_variant_id,
+        SUM(item_requests.quantity), SUM(item_requests.quantity * item_requests.unit_price), COUNT(*)
+    FROM unnest(CAST(:days AS date[])) AS days(day)
+    JOIN service_requests ON service_requests.type = 'sale'
+        AND service_requests.date >= days.day::timestamp AT TIME ZONE 'UTC'
+        AND service_requests.date < (days.day + 1)::timestamp AT TIME ZONE 'UTC'
+    JOIN item_requests ON item_requests.request_id = service_requests.id
+    JOIN product_variants ON product_variants.id = item_requests.product_variant_id
+    GROUP BY days.day, product_variants.product_id, item_requests.product_variant_id
+"""
+
+
+#returns the refreshed days, None when another refresh holds the lock
+async def refresh(db: AsyncSession):
+    if not await db.scalar(text("SELECT pg_try_advisory_xact_lock(:key)"), {"key": REFRESH_LOCK}):
+        return None
+
+    days = sorted(set((await db.scalars(text("DELETE FROM sales_dirty_days RETURNING day"))).all()))
+    if days:
+        await db.execute(text("DELETE FROM sales_daily_rollup WHERE day = ANY(CAST(:days AS date[]))"), {"days": days})
+        await db.execute(text(ROLLUP_DAYS), {"days": days})
+
+    return days
+
+
+async def rebuild(db: AsyncSession):
+    await db.execute(text(f"""
+        INSERT INTO sales_dirty_days (day)
+        SELECT DISTINCT {SALE_DAY} FROM service_requests WHERE service_requests.type = 'sale'
+    """))
+    #days that no longer have sales
+    await db.execute(text("INSERT INTO sales_dirty_days (day) SELECT DISTINCT day FROM sales_daily_rollup"))
+
+    return await refresh(db)
+
+
+#background refresh of a worker, a failed round is retried at the next one
+async def refresh_forever():
+    while True:
+        await asyncio.sleep(settings.analytics_refresh_seconds)
+        try:
+            async with SessionLocal() as db:
+                await refresh(db)
+                await db.commit()
+        except Exception as e:
+            print(f"Analytics refresh failed {e}")
+
+
+async def main(command: str):
+    try:
+        async with SessionLocal() as db:
+            days = await (refresh(db) if command == "refresh" else rebuild(db))
+            await db.commit()
+    finally:
+        await engine.dispose()
+
+    if days is None:
+        report = {"skipped": "another refresh is running"}
+    else:
+        report = {"refreshed_days": len(days), "first_day": days[0].isoformat() if days else None, "last_day": days[-1].isoformat() if days else None}
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Refresh the daily sales rollup of the analytics endpoints")
+    parser.add_argument("command", choices=["refresh", "rebuild"])
+    args = parser.parse_args()
+
+    asyncio.run(main(args.command))
@@ -16,11 +16,11 @@ class Service(BaseModel):
     type: ServiceCreate
     total_cost: Optional[float] = 0
 
+#no stock_quantity - a product's stock is the sum of its variants' (aggregates.py)
 class ValidProduct(BaseModel):
     name: str
     description: str
     price: float
-    stock_quantity: int
 
 class Variant(BaseModel):
     size: str
@@ -42,6 +42,10 @@ class Token(BaseModel):
     access_token: str
     token_type: str
     customer_id: int
+    refresh_token: str
+
+class RefreshRequest(BaseModel):
+    refresh_token: str
    
 class TokenData(BaseModel):
     id: Optional[int] = None
\ No newline at end of file
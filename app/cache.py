@@ -0,0 +1,203 @@
+import importlib
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import NamedTuple, Optional
+from fastapi import Request, Response
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from .config import settings
+from .pagination import NEXT_CURSOR_HEADER
+from .response import dump
+
+#Response cache for the product catalog - GET /products/, GET /products/{id} and GET /products/{product_id}/variants/.
+#Entries are the serialized JSON body with its headers, keyed by path and query string, so a hit skips the database
+#and the serialization.
+#
+#Writes invalidate the entries of the products they touch (invalidate_product) and every product list.
+#The invalidation is recorded on the session and applied when it commits, a rolled back write leaves the cache alone.
+#Product and variant handlers, the catalog import and every product stock change (aggregates.py) invalidate.
+#
+#A read served by a replica (replicas.py) may predate the last write, it is only cached once the last invalidation is
+#older than the replica lag the routing allows - a stale entry would outlive the invalidation for the whole TTL, and be
+#served to the clients pinned to the primary as well.
+
+class CacheEntry(NamedTuple):
+    body: bytes
+    headers: dict
+
+
+class CacheBackend(ABC):
+    @abstractmethod
+    def get(self, key: str) -> Optional[CacheEntry]: ...
+
+    @abstractmethod
+    def set(self, key: str, entry: CacheEntry): ...
+
+    #removes every key starting with prefix
+    @abstractmethod
+    def delete_prefix(self, prefix: str): ...
+
+    @abstractmethod
+    def stats(self) -> dict: ...
+
+
+#in-process LRU with a TTL, shared by the requests of one worker
+class MemoryCache(CacheBackend):
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()    #key -> (expires_at, entry), least recently used first
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, key: str):
+        with self.lock:
+            item = self.entries.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+
+            expires_at, entry = item
+            if expires_at <= time.monotonic():
+                del self.entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def set(self, key: str, entry: CacheEntry):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, entry)
+            self.entries.move_to_end(key)
+
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete_prefix(self, prefix: str):
+        with self.lock:
+            keys = [key for key in self.entries if key.startswith(prefix)]
+            for key in keys:
+                del self.entries[key]
+            self.invalidations += len(keys)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "backend": type(self).__name__,
+                "entries": len(self.entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations
+            }
+
+
+#settings.cache_backend - "memory", or "package.module:factory" for a backend of another module,
+#factory() returns the CacheBackend (a shared cache such as Redis, so the workers see each other's invalidations)
+def make_backend(name: str) -> CacheBackend:
+    if name == "memory":
+        return MemoryCache(max_entries=settings.cache_max_entries, ttl=settings.cache_ttl_seconds)
+
+    module, _, factory = name.partition(":")
+    if not factory:
+        raise ValueError(f"cache_backend must be memory or package.module:factory, not {name}")
+    return getattr(importlib.import_module(module), factory)()
+
+
+cache = make_backend(settings.cache_backend)
+
+
+#replaces the backend at runtime, e.g. from a test or an app factory
+def set_backend(backend: CacheBackend):
+    global cache
+    cache = backend
+
+#time.monotonic() of the last invalidation applied by this worker, writes made before it started count as just now
+last_invalidation = time.monotonic()
+
+
+def cache_key(request: Request):
+    return f"{request.url.path}?{'&'.join(sorted(f'{key}={value}' for key, value in request.query_params.multi_items()))}"
+
+
+#the cached response for the request, None on a miss
+def lookup(request: Request):
+    if not settings.cache_enabled:
+        return None
+
+    entry = cache.get(cache_key(request))
+    if entry is None:
+        return None
+
+    return Response(content=entry.body, media_type="application/json", headers=entry.headers)
+
+
+#primary reads are always cached, replica reads once the replica can't be behind the last invalidation
+#(its lag was at most database_replica_max_lag_seconds when last checked, database_replica_check_seconds ago at most)
+def cacheable(db):
+    if not db.info.get("replica"):
+        return True
+
+    return time.monotonic() - last_invalidation > settings.database_replica_max_lag_seconds + settings.database_replica_check_seconds
+
+
+#serializes data with the response model's TypeAdapter (response.py), caches it and returns the response
+#db - the session data was read from, response - the handler's Response parameter, its pagination header is cached along with the body
+def store(request: Request, db, adapter, data, response: Response = None):
+    body = dump(adapter, data)
+
+    headers = {}
+    if response is not None and NEXT_CURSOR_HEADER in response.headers:
+        headers[NEXT_CURSOR_HEADER] = response.headers[NEXT_CURSOR_HEADER]
+
+    if settings.cache_enabled and cacheable(db):
+        cache.set(cache_key(request), CacheEntry(body, headers))
+
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+#Invalidation, applied when the session commits
+
+def pending(db):
+    return db.info.setdefault("cache_invalidations", set())
+
+
+#/products/{product_id}, its variants and every product list - only the lists for a new product
+def invalidate_product(db, product_id: int = None):
+    pending(db).add("/products/?")
+    if product_id is not None:
+        pending(db).update((f"/products/{product_id}?", f"/products/{product_id}/"))
+
+
+#every catalog entry
+def invalidate_catalog(db):
+    pending(db).add("/products/")
+
+
+@event.listens_for(Session, "after_commit")
+def apply_invalidations(session):
+    global last_invalidation
+    prefixes = session.info.pop("cache_invalidations", ())
+    if prefixes:
+        last_invalidation = time.monotonic()
+
+    for prefix in prefixes:
+        cache.delete_prefix(prefix)
+
+
+@event.listens_for(Session, "after_rollback")
+def drop_invalidations(session):
+    session.info.pop("cache_invalidations", None)
@@ -0,0 +1,228 @@
+import argparse
+import asyncio
+import csv
+import enum
+import json
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+from .database import SessionLocal, engine
+
+#Supplier catalog import. One row per product variant:
+#   name, description, price, size, color, stock_quantity
+#A row without size and color only creates/updates the product.
+#
+#Rows are parsed in batches of IMPORT_BATCH_SIZE and sent with COPY into a temporary staging table, then merged into
+#products (by name) and product_variants (by product, size and color) with one INSERT ... ON CONFLICT per table.
+#Everything runs in one transaction, so a failed import leaves the catalog unchanged.
+#
+#   POST /products/import?format=csv        (multipart upload)
+#   python -m app.catalog catalog.csv --format csv
+
+#rows per COPY round trip
+IMPORT_BATCH_SIZE = 5000
+
+#rejected rows listed in the report, the count is always exact
+MAX_REPORTED_REJECTS = 100
+
+STAGING_COLUMNS = ("line", "name", "description", "price", "size", "color", "stock_quantity")
+
+class CatalogFormat(enum.Enum):
+    csv = "csv"
+    ndjson = "ndjson"
+
+
+class CatalogReport:
+    def __init__(self):
+        self.rows = 0
+        self.rejected = 0
+        self.rejects = []
+        self.products = {"inserted": 0, "updated": 0}
+        self.variants = {"inserted": 0, "updated": 0}
+
+    def reject(self, line: int, reason: str):
+        self.rejected += 1
+        if len(self.rejects) < MAX_REPORTED_REJECTS:
+            self.rejects.append({"line": line, "reason": reason})
+
+    def to_dict(self):
+        return {
+            "rows": self.rows,
+            "products": self.products,
+            "variants": self.variants,
+            "rejected": self.rejected,
+            "rejects": sorted(self.rejects, key=lambda reject: reject["line"])
+        }
+
+
+#a text column of an NDJSON record - numbers are taken as their text, lists, objects and booleans are rejected
+def text_value(values: dict, field: str):
+    value = values.get(field)
+    if value is None:
+        return ""
+    if isinstance(value, bool) or not isinstance(value, (str, int, float)):
+        raise ValueError(f"{field} must be a string")
+    return str(value).strip()
+
+
+#CSV/NDJSON record -> staging row, raises ValueError with the reject reason
+def parse_record(line: int, values):
+    if not isinstance(values, dict):
+        raise ValueError("row is not an object")
+
+    name = text_value(values, "name")
+    if not name:
+        raise ValueError("name is required")
+
+    try:
+        price = float(values.get("price"))
+    except (TypeError, ValueError):
+        raise ValueError("price must be a number")
+
+    size = text_value(values, "size") or None
+    color = text_value(values, "color") or None
+    if (size is None) != (color is None):
+        raise ValueError("size and color must be given together")
+
+    stock_quantity = values.get("stock_quantity") or 0
+    try:
+        if isinstance(stock_quantity, bool) or (isinstance(stock_quantity, float) and not stock_quantity.is_integer()):
+            raise TypeError(stock_quantity)
+        stock_quantity = int(stock_quantity)
+    except (TypeError, ValueError):
+        raise ValueError("stock_quantity must be an integer")
+
+    return (line, name, text_value(values, "description"), price, size, color, stock_quantity)
+
+
+#yields (line, values) from a text stream, line is the 1-based line number of the row in the file
+def read_records(stream, format: CatalogFormat):
+    if format == CatalogFormat.csv:
+        reader = csv.DictReader(stream)
+        for values in reader:
+            yield reader.line_num, values
+        return
+
+    for line, raw in enumerate(stream, start=1):
+        if not raw.strip():
+            continue
+        try:
+            yield line, json.loads(raw)
+        except json.JSONDecodeError:
+            yield line, None
+
+
+async def copy_to_staging(db: AsyncSession, stream, format: CatalogFormat, report: CatalogReport):
+    connection = await db.connection()
+    raw = (await connection.get_raw_connection()).driver_connection
+
+    batch = []
+    for line, values in read_records(stream, format):
+        report.rows += 1
+        try:
+            batch.append(parse_record(line, values))
+        except ValueError as e:
+            report.reject(line, str(e))
+            continue
+
+        if len(batch) >= IMPORT_BATCH_SIZE:
+            await raw.copy_records_to_table("catalog_staging", records=batch, columns=STAGING_COLUMNS)
+            batch = []
+
+    if batch:
+        await raw.copy_records_to_table("catalog_staging", records=batch, columns=STAGING_COLUMNS)
+
+
+async def import_catalog(db: AsyncSession, stream, format: CatalogFormat = CatalogFormat.csv):
+    report = CatalogReport()
+
+    await db.execute(text("""
+        CREATE TEMPORARY TABLE catalog_staging (
+            line integer NOT NULL,
+            name text NOT NULL,
+            description text NOT NULL,
+            price double precision NOT NULL,
+            size text,
+            color text,
+            stock_quantity integer NOT NULL
+        ) ON COMMIT DROP
+    """))
+
+    await copy_to_staging(db, stream, format, report)
+
+    #the check constraints of products and product_variants, applied to staging so one bad row doesn't abort the merge
+    violations = await db.execute(text("""
+        DELETE FROM catalog_staging
+        WHERE price < 0 OR stock_quantity < 0
+        RETURNING line, CASE WHEN price < 0 THEN 'check_positive_price' ELSE 'check_variant_stock_positive' END
+    """))
+    for line, constraint in violations:
+        report.reject(line, f"violates {constraint}")
+
+    #xmax = 0 only for rows the INSERT created, a row updated by ON CONFLICT carries the updating transaction id
+    #when a product or variant appears more than once, the last row in the file wins
+    products = (await db.execute(text("""
+        WITH merged AS (
+            INSERT INTO products (name, description, price)
+            SELECT DISTINCT ON (name) name, description, price
+            FROM catalog_staging
+            ORDER BY name, line DESC
+            ON CONFLICT ON CONSTRAINT unique_product_name
+            DO UPDATE SET description = EXCLUDED.description, price = EXCLUDED.price
+            RETURNING xmax = 0 AS inserted
+        )
+        SELECT count(*) FILTER (WHERE inserted), count(*) FILTER (WHERE NOT inserted) FROM merged
+    """))).one()
+
+    variants = (await db.execute(text("""
+        WITH merged AS (
+            INSERT INTO product_variants (product_id, size, color, stock_quantity)
+            SELECT DISTINCT ON (products.id, staging.size, staging.color) products.id, staging.size, staging.color, staging.stock_quantity
+            FROM catalog_staging AS staging
+            JOIN products ON products.name = staging.name
+            WHERE staging.size IS NOT NULL
+            ORDER BY products.id, staging.size, staging.color, staging.line DESC
+            ON CONFLICT ON CONSTRAINT unique_product_variant
+            DO UPDATE SET stock_quantity = EXCLUDED.stock_quantity
+            RETURNING xmax = 0 AS inserted
+        )
+        SELECT count(*) FILTER (WHERE inserted), count(*) FILTER (WHERE NOT inserted) FROM merged
+    """))).one()
+
+    #products.stock_quantity is the sum of its variants (aggregates.py), recounted for the imported products
+    await db.execute(text("""
+        UPDATE products SET stock_quantity = stocks.total
+        FROM (
+            SELECT product_variants.product_id, SUM(product_variants.stock_quantity) AS total
+            FROM product_variants
+            JOIN products ON products.id = product_variants.product_id
+            WHERE products.name IN (SELECT name FROM catalog_staging)
+            GROUP BY product_variants.product_id
+        ) AS stocks
+        WHERE products.id = stocks.product_id
+        AND products.stock_quantity != stocks.total
+    """))
+
+    report.products = {"inserted": products[0], "updated": products[1]}
+    report.variants = {"inserted": variants[0], "updated": variants[1]}
+    return report
+
+
+async def main(path: str, format: CatalogFormat):
+    try:
+        async with SessionLocal() as db:
+            with open(path, newline="", encoding="utf-8-sig") as stream:
+                report = await import_catalog(db, stream, format)
+            await db.commit()
+    finally:
+        await engine.dispose()
+
+    print(json.dumps(report.to_dict(), indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import a supplier catalog into products and product_variants")
+    parser.add_argument("path", help="CSV or NDJSON file")
+    parser.add_argument("--format", choices=[format.value for format in CatalogFormat], default=CatalogFormat.csv.value)
+    args = parser.parse_args()
+
+    asyncio.run(main(args.path, CatalogFormat(args.format)))
@@ -1,19 +1,53 @@
-from sqlalchemy import create_engine
+from uuid import uuid4
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
 from .config import settings
+from .pool import TimedQueuePool
+from .instrumentation import instrument
 
-SQLALCHEMY_DATABASE_URL = f"postgresql://{settings.database_server}:{settings.database_password}@{settings.database_hostname}:{settings.database_port}/{settings.database_name}"
+SQLALCHEMY_DATABASE_URL = f"postgresql+asyncpg://{settings.database_server}:{settings.database_password}@{settings.database_hostname}:{settings.database_port}/{settings.database_name}"
 
-engine = create_engine(SQLALCHEMY_DATABASE_URL)
+def make_engine(url: str):
+    if settings.database_pgbouncer:
+        #PgBouncer transaction pooling - no client side pool, and no prepared statement cache since
+        #consecutive transactions may run on different server connections. asyncpg still prepares every statement,
+        #unique names keep them from colliding with another client's on a shared server connection
+        engine = create_async_engine(
+            url,
+            poolclass=NullPool,
+            connect_args={
+                "statement_cache_size": 0,
+                "prepared_statement_cache_size": 0,
+                "prepared_statement_name_func": lambda: f"__asyncpg_{uuid4()}__"
+            }
+        )
+    else:
+        engine = create_async_engine(
+            url,
+            poolclass=TimedQueuePool,
+            pool_size=settings.database_pool_size,
+            max_overflow=settings.database_max_overflow,
+            pool_timeout=settings.database_pool_timeout,
+            pool_recycle=settings.database_pool_recycle,
+            pool_pre_ping=settings.database_pool_pre_ping
+        )
 
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    #statement count/time per request, slow query log
+    instrument(engine)
+    return engine
+
+
+engine = make_engine(SQLALCHEMY_DATABASE_URL)
+
+#read replicas, GET requests are routed to them by replicas.get_read_db
+replica_engines = [make_engine(url.strip()) for url in settings.database_replica_urls.split(",") if url.strip()]
+
+#expire_on_commit=False - rows stay readable after commit, an expired attribute would need a lazy load which AsyncSession can't do
+SessionLocal = async_sessionmaker(bind=engine, autoflush=False, expire_on_commit=False)
 
 Base = declarative_base()
 
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_db():
+    async with SessionLocal() as db:
         yield db
-    finally:
-        db.close()
\ No newline at end of file
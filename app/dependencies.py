@@ -0,0 +1,152 @@
+from typing import NamedTuple, Optional
+from fastapi import Depends
+from sqlalchemy import select, and_, exists
+from sqlalchemy.orm import contains_eager
+from sqlalchemy.ext.asyncio import AsyncSession
+from .replicas import get_read_db
+from . import models
+from .status_code import validate_customer_ownership, validate_customer_exists, validate_service_exists, validate_type_of_service, validate_repair_exists, validate_item_request_exists, validate_product_exists, validate_variant_exists
+
+#Parent chain lookups for the nested routes.
+#customer -> service -> child (and product -> variant) is resolved with one LEFT JOIN query instead of a query per level,
+#then checked level by level with the status_code.py validators so the 404/400 errors stay the same.
+
+class ServiceChain(NamedTuple):
+    service: models.ServiceRequest
+    child: Optional[object] = None
+
+class VariantChain(NamedTuple):
+    product: models.Product
+    variant: Optional[models.ProductVariant] = None
+
+
+#child - models.Repair or models.ItemRequest, both reference the service through request_id
+async def service_chain(db: AsyncSession, customer_id: int, service_id: int = None, service_type: models.ServiceCreate = None,
+                        child=None, child_id: int = None, options=()):
+    #SELECT customers.*, service_requests.*, child.* FROM customers
+    #LEFT JOIN service_requests ON service_requests.id = service_id AND service_requests.customer_id = customers.id
+    #LEFT JOIN child ON child.id = child_id AND child.request_id = service_requests.id
+    #WHERE customers.id = customer_id
+    query = select(models.Customer).where(models.Customer.id == customer_id)
+
+    if service_id is not None:
+        query = query.add_columns(models.ServiceRequest).outerjoin(models.ServiceRequest, and_(
+            models.ServiceRequest.id == service_id,
+            models.ServiceRequest.customer_id == models.Customer.id
+        )).options(contains_eager(models.ServiceRequest.user))
+
+    if child is not None:
+        query = query.add_columns(child).outerjoin(child, and_(
+            child.id == child_id,
+            child.request_id == models.ServiceRequest.id
+        )).options(contains_eager(child.service))
+
+    row = (await db.execute(query.options(*options))).first()
+
+    validate_customer_exists(row, customer_id)
+    if service_id is None:
+        return ServiceChain(service=None)
+
+    service = row[1]
+    validate_service_exists(service, service_id)
+    if service_type is not None:
+        validate_type_of_service(service.type, service_type)
+
+    if child is None:
+        return ServiceChain(service=service)
+
+    child_row = row[2]
+    if child is models.Repair:
+        validate_repair_exists(child_row, child_id)
+    else:
+        validate_item_request_exists(child_row, child_id)
+
+    return ServiceChain(service=service, child=child_row)
+
+
+async def variant_chain(db: AsyncSession, product_id: int, variant_id: int = None, options=()):
+    #SELECT products.*, product_variants.* FROM products
+    #LEFT JOIN product_variants ON product_variants.id = variant_id AND product_variants.product_id = products.id
+    #WHERE products.id = product_id
+    query = select(models.Product).where(models.Product.id == product_id)
+
+    if variant_id is not None:
+        query = query.add_columns(models.ProductVariant).outerjoin(models.ProductVariant, and_(
+            models.ProductVariant.id == variant_id,
+            models.ProductVariant.product_id == models.Product.id
+        )).options(contains_eager(models.ProductVariant.product))
+
+    row = (await db.execute(query.options(*options))).first()
+
+    validate_product_exists(row, product_id)
+    if variant_id is None:
+        return VariantChain(product=row[0])
+
+    validate_variant_exists(row[1], variant_id)
+    return VariantChain(product=row[0], variant=row[1])
+
+
+#FastAPI dependencies, path parameters are read by name from the route.
+#get_read_db serves them from a replica on GET requests and from the handler's own primary session on writes.
+
+#/customers/{customer_id}/services
+async def valid_customer(customer_id: int, db: AsyncSession = Depends(get_read_db)):
+    await service_chain(db, customer_id)
+    return customer_id
+
+#/customers/{customer_id}/services/{service_id}
+async def valid_service(customer_id: int, service_id: int, db: AsyncSession = Depends(get_read_db)):
+    return (await service_chain(db, customer_id, service_id)).service
+
+#/customers/{customer_id}/services/{service_id}/repairs
+async def valid_repair_service(customer_id: int, service_id: int, db: AsyncSession = Depends(get_read_db)):
+    return (await service_chain(db, customer_id, service_id, models.ServiceCreate.repair)).service
+
+#/customers/{customer_id}/services/{service_id}/repairs/{repair_id}
+async def valid_repair(customer_id: int, service_id: int, repair_id: int, db: AsyncSession = Depends(get_read_db)):
+    return await service_chain(db, customer_id, service_id, models.ServiceCreate.repair, models.Repair, repair_id)
+
+#/customers/{customer_id}/services/{service_id}/items
+async def valid_sale_service(customer_id: int, service_id: int, db: AsyncSession = Depends(get_read_db)):
+    return (await service_chain(db, customer_id, service_id, models.ServiceCreate.sale)).service
+
+#/customers/{customer_id}/services/{service_id}/items/{item_id}
+async def valid_item(customer_id: int, service_id: int, item_id: int, db: AsyncSession = Depends(get_read_db)):
+    return await service_chain(db, customer_id, service_id, models.ServiceCreate.sale, models.ItemRequest, item_id)
+
+#/products/{product_id}/variants
+async def valid_product(product_id: int, db: AsyncSession = Depends(get_read_db)):
+    return (await variant_chain(db, product_id)).product
+
+#/products/{product_id}/variants/{variant_id}
+async def valid_variant(product_id: int, variant_id: int, db: AsyncSession = Depends(get_read_db)):
+    return (await variant_chain(db, product_id, variant_id)).variant
+
+
+#Write guards for the UPDATE/DELETE ... RETURNING handlers.
+#The parent chain and ownership rules go into the WHERE clause of the write itself, so a miss is detected from an empty result
+#and only then explained with the lookups above.
+
+#EXISTS clause - the service is under the customer, has the given type and belongs to the current user
+def owned_service(customer_id: int, service_id: int, current_user_id: int, service_type: models.ServiceCreate = None):
+    clause = exists().where(
+        models.ServiceRequest.id == service_id,
+        models.ServiceRequest.customer_id == customer_id,
+        models.ServiceRequest.customer_id == current_user_id
+    )
+    if service_type is not None:
+        clause = clause.where(models.ServiceRequest.type == service_type)
+    return clause
+
+
+#raises the 404/400/403 error that explains why a guarded write matched no row
+async def explain_service_write(db: AsyncSession, customer_id: int, service_id: int, current_user_id: int, service_type: models.ServiceCreate = None,
+                                child=None, child_id: int = None):
+    chain = await service_chain(db, customer_id, service_id, service_type, child, child_id)
+    validate_customer_ownership(chain.service.customer_id, current_user_id)
+    return chain
+
+
+async def explain_customer_write(db: AsyncSession, customer_id: int, current_user_id: int):
+    await service_chain(db, customer_id)
+    validate_customer_ownership(customer_id, current_user_id)
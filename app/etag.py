@@ -0,0 +1,123 @@
+import hashlib
+from typing import Optional
+from fastapi import status, HTTPException, Request, Response
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+#Strong ETags for the polled service and repair endpoints.
+#The ETag is built from the xmin (id of the transaction that last wrote the row) of every row in the response,
+#read with one small query instead of serializing and hashing the body. Any UPDATE gives a row a new xmin, and inserts and
+#deletes of child rows change the id:xmin list, so the ETag changes whenever the response would.
+#Streaming replicas are physical copies with the same xmin values, a replica and the primary agree on the ETag.
+#
+#The tag is the resource version only, not the URL, so every representation of a resource has the same opaque tag.
+#The full representation gets it as a strong ETag, a partial one (?fields=/?include=, a page of a list) as a weak ETag,
+#a validator of the same version but not of the same bytes. If-Match compares the opaque tags, a client that read
+#the service with ?fields= can still write it with the tag it got.
+#
+#   GET     If-None-Match - 304 Not Modified with no body when the client's copy is current, checked before the response is loaded
+#   PUT/PATCH   If-Match - 412 Precondition Failed when the row changed since the client read it (optimistic concurrency),
+#               checked with the row locked in the write's transaction
+
+IF_NONE_MATCH = "if-none-match"
+IF_MATCH = "if-match"
+
+#GET /customers/{customer_id}/services/{service_id} - the service, its customer, repairs and items
+SERVICE_VERSION = """
+    SELECT concat_ws('|', s.xmin::text, c.xmin::text,
+        (SELECT string_agg(r.id::text || ':' || r.xmin::text, ',' ORDER BY r.id) FROM repairs r WHERE r.request_id = s.id),
+        (SELECT string_agg(i.id::text || ':' || i.xmin::text, ',' ORDER BY i.id) FROM item_requests i WHERE i.request_id = s.id))
+    FROM service_requests s
+    JOIN customers c ON c.id = s.customer_id
+    WHERE s.id = :service_id AND s.customer_id = :customer_id
+"""
+
+#GET /customers/{customer_id}/services/{service_id}/repairs/ - the repairs of the service, each with the service
+REPAIRS_VERSION = """
+    SELECT concat_ws('|', s.xmin::text,
+        (SELECT string_agg(r.id::text || ':' || r.xmin::text, ',' ORDER BY r.id) FROM repairs r WHERE r.request_id = s.id))
+    FROM service_requests s
+    WHERE s.id = :service_id AND s.customer_id = :customer_id AND s.type = 'repair'
+"""
+
+#GET /customers/{customer_id}/services/{service_id}/repairs/{repair_id} - the repair with its service
+REPAIR_VERSION = """
+    SELECT concat_ws('|', r.xmin::text, s.xmin::text)
+    FROM repairs r
+    JOIN service_requests s ON s.id = r.request_id
+    WHERE r.id = :repair_id AND s.id = :service_id AND s.customer_id = :customer_id AND s.type = 'repair'
+"""
+
+
+#version - the row versions read by one of the queries above, None when the resource doesn't exist
+def make_etag(version: Optional[str]):
+    if version is None:
+        return None
+
+    digest = hashlib.sha1(version.encode()).hexdigest()
+    return f'"{digest}"'
+
+
+#the weak ETag of a partial representation, same opaque tag as the strong one
+def weak(etag: Optional[str]):
+    if etag is None:
+        return None
+    return f"W/{etag}"
+
+
+def opaque(etag: str):
+    return etag.removeprefix("W/")
+
+
+async def read_version(db: AsyncSession, query: str, lock: str = None, **params):
+    if lock:
+        query = f"{query} FOR UPDATE OF {lock}"
+    return await db.scalar(text(query), params)
+
+
+#lock - taken by writes checking If-Match, the row can't change between the check and the UPDATE
+async def service_etag(db: AsyncSession, customer_id: int, service_id: int, lock: bool = False):
+    return make_etag(await read_version(db, SERVICE_VERSION, "s" if lock else None, customer_id=customer_id, service_id=service_id))
+
+
+async def repairs_etag(db: AsyncSession, customer_id: int, service_id: int):
+    return make_etag(await read_version(db, REPAIRS_VERSION, customer_id=customer_id, service_id=service_id))
+
+
+async def repair_etag(db: AsyncSession, customer_id: int, service_id: int, repair_id: int, lock: bool = False):
+    return make_etag(await read_version(db, REPAIR_VERSION, "r" if lock else None,
+                                        customer_id=customer_id, service_id=service_id, repair_id=repair_id))
+
+
+def listed_tags(header: str):
+    return [tag.strip() for tag in header.split(",") if tag.strip()]
+
+
+#304 response for a GET whose If-None-Match lists the current ETag, None when the body has to be sent.
+#If-None-Match uses the weak comparison, a W/ prefix added by a proxy still matches.
+def not_modified(request: Request, etag: Optional[str]):
+    header = request.headers.get(IF_NONE_MATCH)
+    if not header or etag is None:
+        return None
+
+    tags = [opaque(tag) for tag in listed_tags(header)]
+    if "*" in tags or opaque(etag) in tags:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+
+    return None
+
+
+#raises 412 when the request's If-Match doesn't list the current ETag.
+#The opaque tags are compared, a weak tag from a partial representation names the same version as the strong one.
+#A missing resource is left to the write itself, which explains the miss with its usual 404/403.
+def check_if_match(request: Request, etag: Optional[str]):
+    header = request.headers.get(IF_MATCH)
+    if not header or etag is None:
+        return
+
+    tags = [opaque(tag) for tag in listed_tags(header)]
+    if "*" not in tags and opaque(etag) not in tags:
+        raise HTTPException(
+            status_code=status.HTTP_412_PRECONDITION_FAILED,
+            detail="Resource was modified, fetch it again and retry with its current ETag"
+        )
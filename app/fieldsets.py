@@ -0,0 +1,107 @@
+from functools import lru_cache
+from typing import List, NamedTuple, Optional
+from fastapi import status, HTTPException, Response
+from pydantic import ConfigDict, TypeAdapter, create_model
+from sqlalchemy.orm import load_only, selectinload, joinedload
+from . import models
+from .response import CustomerResponse, ServiceResponse, render
+
+#Sparse fieldsets for the response models with nested objects (CustomerResponse, ServiceResponse).
+#   ?fields=id,name     the columns of the resource to return, the others aren't selected (load_only)
+#   ?include=services   the relationships to embed, the others aren't loaded
+#Without either parameter the response has its full default shape. With any of them, relationships are opt-in
+#(only the ones in include are embedded) and the columns default to all of them. id is always returned,
+#it is the pagination key and the key the included relationships are loaded by.
+#
+#The response is serialized with a pydantic model built for the requested fields, cached per combination.
+
+
+class Fieldset(NamedTuple):
+    columns: Optional[tuple]   #None - every column
+    includes: dict              #included field name -> loader option
+    list_adapter: TypeAdapter
+    adapter: TypeAdapter
+    model: type
+
+    #loader options of the router query
+    #skip - relationships the query loads itself, e.g. the user row joined in by dependencies.service_chain
+    def options(self, *skip):
+        options = tuple(option for name, option in self.includes.items() if name not in skip)
+        if self.columns is not None:
+            options = (load_only(*[getattr(self.model, name) for name in self.columns]), *options)
+        return options
+
+    def render_list(self, rows, response: Response = None):
+        return render(self.list_adapter, rows, response)
+
+    def render(self, row, response: Response = None):
+        return render(self.adapter, row, response)
+
+
+class Resource:
+    def __init__(self, model, schema, relationships: dict):
+        self.model = model
+        self.schema = schema
+        self.relationships = relationships      #field name -> loader option
+        self.columns = tuple(name for name in schema.model_fields if name not in relationships)
+        self.default = self.fieldset(None, tuple(relationships))
+
+    #fields, include - the raw query parameters
+    def parse(self, fields: Optional[str], include: Optional[str]):
+        if fields is None and include is None:
+            return self.default
+
+        columns = None
+        if fields is not None:
+            columns = self.validate("fields", fields, self.columns)
+            if "id" not in columns:
+                columns = ("id", *columns)
+
+        includes = self.validate("include", include, tuple(self.relationships)) if include is not None else ()
+        return self.fieldset(columns, includes)
+
+    @staticmethod
+    def validate(parameter: str, value: str, allowed: tuple):
+        names = tuple(dict.fromkeys(name.strip() for name in value.split(",") if name.strip()))
+        unknown = [name for name in names if name not in allowed]
+        if unknown:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Unknown {parameter} {', '.join(unknown)}, expected any of {', '.join(allowed)}"
+            )
+        return names
+
+    #(columns, includes) are normalized to the schema's field order, so the same set shares one cached model
+    def fieldset(self, columns: Optional[tuple], includes: tuple):
+        if columns is not None:
+            columns = tuple(name for name in self.columns if name in columns)
+        includes = {name: option for name, option in self.relationships.items() if name in includes}
+
+        list_adapter, adapter = adapters(self.schema, columns or self.columns, tuple(includes))
+        return Fieldset(columns, includes, list_adapter, adapter, self.model)
+
+
+#TypeAdapters of the response model restricted to the given fields
+@lru_cache(maxsize=256)
+def adapters(schema, columns: tuple, includes: tuple):
+    if columns + includes == tuple(schema.model_fields):
+        sparse = schema
+    else:
+        sparse = create_model(
+            f"{schema.__name__}Fields",
+            __config__=ConfigDict(from_attributes=True),
+            **{name: (schema.model_fields[name].annotation, schema.model_fields[name]) for name in columns + includes}
+        )
+    return TypeAdapter(List[sparse]), TypeAdapter(sparse)
+
+
+#same loader options as loaders.CUSTOMER_RESPONSE and loaders.SERVICE_RESPONSE for the default shape
+CUSTOMER = Resource(models.Customer, CustomerResponse, {
+    "services": selectinload(models.Customer.services),
+})
+
+SERVICE = Resource(models.ServiceRequest, ServiceResponse, {
+    "user": joinedload(models.ServiceRequest.user),
+    "repairs": selectinload(models.ServiceRequest.repairs),
+    "items": selectinload(models.ServiceRequest.items),
+})
@@ -0,0 +1,117 @@
+import contextvars
+import logging
+import time
+from fastapi import Request, status
+from fastapi.responses import JSONResponse
+from sqlalchemy import event
+from .config import settings
+
+#Per-request SQL statistics.
+#Cursor execute hooks on the engine count every statement and its time into the QueryStats of the current request,
+#found through a context variable the middleware sets. The middleware reports them in a Server-Timing header:
+#   Server-Timing: db;dur=12.4;desc="5 queries", db-slowest;dur=6.1
+#
+#Statements slower than settings.sql_slow_query_ms are logged to the "app.sql" logger, with their
+#EXPLAIN (ANALYZE, BUFFERS) plan when settings.sql_explain_slow_queries is on (SELECT statements only - the statement
+#runs a second time to be analyzed).
+#
+#Routes can declare how many statements they are expected to run with Depends(query_budget(n)).
+#Going over is logged, and with settings.sql_query_budget_strict (dev mode) the request fails with a 500.
+
+logger = logging.getLogger("app.sql")
+
+
+class QueryStats:
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.slowest = 0.0
+        self.slowest_statement = None
+        self.budget = None
+
+    def record(self, statement: str, seconds: float):
+        self.count += 1
+        self.total += seconds
+        if seconds > self.slowest:
+            self.slowest = seconds
+            self.slowest_statement = statement
+
+    def server_timing(self):
+        return f'db;dur={self.total * 1000:.1f};desc="{self.count} queries", db-slowest;dur={self.slowest * 1000:.1f}'
+
+
+#the mutable QueryStats is shared by the middleware and the endpoint, which Starlette runs in a copied context
+current_stats = contextvars.ContextVar("current_stats", default=None)
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    seconds = time.perf_counter() - conn.info["query_start"].pop()
+
+    stats = current_stats.get()
+    if stats is not None:
+        stats.record(statement, seconds)
+
+    if seconds * 1000 >= settings.sql_slow_query_ms:
+        plan = explain(conn, statement, parameters) if settings.sql_explain_slow_queries else None
+        logger.warning("slow query %.1f ms: %s %r%s", seconds * 1000, statement, parameters, f"\n{plan}" if plan else "")
+
+
+#EXPLAIN (ANALYZE, BUFFERS) of a slow SELECT, on a cursor of its own inside a savepoint,
+#so a failing EXPLAIN doesn't abort the request's transaction
+def explain(conn, statement: str, parameters):
+    if not statement.lstrip().upper().startswith("SELECT"):
+        return None
+
+    #the raw cursor bypasses the engine events, the EXPLAIN isn't recorded or explained itself
+    cursor = conn.connection.cursor()
+    try:
+        cursor.execute("SAVEPOINT explain_slow_query")
+        try:
+            cursor.execute(f"EXPLAIN (ANALYZE, BUFFERS) {statement}", parameters)
+            plan = "\n".join(row[0] for row in cursor.fetchall())
+            cursor.execute("RELEASE SAVEPOINT explain_slow_query")
+            return plan
+        except Exception as e:
+            cursor.execute("ROLLBACK TO SAVEPOINT explain_slow_query")
+            return f"EXPLAIN failed: {e}"
+    finally:
+        cursor.close()
+
+
+def instrument(engine):
+    event.listen(engine.sync_engine, "before_cursor_execute", before_cursor_execute)
+    event.listen(engine.sync_engine, "after_cursor_execute", after_cursor_execute)
+
+
+#Depends(query_budget(n)) - the route is expected to run at most n statements
+def query_budget(limit: int):
+    def set_budget():
+        stats = current_stats.get()
+        if stats is not None:
+            stats.budget = limit
+
+    return set_budget
+
+
+#HTTP middleware, registered in main.py
+async def sql_timing(request: Request, call_next):
+    stats = QueryStats()
+    token = current_stats.set(stats)
+    try:
+        response = await call_next(request)
+    finally:
+        current_stats.reset(token)
+
+    if stats.budget is not None and stats.count > stats.budget:
+        detail = f"{request.method} {request.url.path} ran {stats.count} queries, over its budget of {stats.budget}"
+        logger.warning("query budget exceeded: %s, slowest statement %.1f ms: %s", detail, stats.slowest * 1000, stats.slowest_statement)
+
+        if settings.sql_query_budget_strict:
+            response = JSONResponse(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, content={"detail": detail})
+
+    response.headers["Server-Timing"] = stats.server_timing()
+    return response
@@ -0,0 +1,98 @@
+from fastapi import status, HTTPException
+from sqlalchemy import select, update, func, values, column, Integer
+from sqlalchemy.ext.asyncio import AsyncSession
+from . import models, aggregates
+from .status_code import validate_variant_exists
+
+#Product variant stock held by item requests.
+#Stock is taken with a conditional UPDATE (stock_quantity >= quantity in the WHERE clause) instead of read, checked and
+#written back, so two sales of the last pair can't both pass the check - the second one waits on the row lock, re-checks
+#the condition against the committed stock and matches no row. The row lock is only held until the sale commits,
+#so callers take stock as late as possible in their transaction.
+#Statements touching several variants lock them in id order first, so concurrent sales can't deadlock each other.
+#Every item write locks in the same order - the sale's row (its total, aggregates.py), then the variants, then the products.
+#Service and customer deletes lock their own rows first too (aggregates.lock_deleted_rows).
+#The product's stock_quantity, the sum of its variants (aggregates.py), moves along with the variant's.
+
+
+#409 for a variant that exists but doesn't have the stock, 404 for a variant that doesn't exist
+async def explain_reservation(db: AsyncSession, variant_id: int):
+    variant = await db.scalar(select(models.ProductVariant.id).where(models.ProductVariant.id == variant_id))
+    validate_variant_exists(variant, variant_id)
+
+    raise HTTPException(
+        status_code=status.HTTP_409_CONFLICT,
+        detail=f"Insufficient stock for product variant with id {variant_id}"
+    )
+
+
+#takes quantity (or gives it back when negative) from one variant
+async def reserve_stock(db: AsyncSession, variant_id: int, quantity: int):
+    if quantity < 0:
+        return await restore_stock(db, variant_id, -quantity)
+
+    #(UPDATE product_variants SET stock_quantity = stock_quantity - quantity WHERE id = variant_id AND stock_quantity >= quantity RETURNING product_id)
+    product_id = await db.scalar(update(models.ProductVariant).where(
+        models.ProductVariant.id == variant_id,
+        models.ProductVariant.stock_quantity >= quantity
+        ).values(stock_quantity=models.ProductVariant.stock_quantity - quantity)
+        .returning(models.ProductVariant.product_id).execution_options(synchronize_session=False))
+
+    if not product_id:
+        await explain_reservation(db, variant_id)
+
+    await aggregates.adjust_product_stock(db, product_id, -quantity)
+
+
+async def restore_stock(db: AsyncSession, variant_id: int, quantity: int):
+    product_id = await db.scalar(update(models.ProductVariant).where(models.ProductVariant.id == variant_id)
+        .values(stock_quantity=models.ProductVariant.stock_quantity + quantity)
+        .returning(models.ProductVariant.product_id).execution_options(synchronize_session=False))
+
+    if product_id:
+        await aggregates.adjust_product_stock(db, product_id, quantity)
+
+
+#takes stock for several variants in one statement, quantities - {variant_id: quantity}
+#returns the ids of the variants that had enough stock, the others are left untouched
+async def reserve_stock_many(db: AsyncSession, quantities: dict):
+    if not quantities:
+        return set()
+
+    requested = values(column("id", Integer), column("quantity", Integer), name="requested").data(list(quantities.items()))
+    locked = aggregates.locked_rows(models.ProductVariant, list(quantities))
+
+    reserved = (await db.execute(update(models.ProductVariant).where(
+        models.ProductVariant.id == locked.c.id,
+        models.ProductVariant.id == requested.c.id,
+        models.ProductVariant.stock_quantity >= requested.c.quantity
+        ).values(stock_quantity=models.ProductVariant.stock_quantity - requested.c.quantity)
+        .returning(models.ProductVariant.id, models.ProductVariant.product_id).execution_options(synchronize_session=False))).all()
+
+    deltas = {}
+    for variant_id, product_id in reserved:
+        deltas[product_id] = deltas.get(product_id, 0) - quantities[variant_id]
+    await aggregates.adjust_product_stocks(db, deltas)
+
+    return {variant_id for variant_id, product_id in reserved}
+
+
+#gives back the stock of every item request matched by item_filter, run before the item requests are deleted
+#(directly, or through ON DELETE CASCADE from their service or customer)
+async def restore_items_stock(db: AsyncSession, *item_filter):
+    totals = (select(models.ItemRequest.product_variant_id, func.sum(models.ItemRequest.quantity).label("quantity"))
+        .where(*item_filter)
+        .group_by(models.ItemRequest.product_variant_id)
+        .subquery())
+    locked = aggregates.locked_rows(models.ProductVariant, select(totals.c.product_variant_id))
+
+    restored = await db.execute(update(models.ProductVariant).where(
+        models.ProductVariant.id == locked.c.id,
+        models.ProductVariant.id == totals.c.product_variant_id
+        ).values(stock_quantity=models.ProductVariant.stock_quantity + totals.c.quantity)
+        .returning(models.ProductVariant.product_id, totals.c.quantity).execution_options(synchronize_session=False))
+
+    deltas = {}
+    for product_id, quantity in restored:
+        deltas[product_id] = deltas.get(product_id, 0) + quantity
+    await aggregates.adjust_product_stocks(db, deltas)
@@ -0,0 +1,75 @@
+from sqlalchemy import select
+from sqlalchemy.orm import selectinload, joinedload
+from . import models
+
+#Loader strategies for the nested fields of each response model in response.py.
+#Every router query passes the matching tuple to .options() so relationships are loaded up front
+#(one extra query per relationship at most) instead of lazily, once per row, during serialization.
+
+#CustomerResponse - services
+CUSTOMER_RESPONSE = (
+    selectinload(models.Customer.services),
+)
+
+#ServiceResponse collections, for queries that already join the user row (dependencies.service_chain)
+SERVICE_COLLECTIONS = (
+    selectinload(models.ServiceRequest.repairs),
+    selectinload(models.ServiceRequest.items),
+)
+
+#ServiceResponse - user, repairs, items
+SERVICE_RESPONSE = (
+    joinedload(models.ServiceRequest.user),
+    *SERVICE_COLLECTIONS,
+)
+
+#ProductResponse - variants
+PRODUCT_RESPONSE = (
+    selectinload(models.Product.variants),
+)
+
+#VariantResponse - product
+VARIANT_RESPONSE = (
+    joinedload(models.ProductVariant.product),
+)
+
+#RepairResponse - service
+REPAIR_RESPONSE = (
+    joinedload(models.Repair.service),
+)
+
+#ItemRequestResponse - service
+ITEM_REQUEST_RESPONSE = (
+    joinedload(models.ItemRequest.service),
+)
+
+
+#Reloads a row with the loader strategy of its response model after an INSERT/UPDATE.
+#AsyncSession can't lazy load, so relationships of a freshly written row must be loaded explicitly.
+async def reload(db, model, id: int, options):
+    query = select(model).options(*options).where(model.id == id).execution_options(populate_existing=True)
+    return await db.scalar(query)
+
+
+#Relationship attributes of each response model, loaded onto rows returned by UPDATE ... RETURNING
+CUSTOMER_RELATIONSHIPS = ["services"]
+SERVICE_RELATIONSHIPS = ["user", "repairs", "items"]
+PRODUCT_RELATIONSHIPS = ["variants"]
+VARIANT_RELATIONSHIPS = ["product"]
+REPAIR_RELATIONSHIPS = ["service"]
+ITEM_REQUEST_RELATIONSHIPS = ["service"]
+
+
+#Runs an UPDATE/DELETE ... RETURNING <model> and loads the response model's relationships onto the returned row.
+#Returns None when the WHERE clause matched no row.
+async def returning(db, statement, relationships=()):
+    row = await returning_row(db, statement, relationships)
+    return row[0] if row is not None else None
+
+
+#Same as returning, for RETURNING <model>, <columns> - returns the whole row
+async def returning_row(db, statement, relationships=()):
+    row = (await db.execute(statement.execution_options(populate_existing=True, synchronize_session=False))).first()
+    if row is not None and relationships:
+        await db.refresh(row[0], attribute_names=relationships)
+    return row
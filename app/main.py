@@ -1,22 +1,62 @@
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
-from .database import engine
-from . import models
-from .routers import customers, service, product, variant, repair, items, login
+from fastapi.responses import ORJSONResponse
+from .database import engine, replica_engines
+from .utils import shutdown_password_pool
+from .analytics import refresh_forever
+from .config import settings
+from .instrumentation import sql_timing
+from .replicas import replica_pin
+from .routers import customers, service, product, variant, repair, board, items, login, export, metrics, analytics
 
-models.Base.metadata.create_all(bind=engine)
+#The schema is managed by the migrations in migrations/ (alembic upgrade head), workers don't touch it at startup
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    #incremental refresh of the sales rollup, see analytics.py
+    refresher = asyncio.create_task(refresh_forever()) if settings.analytics_refresh_seconds > 0 else None
 
-app = FastAPI()
+    yield
+
+    if refresher:
+        refresher.cancel()
+    shutdown_password_pool()
+    await engine.dispose()
+    for replica_engine in replica_engines:
+        await replica_engine.dispose()
+
+#orjson encodes the responses FastAPI serializes itself, the list endpoints render theirs with response.py
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
+
+#Server-Timing header with the request's SQL statement count and time
+app.middleware("http")(sql_timing)
+
+#reads from the primary for a while after a write, see replicas.py
+app.middleware("http")(replica_pin)
 
 app.include_router(customers.router)
 app.include_router(service.router)
 app.include_router(product.router)
 app.include_router(variant.router)
 app.include_router(repair.router)
+app.include_router(board.router)
 app.include_router(items.router)
 app.include_router(login.router)
+app.include_router(export.router)
+app.include_router(metrics.router)
+app.include_router(analytics.router)
 
-#Routers -          customers.py,   service.py,     product.py,     variant.py,     repair.py,      items.py
-#Table Schemas -    models.py
+#Routers -          customers.py,   service.py,     product.py,     variant.py,     repair.py,      board.py,       items.py,       export.py,      metrics.py,     analytics.py
+#Table Schemas -    models.py,      migrations/
+#Loader strategies - loaders.py,   fieldsets.py
 #Pydantic Schemas -          body.py,     response.py,    update.py
-#Error handling -   status_code.py
+#Error handling -   status_code.py,     dependencies.py
+#Connection pool -  pool.py
+#SQL instrumentation - instrumentation.py
+#Read replicas -    replicas.py
+#Response cache -   cache.py,       etag.py
+#Catalog import -   catalog.py
+#Stock, aggregates - inventory.py,   aggregates.py
+#Repair status -    repair_states.py
+#Sales analytics -  analytics.py
 #Token -            oauth2.py,     login.py
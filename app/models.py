@@ -1,5 +1,5 @@
 from .database import Base
-from sqlalchemy import TIMESTAMP, Column, ForeignKey, Integer, Boolean, String, Enum, Float, CheckConstraint, UniqueConstraint
+from sqlalchemy import TIMESTAMP, Column, ForeignKey, Integer, BigInteger, Boolean, String, Enum, Float, Date, Identity, CheckConstraint, UniqueConstraint, Index
 from sqlalchemy.sql.expression import text
 import enum
 from sqlalchemy.orm import relationship
@@ -17,6 +17,14 @@ class Status(enum.Enum):
     IN_PROGRESS = "in_progress"
     COMPLETED = "completed"
 
+#statuses on the repair board (GET /repairs/) and the predicates of their partial indexes.
+#The board query repeats the predicate as SQL text, a bound parameter would keep a prepared statement's generic plan off the index.
+#repair_enum stores the names of Status.
+REPAIR_BOARD_STATUSES = {
+    Status.PENDING: "status = 'PENDING'",
+    Status.IN_PROGRESS: "status = 'IN_PROGRESS'",
+}
+
 #/customers
 class Customer(Base):
     __tablename__ = "customers"
@@ -26,7 +34,7 @@ class Customer(Base):
     email = Column(String, nullable=False, unique=True)
     password = Column(String, nullable=False)
     address = Column(String, nullable=False)
-    created_at = Column(TIMESTAMP(timezone=True), nullable=False, server_default=text('now()'))
+    created_at = Column(TIMESTAMP(timezone=True), nullable=False, server_default=text('now()'), index=True)
 
     #references ServiceRequest class and user attribute
     services = relationship("ServiceRequest", back_populates="user")
@@ -48,6 +56,13 @@ class ServiceRequest(Base):
     repairs = relationship("Repair", back_populates="service")
     items = relationship("ItemRequest", back_populates="service")
 
+    #GET /customers/{customer_id}/services/ type and date filters, and the customer_id filter with keyset pagination on id
+    __table_args__ = (
+        Index("ix_service_requests_customer_id_type_date", "customer_id", "type", "date"),
+        Index("ix_service_requests_customer_id_id", "customer_id", "id"),
+        Index("ix_service_requests_date", "date"),    #sales of a day, refresh of the sales rollup (analytics.py)
+    )
+
 #/product" 
 class Product(Base):
     __tablename__ = "products"
@@ -57,15 +72,19 @@ class Product(Base):
     description = Column(String, nullable=False)
     price = Column(Float, nullable=False) 
     stock_quantity = Column(Integer, nullable=False, server_default=text("0"))
-    created_at = Column(TIMESTAMP(timezone=True), nullable=False, server_default=text('now()'))
+    created_at = Column(TIMESTAMP(timezone=True), nullable=False, server_default=text('now()'), index=True)
 
     #references ProductVariant class and product attribute
     variants = relationship("ProductVariant", back_populates="product")
 
     #changes on price and stock must not be < 0
+    #product names are the merge key of the catalog import (catalog.py)
     __table_args__ = (
         CheckConstraint('price >= 0', name="check_positive_price"),
-        CheckConstraint('stock_quantity >= 0', name="check_stock_positive")
+        CheckConstraint('stock_quantity >= 0', name="check_stock_positive"),
+        UniqueConstraint('name', name="unique_product_name"),
+        #GET /products/?in_stock=true - stock_quantity is the sum of the variants' stock (aggregates.py)
+        Index("ix_products_in_stock", "id", postgresql_where=text("stock_quantity > 0"))
     )
 
 #product/{product_id}/variant
@@ -81,8 +100,11 @@ class ProductVariant(Base):
     #references the Product class and variants attribute
     product = relationship("Product", back_populates="variants")
 
+    #one variant per size and color of a product, the merge key of the catalog import
     __table_args__ = (
         CheckConstraint('stock_quantity >= 0', name="check_variant_stock_positive"),
+        UniqueConstraint('product_id', 'size', 'color', name="unique_product_variant"),
+        Index("ix_product_variants_product_id_id", "product_id", "id"),    #GET /products/{product_id}/variants/
     )
 
 #/customers/customer_id/services/service_id/repairs
@@ -96,10 +118,18 @@ class Repair(Base):
     created_at = Column(TIMESTAMP(timezone=True), nullable=False, server_default=text('now()'))
     start_date = Column(TIMESTAMP(timezone=True), nullable=True)
     finished_date = Column(TIMESTAMP(timezone=True), nullable=True)
+    version = Column(Integer, nullable=False, server_default=text("0"))    #incremented by every update, see repair_states.py
     
     #references ServiceRequest class and repairs attribute
     service = relationship("ServiceRequest", back_populates="repairs")
 
+    __table_args__ = (
+        Index("ix_repairs_request_id_id", "request_id", "id"),    #GET .../services/{service_id}/repairs/
+        #GET /repairs/ - the open repairs only, completed repairs pile up without growing these
+        Index("ix_repairs_pending_created_at", "created_at", "id", postgresql_where=text(REPAIR_BOARD_STATUSES[Status.PENDING])),
+        Index("ix_repairs_in_progress_created_at", "created_at", "id", postgresql_where=text(REPAIR_BOARD_STATUSES[Status.IN_PROGRESS])),
+    )
+
 #"/customers/customer_id/services/service_id/items"
 class ItemRequest(Base):
     __tablename__ = "item_requests"
@@ -116,6 +146,46 @@ class ItemRequest(Base):
 
     __table_args__ = (
         UniqueConstraint('request_id', 'product_variant_id', name='unique_request_variant'),    #each combination will only appear once
+        Index("ix_item_requests_request_id_id", "request_id", "id"),    #GET .../services/{service_id}/items/
+        Index("ix_item_requests_product_variant_id", "product_variant_id"),    #ON DELETE CASCADE from product_variants
         CheckConstraint('quantity > 0', name="check_positive_quantity"),
         CheckConstraint('unit_price >= 0', name="check_positive_price")
-    )
\ No newline at end of file
+    )
+
+#/login, /token/refresh - refresh tokens are stored as the SHA-256 of the token, see oauth2.py
+class RefreshToken(Base):
+    __tablename__ = "refresh_tokens"
+
+    id = Column(Integer, primary_key=True, nullable=False)
+    customer_id = Column(Integer, ForeignKey("customers.id", ondelete="CASCADE"), nullable=False)
+    token_hash = Column(String, nullable=False)
+    created_at = Column(TIMESTAMP(timezone=True), nullable=False, server_default=text('now()'))
+    expires_at = Column(TIMESTAMP(timezone=True), nullable=False)
+    revoked_at = Column(TIMESTAMP(timezone=True), nullable=True)    #set when the token is rotated or revoked
+
+    __table_args__ = (
+        UniqueConstraint('token_hash', name="unique_refresh_token_hash"),    #lookup of the presented token
+        Index("ix_refresh_tokens_customer_id", "customer_id"),    #revocation of every token of a customer, ON DELETE CASCADE
+    )
+
+#/analytics - sales per day and variant, refreshed from item_requests for the days in sales_dirty_days, see analytics.py
+class SalesDailyRollup(Base):
+    __tablename__ = "sales_daily_rollup"
+
+    day = Column(Date, primary_key=True, nullable=False)
+    product_variant_id = Column(Integer, primary_key=True, nullable=False)    #no foreign key, a deleted variant leaves with the next refresh
+    product_id = Column(Integer, nullable=False)
+    quantity = Column(BigInteger, nullable=False)
+    revenue = Column(Float, nullable=False)
+    items = Column(Integer, nullable=False)
+
+    __table_args__ = (
+        Index("ix_sales_daily_rollup_product_id_day", "product_id", "day"),    #GET /analytics/variants?product_id=
+    )
+
+#days whose rollup is out of date, appended by triggers on item_requests and service_requests (migration 0007)
+class SalesDirtyDay(Base):
+    __tablename__ = "sales_dirty_days"
+
+    id = Column(BigInteger, Identity(), primary_key=True)
+    day = Column(Date, nullable=False)
@@ -1,9 +1,21 @@
+import argparse
+import asyncio
+import hashlib
+import json
+import secrets
+import threading
+import time
+from collections import OrderedDict
 from jose import JWTError, jwt
 from fastapi import Depends, status, HTTPException
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import select, update, delete, func
+from sqlalchemy.ext.asyncio import AsyncSession
 from .body import TokenData
+from . import models
 from fastapi.security import OAuth2PasswordBearer
 from .config import settings
+from .database import SessionLocal, engine
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
 
@@ -13,33 +25,227 @@ ALGORITHM = settings.algorithm
 
 ACCESS_TOKEN_EXPIRE_MINUTES = settings.token_minutes
 
+REFRESH_TOKEN_EXPIRE_DAYS = settings.refresh_token_days
+
 def create_token(data: dict):
     #create a copy of data
     to_encode = data.copy()
 
-    expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    to_encode.update({"exp": expire})
+    #iat - compared with revoke_customer, tokens issued before a revocation are refused.
+    #A float timestamp rather than whole seconds, so a login right after a revocation isn't refused with it.
+    now = datetime.utcnow()
+    expire = now + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+    to_encode.update({"exp": expire, "iat": time.time()})
 
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
     return encoded_jwt
 
+
+#Decoded token cache.
+#A client reuses its token for every request until it expires, so the signature check of jwt.decode runs once per token
+#and the TokenData is kept until the token's exp. Keyed by the SHA-256 of the token, the token itself isn't kept in memory.
+#Bounded LRU, get_current_user is a sync dependency run in the threadpool, so it is guarded by a lock.
+#
+#Revocation is per worker process: evict_token drops one token's entry, revoke_customer refuses every token of a customer
+#issued up to now (cached or not) until they expire. Other workers keep accepting those access tokens until their exp
+#(token_minutes), only the refresh tokens are revoked for every worker (in the database).
+#A revocation is dropped once token_seconds have passed, every token it refuses has expired by then.
+class TokenCache:
+    def __init__(self, max_entries: int, token_seconds: float):
+        self.max_entries = max_entries
+        self.token_seconds = token_seconds
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()    #token digest -> (exp, issued_at, TokenData), least recently used first
+        self.revoked = {}               #customer id -> tokens issued at or before this timestamp are refused
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: bytes):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            exp, issued_at, token_data = entry
+            if exp <= time.time() or self.is_revoked(token_data.id, issued_at):
+                del self.entries[key]
+                self.misses += 1
+                return None
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return token_data
+
+    def set(self, key: bytes, exp: float, issued_at: float, token_data: TokenData):
+        with self.lock:
+            self.entries[key] = (exp, issued_at, token_data)
+            self.entries.move_to_end(key)
+
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def evict(self, key: bytes):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def revoke_customer(self, customer_id: int):
+        with self.lock:
+            now = time.time()
+            for expired in [id for id, revoked_at in self.revoked.items() if revoked_at < now - self.token_seconds]:
+                del self.revoked[expired]
+
+            self.revoked[customer_id] = now
+            for key in [key for key, entry in self.entries.items() if entry[2].id == customer_id]:
+                del self.entries[key]
+
+    #called with the lock held
+    def is_revoked(self, customer_id: int, issued_at: float):
+        revoked_at = self.revoked.get(customer_id)
+        return revoked_at is not None and (issued_at is None or issued_at <= revoked_at)
+
+
+token_cache = TokenCache(max_entries=settings.token_cache_max_entries, token_seconds=ACCESS_TOKEN_EXPIRE_MINUTES * 60)
+
+
+def token_digest(token: str):
+    return hashlib.sha256(token.encode()).digest()
+
+
+#eviction hook - the token is decoded and checked again on its next use
+def evict_token(token: str):
+    token_cache.evict(token_digest(token))
+
+
+#revocation hook - every token issued to the customer so far is refused
+def revoke_customer(customer_id: int):
+    token_cache.revoke_customer(customer_id)
+
+
 def verify_token(token, credentials_exception):
+    key = token_digest(token)
+    cached = token_cache.get(key)
+    if cached is not None:
+        return cached
+
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         #user_id from login.py access toekn
         id = payload.get("user_id")
         if not id:
             raise credentials_exception
-        
+
     except JWTError as e:
         raise credentials_exception
-    
-    return TokenData(id=id)
+
+    issued_at = payload.get("iat")
+    with token_cache.lock:
+        revoked = token_cache.is_revoked(id, issued_at)
+    if revoked:
+        raise credentials_exception
+
+    token_data = TokenData(id=id)
+
+    #jwt.decode has checked exp, a token without one isn't cached
+    if payload.get("exp"):
+        token_cache.set(key, payload["exp"], issued_at, token_data)
+
+    return token_data
 
 def get_current_user(token = Depends(oauth2_scheme)):
     credentias_exception = HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
                                          detail="Could not validate credentials",
                                          headers={"WWW-Authenticate": "Bearer"})
 
-    return verify_token(token, credentias_exception)
\ No newline at end of file
+    return verify_token(token, credentias_exception)
+
+
+#Refresh tokens.
+#/login hands out a refresh token along with the access token, /token/refresh trades it for a new pair without the
+#password (and bcrypt). Each refresh token is used once: it is revoked by the refresh that rotates it.
+#A revoked token presented again means it was copied, every refresh token of the customer is revoked and their access
+#tokens are refused by this worker (revoke_customer), the customer has to log in again once those expire.
+#Refresh tokens are random, not JWTs, and only their SHA-256 is stored.
+#Expired rows are deleted - the customer's own at each rotation, everyone's with the purge command (e.g. from cron).
+#An expired token is refused either way, it just no longer counts as a reuse.
+#
+#   python -m app.oauth2 purge      deletes every expired refresh token
+
+def refresh_token_hash(token: str):
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+#adds the refresh token to the session, the caller commits
+def create_refresh_token(db: AsyncSession, customer_id: int):
+    token = secrets.token_urlsafe(32)
+    db.add(models.RefreshToken(
+        customer_id=customer_id,
+        token_hash=refresh_token_hash(token),
+        expires_at=datetime.now(timezone.utc) + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)
+    ))
+    return token
+
+
+#revokes the refresh token and returns its customer id, the caller issues the new pair and commits
+async def rotate_refresh_token(db: AsyncSession, token: str, credentials_exception):
+    token_hash = refresh_token_hash(token)
+
+    #UPDATE refresh_tokens SET revoked_at = now() WHERE token_hash = ... AND revoked_at IS NULL AND expires_at > now() RETURNING customer_id
+    #two refreshes racing with the same token - only one of them gets the row
+    customer_id = await db.scalar(update(models.RefreshToken).where(
+        models.RefreshToken.token_hash == token_hash,
+        models.RefreshToken.revoked_at.is_(None),
+        models.RefreshToken.expires_at > func.now()
+        ).values(revoked_at=func.now()).returning(models.RefreshToken.customer_id).execution_options(synchronize_session=False))
+    if customer_id:
+        await purge_refresh_tokens(db, customer_id)
+        return customer_id
+
+    #reuse of a rotated or revoked token
+    reused_by = await db.scalar(select(models.RefreshToken.customer_id).where(
+        models.RefreshToken.token_hash == token_hash,
+        models.RefreshToken.revoked_at.is_not(None)
+        ))
+    if reused_by:
+        await revoke_refresh_tokens(db, reused_by)
+        await db.commit()
+
+    raise credentials_exception
+
+
+#bulk revocation - every refresh token of the customer, and the access tokens issued so far
+async def revoke_refresh_tokens(db: AsyncSession, customer_id: int):
+    await db.execute(update(models.RefreshToken).where(
+        models.RefreshToken.customer_id == customer_id,
+        models.RefreshToken.revoked_at.is_(None)
+        ).values(revoked_at=func.now()).execution_options(synchronize_session=False))
+    revoke_customer(customer_id)
+
+
+#DELETE FROM refresh_tokens WHERE expires_at < now() - of one customer (ix_refresh_tokens_customer_id), or of everyone
+async def purge_refresh_tokens(db: AsyncSession, customer_id: int = None):
+    purge_query = delete(models.RefreshToken).where(models.RefreshToken.expires_at < func.now())
+    if customer_id is not None:
+        purge_query = purge_query.where(models.RefreshToken.customer_id == customer_id)
+
+    return (await db.execute(purge_query.execution_options(synchronize_session=False))).rowcount
+
+
+async def main():
+    try:
+        async with SessionLocal() as db:
+            purged = await purge_refresh_tokens(db)
+            await db.commit()
+    finally:
+        await engine.dispose()
+
+    print(json.dumps({"purged_refresh_tokens": purged}, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Delete the expired refresh tokens")
+    parser.add_argument("command", choices=["purge"])
+    parser.parse_args()
+
+    asyncio.run(main())
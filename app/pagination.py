@@ -0,0 +1,62 @@
+import base64
+import json
+from datetime import datetime
+from fastapi import status, HTTPException, Response
+from sqlalchemy import tuple_
+
+#Keyset (cursor) pagination for the list endpoints.
+#The cursor wraps the sort key of the last row of a page, so the next page is an index range scan
+#(WHERE (key) > (last key) ORDER BY key LIMIT n) instead of an OFFSET or a full .all() of the table.
+
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+
+#response header carrying the opaque cursor of the next page, missing on the last page
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def encode_cursor(values):
+    payload = [value.isoformat() if isinstance(value, datetime) else value for value in values]
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode()
+
+
+def decode_cursor(cursor: str, keys):
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if not isinstance(payload, list) or len(payload) != len(keys):
+            raise ValueError(cursor)
+
+        #every value must already be of its key's type - ["x"] or [1.5] for an Integer key is refused, not converted
+        values = []
+        for key, value in zip(keys, payload):
+            python_type = key.type.python_type
+            if python_type is datetime:
+                value = datetime.fromisoformat(value)
+            else:
+                coerced = python_type(value)
+                if isinstance(value, bool) or coerced != value:
+                    raise ValueError(value)
+                value = coerced
+            values.append(value)
+        return values
+
+    except (ValueError, TypeError):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid pagination cursor"
+        )
+
+
+#keys - columns of the sort key, e.g. (models.Customer.id,), the last one must be unique
+async def paginate(db, query, keys, limit: int, cursor: str, response: Response):
+    if cursor:
+        query = query.where(tuple_(*keys) > tuple_(*decode_cursor(cursor, keys)))
+
+    #fetch one extra row to know if there is a next page
+    rows = (await db.scalars(query.order_by(*keys).limit(limit + 1))).all()
+
+    if len(rows) > limit:
+        rows = rows[:limit]
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor([getattr(rows[-1], key.key) for key in keys])
+
+    return rows
@@ -0,0 +1,82 @@
+import threading
+import time
+from sqlalchemy import exc
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+#Connection pool metrics, reported by GET /metrics/pool
+
+#upper bounds in seconds of the checkout wait-time histogram buckets
+WAIT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+class PoolMetrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.buckets = [0] * len(WAIT_BUCKETS)
+        self.count = 0
+        self.total_wait = 0.0
+        self.timeouts = 0
+
+    def observe(self, seconds: float):
+        with self.lock:
+            self.count += 1
+            self.total_wait += seconds
+            for i, bound in enumerate(WAIT_BUCKETS):
+                if seconds <= bound:
+                    self.buckets[i] += 1
+                    break
+
+    def timeout(self):
+        with self.lock:
+            self.timeouts += 1
+
+    #cumulative buckets, the same shape as a Prometheus histogram
+    def histogram(self):
+        with self.lock:
+            buckets = {}
+            running = 0
+            for bound, count in zip(WAIT_BUCKETS, self.buckets):
+                running += count
+                buckets[str(bound)] = running
+            buckets["+Inf"] = self.count
+
+            return {
+                "buckets": buckets,
+                "count": self.count,
+                "sum": self.total_wait,
+                "timeouts": self.timeouts
+            }
+
+metrics = PoolMetrics()
+
+
+#QueuePool that records how long each checkout waited for a free connection
+class TimedQueuePool(AsyncAdaptedQueuePool):
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except exc.TimeoutError:
+            metrics.timeout()
+            raise
+
+        metrics.observe(time.perf_counter() - start)
+        return connection
+
+
+def pool_status(engine):
+    pool = engine.sync_engine.pool
+
+    #NullPool (PgBouncer mode) keeps no connections of its own
+    if not isinstance(pool, QueuePool):
+        return {"pool": type(pool).__name__}
+
+    return {
+        "pool": type(pool).__name__,
+        "size": pool.size(),
+        "checked_out": pool.checkedout(),
+        "idle": pool.checkedin(),
+        #overflow() counts down from -size while the pool is still filling up
+        "overflow": max(pool.overflow(), 0),
+        "max_overflow": pool._max_overflow,
+        "checkout_wait_seconds": metrics.histogram()
+    }
@@ -0,0 +1,60 @@
+from datetime import datetime
+from typing import Optional
+from fastapi import status, HTTPException
+from .models import Status
+
+#Repair status state machine.
+#A transition sets the repair's dates from the status it leaves and the one it enters. Reverting a status (a misinput)
+#is a transition too, it clears the dates of the status it undoes.
+#
+#The routers apply a transition as one conditional UPDATE guarded by the status it was computed from and the repair's version,
+#which the UPDATE increments (routers/repair.py write_repair). A repair changed in between matches no row and the write
+#fails with 409 instead of overwriting the other change.
+
+#allowed target statuses of each status
+TRANSITIONS = {
+    Status.PENDING: {Status.IN_PROGRESS, Status.COMPLETED},
+    Status.IN_PROGRESS: {Status.PENDING, Status.COMPLETED},
+    Status.COMPLETED: {Status.PENDING, Status.IN_PROGRESS},
+}
+
+
+#date columns of a repair entering new_status at now
+def entered(new_status: Status, now: datetime):
+    if new_status == Status.PENDING:
+        return {"start_date": None, "finished_date": None}
+    if new_status == Status.IN_PROGRESS:
+        return {"start_date": now, "finished_date": None}
+    return {"finished_date": now}
+
+
+#values of a new repair
+def created(repair_data: dict):
+    new_status = repair_data.get("status") or Status.PENDING
+    if new_status == Status.PENDING:
+        return repair_data
+    return {**repair_data, **entered(new_status, datetime.utcnow())}
+
+
+#values of an update of a repair currently in old_status - repair_data with the dates of the transition, if its status changes
+def transition(old_status: Status, repair_data: dict, repair_id: int):
+    new_status = repair_data.get("status")
+    if new_status is None or new_status == old_status:
+        return repair_data
+
+    if new_status not in TRANSITIONS[old_status]:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"Repair with id {repair_id} can't go from {old_status.value} to {new_status.value}"
+        )
+
+    return {**repair_data, **entered(new_status, datetime.utcnow())}
+
+
+#the version the client read doesn't match, or the repair changed between the read and the guarded UPDATE
+def conflict(repair_id: int, version: Optional[int] = None):
+    detail = f"Repair with id {repair_id} was modified by another request"
+    if version is not None:
+        detail = f"{detail}, its current version is {version}"
+
+    return HTTPException(status_code=status.HTTP_409_CONFLICT, detail=detail)
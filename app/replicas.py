@@ -0,0 +1,120 @@
+import asyncio
+import itertools
+import time
+from fastapi import Depends, Request
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+from .config import settings
+from .database import SessionLocal, get_db, replica_engines
+from .instrumentation import current_stats
+
+#Read replica routing.
+#GET/HEAD requests that use get_read_db instead of get_db are served by the replicas in settings.database_replica_urls,
+#taken in turn. Everything else stays on the primary:
+#   - writes, and the lookups they depend on (get_read_db hands back the request's get_db session for them)
+#   - clients that wrote in the last settings.database_replica_pin_seconds, marked by the PIN_COOKIE the
+#     replica_pin middleware sets on successful writes, so they read their own changes
+#   - every GET, when no replica is within settings.database_replica_max_lag_seconds of the primary or reachable
+#
+#Replication lag is checked at most every settings.database_replica_check_seconds per replica. A server that isn't
+#a standby (pg_is_in_recovery() is false) counts as caught up, so routing can be tried locally against
+#two independent PostgreSQL instances, and the fallback with database_replica_max_lag_seconds set below 0.
+
+PIN_COOKIE = "read_primary"
+
+SAFE_METHODS = ("GET", "HEAD")
+
+#seconds behind the primary:
+#   0 for a server that isn't a standby
+#   0 for a standby with a running WAL receiver that has replayed everything it received, so an idle primary doesn't
+#     look like lag - a standby whose receiver is gone has replayed everything it received too, but is falling behind
+#   the age of the last replayed transaction otherwise, Infinity for a standby that never received or replayed any
+LAG_QUERY = text("""
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_receive_lsn() IS NOT NULL
+            AND pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn()
+            AND EXISTS (SELECT 1 FROM pg_stat_wal_receiver) THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())::float8, 'Infinity'::float8)
+    END
+""")
+
+
+class Replica:
+    def __init__(self, engine):
+        self.engine = engine
+        self.sessions = async_sessionmaker(bind=engine, autoflush=False, expire_on_commit=False)
+        self.lock = asyncio.Lock()
+        self.checked_at = None
+        self.lag = None     #seconds, None when the replica couldn't be reached
+
+    async def check_lag(self):
+        #not one of the request's statements, kept out of its Server-Timing and query budget
+        token = current_stats.set(None)
+        try:
+            async with self.engine.connect() as connection:
+                lag = await connection.scalar(LAG_QUERY)
+            self.lag = float(lag or 0)
+        except Exception as e:
+            print(f"Replica check failed {e}")
+            self.lag = None
+        finally:
+            current_stats.reset(token)
+            self.checked_at = time.monotonic()
+
+    async def usable(self):
+        if self.checked_at is None or time.monotonic() - self.checked_at >= settings.database_replica_check_seconds:
+            async with self.lock:
+                #another request may have checked while this one waited for the lock
+                if self.checked_at is None or time.monotonic() - self.checked_at >= settings.database_replica_check_seconds:
+                    await self.check_lag()
+
+        return self.lag is not None and self.lag <= settings.database_replica_max_lag_seconds
+
+
+replicas = [Replica(engine) for engine in replica_engines]
+turns = itertools.cycle(range(len(replicas)))
+
+
+#the next replica in turn that is caught up, None for the primary
+async def pick_replica(request: Request):
+    if not replicas or request.method not in SAFE_METHODS or request.cookies.get(PIN_COOKIE):
+        return None
+
+    start = next(turns)
+    for offset in range(len(replicas)):
+        replica = replicas[(start + offset) % len(replicas)]
+        if await replica.usable():
+            return replica
+
+    return None
+
+
+#get_db for read-only handlers and the lookups they depend on
+async def get_read_db(request: Request, db: AsyncSession = Depends(get_db)):
+    replica = await pick_replica(request)
+    if replica is None:
+        #the request's primary session, shared with the handler on writes
+        yield db
+        return
+
+    async with replica.sessions() as replica_db:
+        #checked by cache.store, replica reads may be behind the primary
+        replica_db.info["replica"] = True
+        yield replica_db
+
+
+#session factory for reads that open their own session instead of the request's (the export stream), picked like get_read_db
+async def read_sessions(request: Request):
+    replica = await pick_replica(request)
+    return SessionLocal if replica is None else replica.sessions
+
+
+#HTTP middleware, registered in main.py - pins the client to the primary after a successful write
+async def replica_pin(request: Request, call_next):
+    response = await call_next(request)
+
+    if replicas and request.method not in SAFE_METHODS and response.status_code < 400:
+        response.set_cookie(PIN_COOKIE, "1", max_age=settings.database_replica_pin_seconds, httponly=True, samesite="lax")
+
+    return response
@@ -1,6 +1,7 @@
-from pydantic import BaseModel, EmailStr
-from typing import Optional, List
-from datetime import datetime
+from fastapi import Response
+from pydantic import BaseModel, ConfigDict, EmailStr, TypeAdapter
+from typing import Optional, List, Literal
+from datetime import datetime, date
 from .models import ServiceCreate, Status
 
 #PYDANTIC validators
@@ -13,8 +14,7 @@ class BaseCustomerResponse(BaseModel):
     address: str
     created_at: datetime
 
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
 
 class BaseServiceResponse(BaseModel):
     id: int
@@ -23,8 +23,7 @@ class BaseServiceResponse(BaseModel):
     total_cost: Optional[float] = 0
     date: datetime
 
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
 
 class BaseProductResponse(BaseModel):
     id: int
@@ -34,8 +33,7 @@ class BaseProductResponse(BaseModel):
     stock_quantity: int
     created_at: datetime
 
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
 
 class BaseVariantResponse(BaseModel):
     id: int
@@ -44,8 +42,7 @@ class BaseVariantResponse(BaseModel):
     color: str
     stock_quantity: int
 
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
 
 class BaseRepairResponse(BaseModel):
     id: int
@@ -55,9 +52,9 @@ class BaseRepairResponse(BaseModel):
     created_at: datetime
     start_date: Optional[datetime] = None
     finished_date: Optional[datetime] = None
+    version: int = 0
 
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
 
 class BaseItemRequestResponse(BaseModel):
     id: int
@@ -67,8 +64,7 @@ class BaseItemRequestResponse(BaseModel):
     unit_price: float
     created_at: datetime
 
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
 
 #Response model filtering
 class CustomerResponse(BaseModel):
@@ -79,8 +75,7 @@ class CustomerResponse(BaseModel):
     created_at: datetime
     services: Optional[List[BaseServiceResponse]] = []
 
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
 
 class ServiceResponse(BaseModel):
     id: int
@@ -92,8 +87,7 @@ class ServiceResponse(BaseModel):
     repairs: Optional[List[BaseRepairResponse]] = []
     items: Optional[List[BaseItemRequestResponse]] = []
 
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
 
 class ProductResponse(BaseModel):
     id: int
@@ -104,8 +98,7 @@ class ProductResponse(BaseModel):
     created_at: datetime
     variants: Optional[List[BaseVariantResponse]] = []
 
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
 
 class VariantResponse(BaseModel):
     id: int
@@ -115,8 +108,7 @@ class VariantResponse(BaseModel):
     stock_quantity: int
     product: BaseProductResponse    #uses BaseProductResponse as a response model
 
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
 
 class RepairResponse(BaseModel):
     id: int
@@ -126,10 +118,10 @@ class RepairResponse(BaseModel):
     created_at: datetime
     start_date: Optional[datetime] = None
     finished_date: Optional[datetime] = None
+    version: int = 0
     service: BaseServiceResponse    #uses BaseServiceResponse as a response model
 
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
 
 class ItemRequestResponse(BaseModel):
     id: int
@@ -140,6 +132,78 @@ class ItemRequestResponse(BaseModel):
     created_at: datetime
     service: BaseServiceResponse    #uses BaseServiceResponse as a response model
 
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
 
+#Bulk item request results, one per row of the request body in the same order
+class BulkItemRequestResult(BaseModel):
+    index: int
+    status: Literal["created", "conflict", "invalid", "insufficient_stock"]
+    item: Optional[BaseItemRequestResponse] = None
+    detail: Optional[str] = None
+
+
+#Catalog import report
+class CatalogMergeCounts(BaseModel):
+    inserted: int
+    updated: int
+
+class CatalogReject(BaseModel):
+    line: int
+    reason: str
+
+class CatalogImportResponse(BaseModel):
+    rows: int
+    products: CatalogMergeCounts
+    variants: CatalogMergeCounts
+    rejected: int
+    rejects: List[CatalogReject] = []
+
+
+
+#Sales analytics
+class DailySales(BaseModel):
+    day: date
+    quantity: int
+    revenue: float
+    items: int
+
+    model_config = ConfigDict(from_attributes=True)
+
+class ProductSales(BaseModel):
+    product_id: int
+    name: str
+    quantity: int
+    revenue: float
+
+    model_config = ConfigDict(from_attributes=True)
+
+class VariantSales(BaseModel):
+    product_variant_id: int
+    product_id: int
+    name: str
+    size: str
+    color: str
+    quantity: int
+    revenue: float
+
+    model_config = ConfigDict(from_attributes=True)
+
+
+#Prebuilt serializers of the GET responses (customers and services have theirs in fieldsets.py).
+#render validates the ORM rows once and dumps them straight to JSON bytes in pydantic-core,
+#instead of FastAPI's validate, dump to Python objects and encode again.
+PRODUCT_LIST = TypeAdapter(List[ProductResponse])
+PRODUCT = TypeAdapter(ProductResponse)
+VARIANT_LIST = TypeAdapter(List[VariantResponse])
+REPAIR_LIST = TypeAdapter(List[RepairResponse])
+ITEM_LIST = TypeAdapter(List[ItemRequestResponse])
+
+
+def dump(adapter: TypeAdapter, data):
+    return adapter.dump_json(adapter.validate_python(data))
+
+
+#response - the handler's Response parameter, its headers (pagination cursor, ETag) are kept
+def render(adapter: TypeAdapter, data, response: Response = None):
+    headers = dict(response.headers) if response is not None else None
+    return Response(content=dump(adapter, data), media_type="application/json", headers=headers)
@@ -0,0 +1,77 @@
+import enum
+from datetime import date
+from fastapi import APIRouter, Depends, Query
+from sqlalchemy import select, func, cast, BigInteger
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Optional
+from .. import models
+from ..replicas import get_read_db
+from ..response import DailySales, ProductSales, VariantSales
+from ..instrumentation import query_budget
+
+#Sales analytics, aggregated by PostgreSQL from the daily rollup (analytics.py) instead of item_requests.
+#Figures are as of the last refresh of the rollup, settings.analytics_refresh_seconds at most.
+#date_from/date_to - day range of the sales (UTC), date_to excluded
+
+router = APIRouter(
+    prefix="/analytics",
+    tags=["Analytics"]
+)
+
+#rows returned by the per product/variant rankings
+DEFAULT_TOP = 10
+MAX_TOP = 1000
+
+class SalesOrder(enum.Enum):
+    revenue = "revenue"
+    quantity = "quantity"
+
+Rollup = models.SalesDailyRollup
+
+QUANTITY = cast(func.sum(Rollup.quantity), BigInteger).label("quantity")
+REVENUE = func.sum(Rollup.revenue).label("revenue")
+
+
+def in_range(query, date_from: Optional[date], date_to: Optional[date]):
+    if date_from:
+        query = query.where(Rollup.day >= date_from)
+    if date_to:
+        query = query.where(Rollup.day < date_to)
+    return query
+
+
+#ORDER BY revenue or quantity DESC, the id breaks ties so the ranking is stable
+def ranked(query, order: SalesOrder, id_column, top: int):
+    column = REVENUE if order == SalesOrder.revenue else QUANTITY
+    return query.order_by(column.desc(), id_column).limit(top)
+
+
+@router.get("/daily", response_model=List[DailySales], dependencies=[Depends(query_budget(1))])
+async def get_daily_sales(date_from: Optional[date] = None, date_to: Optional[date] = None, db: AsyncSession = Depends(get_read_db)):
+    query = select(Rollup.day, QUANTITY, REVENUE, cast(func.sum(Rollup.items), BigInteger).label("items")).group_by(Rollup.day).order_by(Rollup.day)
+    return (await db.execute(in_range(query, date_from, date_to))).all()
+
+
+#top sellers - ?order=quantity for units sold
+@router.get("/products", response_model=List[ProductSales], dependencies=[Depends(query_budget(1))])
+async def get_product_sales(date_from: Optional[date] = None, date_to: Optional[date] = None, order: SalesOrder = SalesOrder.revenue,
+                            top: int = Query(DEFAULT_TOP, ge=1, le=MAX_TOP), db: AsyncSession = Depends(get_read_db)):
+    query = (select(Rollup.product_id, models.Product.name, QUANTITY, REVENUE)
+        .join(models.Product, models.Product.id == Rollup.product_id)
+        .group_by(Rollup.product_id, models.Product.name))
+    return (await db.execute(ranked(in_range(query, date_from, date_to), order, Rollup.product_id, top))).all()
+
+
+@router.get("/variants", response_model=List[VariantSales], dependencies=[Depends(query_budget(1))])
+async def get_variant_sales(date_from: Optional[date] = None, date_to: Optional[date] = None, product_id: Optional[int] = None,
+                            order: SalesOrder = SalesOrder.revenue, top: int = Query(DEFAULT_TOP, ge=1, le=MAX_TOP), db: AsyncSession = Depends(get_read_db)):
+    query = (select(Rollup.product_variant_id, Rollup.product_id, models.Product.name, models.ProductVariant.size, models.ProductVariant.color, QUANTITY, REVENUE)
+        .join(models.ProductVariant, models.ProductVariant.id == Rollup.product_variant_id)
+        .join(models.Product, models.Product.id == Rollup.product_id)
+        .group_by(Rollup.product_variant_id, Rollup.product_id, models.Product.name, models.ProductVariant.size, models.ProductVariant.color))
+
+    #ix_sales_daily_rollup_product_id_day
+    if product_id:
+        query = query.where(Rollup.product_id == product_id)
+
+    return (await db.execute(ranked(in_range(query, date_from, date_to), order, Rollup.product_variant_id, top))).all()
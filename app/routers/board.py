@@ -0,0 +1,33 @@
+from fastapi import APIRouter, status, Depends, HTTPException, Query, Response
+from sqlalchemy import select, text
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Optional
+from .. import models, loaders
+from ..replicas import get_read_db
+from ..response import RepairResponse, REPAIR_LIST, render
+from ..pagination import paginate, DEFAULT_LIMIT, MAX_LIMIT
+from ..instrumentation import query_budget
+
+#Shop-wide repair work board - the open repairs of every customer, oldest first
+
+router = APIRouter(
+    prefix="/repairs",
+    tags=["Repair Board"]
+)
+
+
+@router.get("/", response_model=List[RepairResponse], dependencies=[Depends(query_budget(1))])
+async def get_repair_board(response: Response, repair_status: models.Status = Query(models.Status.PENDING, alias="status"), limit: int = Query(DEFAULT_LIMIT, ge=1, le=MAX_LIMIT),
+                           cursor: Optional[str] = None, db: AsyncSession = Depends(get_read_db)):
+    #completed repairs have no index ordered by created_at, there are far too many of them to sort on each request
+    if repair_status not in models.REPAIR_BOARD_STATUSES:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"The repair board lists {' and '.join(board_status.value for board_status in models.REPAIR_BOARD_STATUSES)} repairs"
+        )
+
+    #WHERE status = '...' ORDER BY created_at, id - a range scan of ix_repairs_pending_created_at / ix_repairs_in_progress_created_at
+    query = select(models.Repair).options(*loaders.REPAIR_RESPONSE).where(text(f"repairs.{models.REPAIR_BOARD_STATUSES[repair_status]}"))
+    repairs = await paginate(db, query, (models.Repair.created_at, models.Repair.id), limit, cursor, response)
+
+    return render(REPAIR_LIST, repairs, response)
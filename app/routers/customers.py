@@ -1,112 +1,164 @@
-from fastapi import status, HTTPException, Depends, APIRouter
-from sqlalchemy.orm import Session
+from fastapi import status, HTTPException, Depends, APIRouter, Query, Response
+from sqlalchemy import select, update, delete
+from sqlalchemy.ext.asyncio import AsyncSession
 from ..database import get_db
-from .. import models, utils
+from ..replicas import get_read_db
+from .. import models, utils, loaders, inventory, aggregates, fieldsets
 from ..body import Customer, TokenData
 from ..update import CustomerPatch, CustomerPut
 from ..response import CustomerResponse
-from typing import List
+from typing import List, Optional
+from datetime import datetime
 from ..oauth2 import get_current_user
-from ..status_code import validate_customer_exists, validate_customer_ownership, exception
+from ..status_code import validate_customer_exists, exception
+from ..pagination import paginate, DEFAULT_LIMIT, MAX_LIMIT
+from ..instrumentation import query_budget
+from ..dependencies import explain_customer_write
 
 router = APIRouter(
     prefix="/customers",
     tags=["Customers"]
 )
 
-@router.get("/", response_model=List[CustomerResponse])
-def get_customers(db: Session = Depends(get_db)):
-    post = db.query(models.Customer).all()
-    return post
+@router.get("/", response_model=List[CustomerResponse], dependencies=[Depends(query_budget(2))])
+async def get_customers(response: Response, limit: int = Query(DEFAULT_LIMIT, ge=1, le=MAX_LIMIT), cursor: Optional[str] = None,
+                        created_after: Optional[datetime] = None, created_before: Optional[datetime] = None,
+                        fields: Optional[str] = None, include: Optional[str] = None, db: AsyncSession = Depends(get_read_db)):
+    #?fields= and ?include= select the columns and relationships that are loaded, see fieldsets.py
+    fieldset = fieldsets.CUSTOMER.parse(fields, include)
+    query = select(models.Customer).options(*fieldset.options())
+
+    #created_at range filter (ix_customers_created_at)
+    if created_after:
+        query = query.where(models.Customer.created_at >= created_after)
+    if created_before:
+        query = query.where(models.Customer.created_at < created_before)
+
+    post = await paginate(db, query, (models.Customer.id,), limit, cursor, response)
+    return fieldset.render_list(post, response)
 
 
 @router.post("/", status_code=status.HTTP_201_CREATED, response_model=CustomerResponse)
-def create_customer(customer: Customer, db: Session = Depends(get_db)):
+async def create_customer(customer: Customer, db: AsyncSession = Depends(get_db)):
     try:
-        #hash password
-        customer.password = utils.hash(customer.password)
-        
-        customer = models.Customer(**customer.dict())
+        #hash password, bcrypt is CPU bound so it runs in the password pool (utils.py)
+        customer.password = await utils.hash_password(customer.password)
+
+        customer = models.Customer(**customer.model_dump())
         db.add(customer)
-        db.commit()
-        db.refresh(customer)
-        return customer
+        await db.commit()
+        return await loaders.reload(db, models.Customer, customer.id, loaders.CUSTOMER_RESPONSE)
 
     except HTTPException as http_error:
         raise http_error
-    
+
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         exception(e)
 
 
-@router.get("/{id}", response_model=CustomerResponse)
-def get_customer(id: int, db: Session = Depends(get_db)):
-    customer = db.query(models.Customer).filter(models.Customer.id == id).first()
+@router.get("/{id}", response_model=CustomerResponse, dependencies=[Depends(query_budget(2))])
+async def get_customer(id: int, fields: Optional[str] = None, include: Optional[str] = None, db: AsyncSession = Depends(get_read_db)):
+    fieldset = fieldsets.CUSTOMER.parse(fields, include)
+    customer = await db.scalar(select(models.Customer).options(*fieldset.options()).where(models.Customer.id == id))
 
     validate_customer_exists(customer, id)
-    
-    return customer
+
+    return fieldset.render(customer)
 
 
 @router.delete("/{id}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_customer(id: int, db: Session = Depends(get_db), current_user: TokenData = Depends(get_current_user)):
+async def delete_customer(id: int, db: AsyncSession = Depends(get_db), current_user: TokenData = Depends(get_current_user)):
     try:
-        delete_query = db.query(models.Customer).filter(models.Customer.id == id)
-        customer = delete_query.first()
-        validate_customer_exists(customer, id)
-        validate_customer_ownership(customer.id, current_user.id)
-
-        delete_query.delete(synchronize_session=False)
-        db.commit()
+        #the customer and its services are locked first, before the variants their items give stock back to
+        await aggregates.lock_deleted_rows(db, models.Customer, models.Customer.id == id, models.Customer.id == current_user.id)
+        await aggregates.lock_deleted_rows(db, models.ServiceRequest, models.ServiceRequest.customer_id == id, models.ServiceRequest.customer_id == current_user.id)
+
+        #the customer's services and their item requests go with it (ON DELETE CASCADE), the stock goes back to the variants
+        await inventory.restore_items_stock(db, models.ItemRequest.request_id.in_(
+            select(models.ServiceRequest.id).where(
+                models.ServiceRequest.customer_id == id,
+                models.ServiceRequest.customer_id == current_user.id
+            )))
+
+        #DELETE FROM customers WHERE id = id AND id = current_user.id RETURNING id
+        deleted = await db.scalar(delete(models.Customer).where(
+            models.Customer.id == id,
+            models.Customer.id == current_user.id
+            ).returning(models.Customer.id).execution_options(synchronize_session=False))
+        if not deleted:
+            await explain_customer_write(db, id, current_user.id)
+
+        await db.commit()
         return
-    
+
     except HTTPException as http_error:
         raise http_error
-    
+
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         exception(e)
 
 
 @router.put("/{id}", response_model=CustomerResponse)
-def update_customer(id: int, customer:CustomerPut, db: Session = Depends(get_db), current_user: TokenData = Depends(get_current_user)):
+async def update_customer(id: int, customer:CustomerPut, db: AsyncSession = Depends(get_db), current_user: TokenData = Depends(get_current_user)):
     try:
-        update_query = db.query(models.Customer).filter(models.Customer.id == id)
-        new_customer = update_query.first()
-        validate_customer_exists(new_customer, id)
-        validate_customer_ownership(new_customer.id, current_user.id)
-        
-        update_query.update(customer.dict(), synchronize_session=False)
-        db.commit()
+        #UPDATE customers SET ... WHERE id = id AND id = current_user.id RETURNING *
+        update_query = update(models.Customer).where(
+            models.Customer.id == id,
+            models.Customer.id == current_user.id
+            )
+
+        #404/403 for another customer before the password is hashed, so those requests don't take a password pool slot
+        if id != current_user.id:
+            await explain_customer_write(db, id, current_user.id)
 
-        return update_query.first()
+        customer_data = customer.model_dump()
+        customer_data["password"] = await utils.hash_password(customer_data["password"])
+
+        new_customer = await loaders.returning(db, update_query.values(customer_data).returning(models.Customer), loaders.CUSTOMER_RELATIONSHIPS)
+        if not new_customer:
+            await explain_customer_write(db, id, current_user.id)
+
+        await db.commit()
+        return new_customer
 
     except HTTPException as http_error:
         raise http_error
-    
+
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         exception(e)
 
 
 @router.patch("/{id}", response_model=CustomerResponse)
-def patch_customer(id: int, customer:CustomerPatch, db: Session = Depends(get_db), current_user: TokenData = Depends(get_current_user)):
+async def patch_customer(id: int, customer:CustomerPatch, db: AsyncSession = Depends(get_db), current_user: TokenData = Depends(get_current_user)):
     try:
-        patch_query = db.query(models.Customer).filter(models.Customer.id == id)
-        new_customer = patch_query.first()
-        validate_customer_exists(new_customer, id)
-        validate_customer_ownership(new_customer.id, current_user.id)
+        #UPDATE customers SET ... WHERE id = id AND id = current_user.id RETURNING *
+        patch_query = update(models.Customer).where(
+            models.Customer.id == id,
+            models.Customer.id == current_user.id
+            )
+
+        #404/403 for another customer before the password is hashed, so those requests don't take a password pool slot
+        if id != current_user.id:
+            await explain_customer_write(db, id, current_user.id)
 
         #exclude_unset - skips missing fields in updates
-        patch_query.update(customer.dict(exclude_unset=True), synchronize_session=False)
-        db.commit()
+        customer_data = customer.model_dump(exclude_unset=True)
+        if "password" in customer_data:
+            customer_data["password"] = await utils.hash_password(customer_data["password"])
+
+        new_customer = await loaders.returning(db, patch_query.values(customer_data).returning(models.Customer), loaders.CUSTOMER_RELATIONSHIPS)
+        if not new_customer:
+            await explain_customer_write(db, id, current_user.id)
+
+        await db.commit()
+        return new_customer
 
-        return patch_query.first()
-    
     except HTTPException as http_error:
         raise http_error
-    
+
     except Exception as e:
-        db.rollback()
-        exception(e)
\ No newline at end of file
+        await db.rollback()
+        exception(e)
@@ -0,0 +1,99 @@
+import csv
+import io
+import json
+import enum
+from datetime import datetime
+from fastapi import APIRouter, Request
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select
+from ..replicas import read_sessions
+from .. import models
+from ..response import BaseCustomerResponse, BaseServiceResponse, BaseItemRequestResponse, BaseRepairResponse
+
+#Full table dumps for accounting. Rows are read from a server-side cursor in batches of EXPORT_BATCH_SIZE
+#and written to the response as they arrive, so memory stays flat no matter how big the table is.
+#Like the other reads, they come from a replica when one is caught up (replicas.py), the primary otherwise.
+
+router = APIRouter(
+    prefix="/export",
+    tags=["Export"]
+)
+
+#rows fetched per round trip from the server-side cursor
+EXPORT_BATCH_SIZE = 1000
+
+class ExportTable(enum.Enum):
+    customers = "customers"
+    service_requests = "service_requests"
+    item_requests = "item_requests"
+    repairs = "repairs"
+
+class ExportFormat(enum.Enum):
+    ndjson = "ndjson"
+    csv = "csv"
+
+#table -> (table model, response schema whose fields are exported)
+EXPORTS = {
+    ExportTable.customers: (models.Customer, BaseCustomerResponse),
+    ExportTable.service_requests: (models.ServiceRequest, BaseServiceResponse),
+    ExportTable.item_requests: (models.ItemRequest, BaseItemRequestResponse),
+    ExportTable.repairs: (models.Repair, BaseRepairResponse),
+}
+
+MEDIA_TYPES = {
+    ExportFormat.ndjson: "application/x-ndjson",
+    ExportFormat.csv: "text/csv",
+}
+
+
+def to_plain(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, enum.Enum):
+        return value.value
+    return value
+
+
+#yields batches of rows holding only the columns of the response schema
+async def fetch_batches(sessions, model, fields):
+    #the request's session from get_db is closed before the body is streamed, so the export owns its session
+    async with sessions() as db:
+        query = select(*[getattr(model, field) for field in fields]).order_by(model.id)
+        result = await db.stream(query.execution_options(yield_per=EXPORT_BATCH_SIZE))
+        async for batch in result.partitions():
+            yield batch
+
+
+async def ndjson_lines(sessions, model, fields):
+    async for batch in fetch_batches(sessions, model, fields):
+        yield "".join(json.dumps(dict(zip(fields, map(to_plain, row)))) + "\n" for row in batch)
+
+
+async def csv_lines(sessions, model, fields):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(fields)
+
+    async for batch in fetch_batches(sessions, model, fields):
+        writer.writerows([map(to_plain, row) for row in batch])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate(0)
+
+    #header only, for an empty table
+    if buffer.getvalue():
+        yield buffer.getvalue()
+
+
+@router.get("/{table}")
+async def export_table(table: ExportTable, request: Request, format: ExportFormat = ExportFormat.ndjson):
+    model, schema = EXPORTS[table]
+    fields = list(schema.model_fields)
+
+    lines = ndjson_lines if format == ExportFormat.ndjson else csv_lines
+
+    return StreamingResponse(
+        lines(await read_sessions(request), model, fields),
+        media_type=MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="{table.value}.{format.value}"'}
+    )
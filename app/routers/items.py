@@ -1,213 +1,254 @@
-from fastapi import APIRouter, status, HTTPException, Depends
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, status, HTTPException, Depends, Query, Response
+from sqlalchemy import select, update, delete
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
 from ..database import get_db
-from .. import models
-from typing import List
+from ..replicas import get_read_db
+from .. import models, loaders, inventory, aggregates
+from typing import List, Optional
 from ..oauth2 import get_current_user
 from ..body import ItemRequest, TokenData
 from ..update import ItemRequestPatch, ItemRequestPut
-from ..response import ItemRequestResponse
-from ..status_code import validate_customer_ownership, validate_item_request_exists, validate_customer_exists, validate_type_of_service, validate_service_exists, exception
+from ..response import ItemRequestResponse, BulkItemRequestResult, ITEM_LIST, render
+from ..status_code import validate_customer_ownership, exception, concurrent_write
+from ..dependencies import ServiceChain, valid_sale_service, valid_item, owned_service, explain_service_write
+from ..pagination import paginate, DEFAULT_LIMIT, MAX_LIMIT
+from ..instrumentation import query_budget
 
 #The product_variant_id would be included in the request body when creating/updating item requests.
 
+#upper bound on rows per bulk request, 4 parameters per row stays well under the 32767 bind parameter limit of asyncpg
+MAX_BULK_ITEMS = 1000
+
 router = APIRouter(
     prefix="/customers/{customer_id}/services/{service_id}/items",
     tags=["Item Requests"]
-) 
-
-@router.get("/", response_model=List[ItemRequestResponse])
-def get_items(customer_id: int, service_id: int, db: Session = Depends(get_db)):
-    customer = db.query(models.Customer).filter(models.Customer.id == customer_id).first()
-    validate_customer_exists(customer, customer_id)
-    
-    service = db.query(models.ServiceRequest).filter(
-        models.ServiceRequest.id == service_id,
-        models.ServiceRequest.customer_id == customer_id
-        ).first()
-    
-    validate_service_exists(service, service_id)
-    validate_type_of_service(service.type, models.ServiceCreate.sale)
-    
-    item_request = db.query(models.ItemRequest).filter(models.ItemRequest.request_id == service_id).all()
-    return item_request
+)
+
+
+#WHERE clause of the item writes - the item is under the sale service, which belongs to the current user
+def item_write_filter(customer_id: int, service_id: int, item_id: int, current_user_id: int):
+    return (
+        models.ItemRequest.id == item_id,
+        models.ItemRequest.request_id == service_id,
+        owned_service(customer_id, service_id, current_user_id, models.ServiceCreate.sale)
+    )
+
+
+#raises the error for an item write that matched no row
+async def explain_item_write(db: AsyncSession, customer_id: int, service_id: int, item_id: int, current_user_id: int, product_variant_id: int = None):
+    chain = await explain_service_write(db, customer_id, service_id, current_user_id, models.ServiceCreate.sale, models.ItemRequest, item_id)
+
+    #the item exists and is owned, so the product_variant_id guard is what failed
+    if product_variant_id is not None and chain.child.product_variant_id != product_variant_id:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Product variant cannot be changed after creation"
+        )
+
+
+#PUT/PATCH - updates the item, moves the quantity difference between the variant's stock and the item
+#and adds the cost difference to the sale's total
+async def write_item(db: AsyncSession, customer_id: int, service_id: int, item_id: int, current_user_id: int, update_data: dict, product_variant_id: int = None):
+    #the quantity and unit price before the update, read and locked in the UPDATE's FROM clause
+    old_item = (select(models.ItemRequest.id, models.ItemRequest.quantity, models.ItemRequest.unit_price)
+        .where(models.ItemRequest.id == item_id)
+        .with_for_update(key_share=True)
+        .subquery("old_item"))
+
+    update_query = update(models.ItemRequest).where(
+        models.ItemRequest.id == old_item.c.id,
+        *item_write_filter(customer_id, service_id, item_id, current_user_id)
+        )
+    if product_variant_id is not None:
+        update_query = update_query.where(models.ItemRequest.product_variant_id == product_variant_id)
+
+    row = await loaders.returning_row(db, update_query.values(update_data).returning(models.ItemRequest, old_item.c.quantity, old_item.c.unit_price))
+    if not row:
+        await explain_item_write(db, customer_id, service_id, item_id, current_user_id, product_variant_id)
+        concurrent_write("Item request", item_id)
+
+    new_item_request, old_quantity, old_unit_price = row
+    await aggregates.adjust_service_total(db, service_id, new_item_request.quantity * new_item_request.unit_price - old_quantity * old_unit_price)
+    await inventory.reserve_stock(db, new_item_request.product_variant_id, new_item_request.quantity - old_quantity)
+
+    #the service is loaded after its total moved, for the response
+    await db.refresh(new_item_request, attribute_names=loaders.ITEM_REQUEST_RELATIONSHIPS)
+    return new_item_request
+
+
+@router.get("/", response_model=List[ItemRequestResponse], dependencies=[Depends(valid_sale_service), Depends(query_budget(2))])
+async def get_items(customer_id: int, service_id: int, response: Response, limit: int = Query(DEFAULT_LIMIT, ge=1, le=MAX_LIMIT), cursor: Optional[str] = None,
+                    db: AsyncSession = Depends(get_read_db)):
+    #customer, service and service type are checked by the valid_sale_service dependency
+    query = select(models.ItemRequest).options(*loaders.ITEM_REQUEST_RESPONSE).where(models.ItemRequest.request_id == service_id)
+    item_request = await paginate(db, query, (models.ItemRequest.id,), limit, cursor, response)
+    return render(ITEM_LIST, item_request, response)
 
 
 @router.post("/", status_code=status.HTTP_201_CREATED, response_model=ItemRequestResponse)
-def post_item_request(customer_id: int, service_id: int, item_request: ItemRequest, db: Session = Depends(get_db), current_user: TokenData = Depends(get_current_user)):
+async def post_item_request(customer_id: int, service_id: int, item_request: ItemRequest, service: models.ServiceRequest = Depends(valid_sale_service), db: AsyncSession = Depends(get_db), current_user: TokenData = Depends(get_current_user)):
     try:
-        customer = db.query(models.Customer).filter(models.Customer.id == customer_id).first()
-        validate_customer_exists(customer, customer_id)
-
-        service = db.query(models.ServiceRequest).filter(
-            models.ServiceRequest.id == service_id,
-            models.ServiceRequest.customer_id == customer_id
-            ).first()
-        
-        validate_service_exists(service, service_id)
-        validate_type_of_service(service.type, models.ServiceCreate.sale)
-        
         validate_customer_ownership(service.customer_id, current_user.id)
 
-        item_request_data = item_request.dict()
+        item_request_data = item_request.model_dump()
         item_request_data["request_id"] = service_id
 
         new_item_request = models.ItemRequest(**item_request_data)
         db.add(new_item_request)
-        db.commit()
-        db.refresh(new_item_request)
-        return new_item_request
+        await db.flush()
+
+        await aggregates.adjust_service_total(db, service_id, new_item_request.quantity * new_item_request.unit_price)
+
+        #stock is taken last, right before the commit, so the variant's row lock is held as briefly as possible
+        await inventory.reserve_stock(db, new_item_request.product_variant_id, new_item_request.quantity)
+        await db.commit()
+        return await loaders.reload(db, models.ItemRequest, new_item_request.id, loaders.ITEM_REQUEST_RESPONSE)
 
     except HTTPException as http_error:
         raise http_error
-    
+
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         exception(e)
 
 
-@router.get("/{item_id}", response_model=ItemRequestResponse)
-def get_one_item(customer_id: int, service_id: int, item_id: int, db: Session = Depends(get_db)):
-    customer = db.query(models.Customer).filter(models.Customer.id == customer_id).first()
-    validate_customer_exists(customer, customer_id)
-    
-    service = db.query(models.ServiceRequest).filter(
-        models.ServiceRequest.id == service_id,
-        models.ServiceRequest.customer_id == customer_id
-        ).first()
-    
-    validate_service_exists(service, service_id)
-    validate_type_of_service(service.type, models.ServiceCreate.sale)
-
-    item_request = db.query(models.ItemRequest).filter(
-        models.ItemRequest.id == item_id,
-        models.ItemRequest.request_id == service_id
-    ).first()
+#Creates every item request of a sale in one multi-row INSERT and one transaction.
+#Rows are reported one by one - a product variant that is already on the service (or repeated in the body) is a conflict
+#on unique_request_variant, and a product variant that doesn't exist is invalid. The other rows are still created.
+@router.post("/bulk", response_model=List[BulkItemRequestResult])
+async def post_item_requests(customer_id: int, service_id: int, item_requests: List[ItemRequest], service: models.ServiceRequest = Depends(valid_sale_service), db: AsyncSession = Depends(get_db), current_user: TokenData = Depends(get_current_user)):
+    try:
+        validate_customer_ownership(service.customer_id, current_user.id)
 
-    validate_item_request_exists(item_request, item_id)
+        if not item_requests:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="No item requests provided"
+            )
+        if len(item_requests) > MAX_BULK_ITEMS:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"At most {MAX_BULK_ITEMS} item requests can be created at once"
+            )
 
-    return item_request
+        variant_ids = {item.product_variant_id for item in item_requests}
+        existing_variants = set(await db.scalars(select(models.ProductVariant.id).where(models.ProductVariant.id.in_(variant_ids))))
+
+        results = [None] * len(item_requests)
+        rows = {}    #product_variant_id -> index of the row that gets inserted
+        for index, item in enumerate(item_requests):
+            if item.product_variant_id not in existing_variants:
+                results[index] = BulkItemRequestResult(index=index, status="invalid", detail=f"Product variant with id {item.product_variant_id} was not found")
+            elif item.quantity <= 0:
+                results[index] = BulkItemRequestResult(index=index, status="invalid", detail="Quantity must be greater than 0")
+            elif item.unit_price < 0:
+                results[index] = BulkItemRequestResult(index=index, status="invalid", detail="Unit price must not be negative")
+            elif item.product_variant_id in rows:
+                results[index] = BulkItemRequestResult(index=index, status="conflict", detail=f"Product variant with id {item.product_variant_id} is repeated in the request")
+            else:
+                rows[item.product_variant_id] = index
+
+        #the sale's total is adjusted after the insert, its row is locked before the variants like the single POST does
+        await aggregates.lock_service(db, service_id)
+
+        #stock for every row in one statement, rows whose variant is short are not inserted
+        reserved = await inventory.reserve_stock_many(db, {variant_id: item_requests[index].quantity for variant_id, index in rows.items()})
+        for variant_id in set(rows) - reserved:
+            index = rows.pop(variant_id)
+            results[index] = BulkItemRequestResult(index=index, status="insufficient_stock", detail=f"Insufficient stock for product variant with id {variant_id}")
+
+        if rows:
+            #INSERT ... VALUES (...), (...) ON CONFLICT ON CONSTRAINT unique_request_variant DO NOTHING RETURNING *
+            insert_query = insert(models.ItemRequest).values([
+                {**item_requests[index].model_dump(), "request_id": service_id} for index in rows.values()
+            ]).on_conflict_do_nothing(constraint="unique_request_variant").returning(models.ItemRequest)
+
+            total = 0
+            for new_item in await db.scalars(insert_query):
+                index = rows.pop(new_item.product_variant_id)
+                results[index] = BulkItemRequestResult(index=index, status="created", item=new_item)
+                total += new_item.quantity * new_item.unit_price
+
+            await aggregates.adjust_service_total(db, service_id, total)
+
+            #rows left over were skipped by ON CONFLICT, their stock goes back
+            for variant_id, index in rows.items():
+                await inventory.restore_stock(db, variant_id, item_requests[index].quantity)
+                results[index] = BulkItemRequestResult(index=index, status="conflict", detail=f"Product variant with id {variant_id} is already in this service")
+
+        await db.commit()
+        return results
 
+    except HTTPException as http_error:
+        raise http_error
 
-@router.delete("/{item_id}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_item_request(customer_id: int, service_id: int, item_id: int, db: Session = Depends(get_db), current_user: TokenData = Depends(get_current_user)):
-    try:
-        customer = db.query(models.Customer).filter(models.Customer.id == customer_id).first()
-        validate_customer_exists(customer, customer_id)
-        
-        service = db.query(models.ServiceRequest).filter(
-            models.ServiceRequest.id == service_id,
-            models.ServiceRequest.customer_id == customer_id
-        ).first()
-        
-        validate_service_exists(service, service_id)
-        validate_type_of_service(service.type, models.ServiceCreate.sale)
+    except Exception as e:
+        await db.rollback()
+        exception(e)
 
-        validate_customer_ownership(service.customer_id, current_user.id)
 
-        delete_query = db.query(models.ItemRequest).filter(
-            models.ItemRequest.id == item_id,
-            models.ItemRequest.request_id == service_id
-        )
-        item_request = delete_query.first()
+@router.get("/{item_id}", response_model=ItemRequestResponse, dependencies=[Depends(query_budget(1))])
+async def get_one_item(customer_id: int, service_id: int, item_id: int, chain: ServiceChain = Depends(valid_item)):
+    #customer, service and item request come from one query, with the service joined in for the response
+    return chain.child
 
-        validate_item_request_exists(item_request, item_id)
 
-        delete_query.delete(synchronize_session=False)
-        db.commit()
+@router.delete("/{item_id}", status_code=status.HTTP_204_NO_CONTENT)
+async def delete_item_request(customer_id: int, service_id: int, item_id: int, db: AsyncSession = Depends(get_db), current_user: TokenData = Depends(get_current_user)):
+    try:
+        deleted = (await db.execute(delete(models.ItemRequest).where(
+            *item_write_filter(customer_id, service_id, item_id, current_user.id)
+            ).returning(models.ItemRequest.product_variant_id, models.ItemRequest.quantity, models.ItemRequest.unit_price).execution_options(synchronize_session=False))).first()
+        if not deleted:
+            await explain_item_write(db, customer_id, service_id, item_id, current_user.id)
+            concurrent_write("Item request", item_id)
+
+        #the item's cost comes off the sale's total and its quantity goes back to the variant
+        await aggregates.adjust_service_total(db, service_id, -deleted.quantity * deleted.unit_price)
+        await inventory.restore_stock(db, deleted.product_variant_id, deleted.quantity)
+
+        await db.commit()
         return
 
     except HTTPException as http_error:
         raise http_error
-    
+
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         exception(e)
 
 
 @router.put("/{item_id}", response_model=ItemRequestResponse)
-def put_item_request(customer_id: int, service_id: int, item_id: int, item_request: ItemRequestPut, db: Session = Depends(get_db), current_user: TokenData = Depends(get_current_user)):
+async def put_item_request(customer_id: int, service_id: int, item_id: int, item_request: ItemRequestPut, db: AsyncSession = Depends(get_db), current_user: TokenData = Depends(get_current_user)):
     try:
-        customer = db.query(models.Customer).filter(models.Customer.id == customer_id).first()
-        validate_customer_exists(customer, customer_id)
-
-        service = db.query(models.ServiceRequest).filter(
-            models.ServiceRequest.id == service_id,
-            models.ServiceRequest.customer_id == customer_id
-        ).first()
-
-        validate_service_exists(service, service_id)
-        validate_type_of_service(service.type, models.ServiceCreate.sale)
-
-        validate_customer_ownership(service.customer_id, current_user.id)
-
-        put_query = db.query(models.ItemRequest).filter(
-            models.ItemRequest.id == item_id, 
-            models.ItemRequest.request_id == service_id
-        )
-        existing_item = put_query.first()
-
-        validate_item_request_exists(existing_item, item_id)
-
         # Get update data
-        update_data = item_request.dict()
+        update_data = item_request.model_dump()
 
-        # Prevent product_variant_id updates
-        if "product_variant_id" in update_data:
-            if update_data["product_variant_id"] != existing_item.product_variant_id:
-                raise HTTPException(
-                    status_code=status.HTTP_400_BAD_REQUEST,
-                    detail="Product variant cannot be changed after creation"
-                )
-            update_data.pop("product_variant_id")
+        # Prevent product_variant_id updates - the row only matches if the variant is unchanged
+        product_variant_id = update_data.pop("product_variant_id", None)
+        new_item_request = await write_item(db, customer_id, service_id, item_id, current_user.id, update_data, product_variant_id)
 
-        put_query.update(update_data, synchronize_session=False)
-        db.commit()
-        return put_query.first()
+        await db.commit()
+        return new_item_request
 
     except HTTPException as http_error:
         raise http_error
-    
+
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         exception(e)
 
 
 #If product_variant_id is the only data in body, it will not be accepted
 @router.patch("/{item_id}", response_model=ItemRequestResponse)
-def update_item_request(customer_id: int, service_id: int, item_id: int, item_request:ItemRequestPatch, db: Session = Depends(get_db), current_user: TokenData = Depends(get_current_user)):
+async def update_item_request(customer_id: int, service_id: int, item_id: int, item_request:ItemRequestPatch, db: AsyncSession = Depends(get_db), current_user: TokenData = Depends(get_current_user)):
     try:
-        customer = db.query(models.Customer).filter(models.Customer.id == customer_id).first()
-        validate_customer_exists(customer, customer_id)
-
-        service = db.query(models.ServiceRequest).filter(
-            models.ServiceRequest.id == service_id,
-            models.ServiceRequest.customer_id == customer_id
-        ).first()
-        validate_service_exists(service, service_id)
-        validate_type_of_service(service.type, models.ServiceCreate.sale)
-
-        validate_customer_ownership(service.customer_id, current_user.id)
-
-        patch_query = db.query(models.ItemRequest).filter(
-            models.ItemRequest.id == item_id,
-            models.ItemRequest.request_id == service_id
-        )
-        existing_item = patch_query.first()
-
-        validate_item_request_exists(existing_item, item_id)
-
         # Get update data and exclude product_variant_id to prevent changes
-        update_data = item_request.dict(exclude_unset=True)
+        update_data = item_request.model_dump(exclude_unset=True)
 
-        # Prevent product_variant_id updates
-        if "product_variant_id" in update_data:
-            if update_data["product_variant_id"] != existing_item.product_variant_id:
-                raise HTTPException(
-                    status_code=status.HTTP_400_BAD_REQUEST,
-                    detail="Product variant cannot be changed after creation"
-                )
-            update_data.pop("product_variant_id")
+        # Prevent product_variant_id updates - the row only matches if the variant is unchanged
+        product_variant_id = update_data.pop("product_variant_id", None)
 
         # Ensure at least one field is being updated
         if not update_data:
@@ -215,14 +256,15 @@ def update_item_request(customer_id: int, service_id: int, item_id: int, item_re
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="No valid fields provided for update"
             )
-        
-        patch_query.update(update_data, synchronize_session=False)
-        db.commit()
-        return patch_query.first()
+
+        new_item_request = await write_item(db, customer_id, service_id, item_id, current_user.id, update_data, product_variant_id)
+
+        await db.commit()
+        return new_item_request
 
     except HTTPException as http_error:
         raise http_error
-    
+
     except Exception as e:
-        db.rollback()
-        exception(e)
\ No newline at end of file
+        await db.rollback()
+        exception(e)
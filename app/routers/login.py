@@ -1,29 +1,63 @@
 from fastapi import APIRouter, Depends, status, HTTPException
 from fastapi.security.oauth2 import OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
 from ..database import get_db
-from ..body import Token
+from ..body import Token, TokenData, RefreshRequest
 from .. import models, oauth2
-from ..utils import verify
+from ..utils import verify_password
+from ..oauth2 import get_current_user
 
 router = APIRouter()
 
 @router.post("/login", response_model=Token)
-def login(credentials: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
+async def login(credentials: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_db)):
     #gets the row of the user that matches the email
-    user = db.query(models.Customer).filter(models.Customer.email == credentials.username).first()
+    user = await db.scalar(select(models.Customer).where(models.Customer.email == credentials.username))
 
     if not user:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
                             detail="Invalid credentials.")
-    
-    #verifies password of the email/user
-    if not verify(credentials.password, user.password):
+
+    #verifies password of the email/user, bcrypt is CPU bound so it runs in the password pool (utils.py)
+    matches, new_hash = await verify_password(credentials.password, user.password)
+    if not matches:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
                             detail="Invalid credentials.")
 
-    #create a token from oauth2 using user id
+    #the stored hash was made with other bcrypt rounds than settings.bcrypt_rounds, replaced now that the password is known
+    if new_hash:
+        await db.execute(update(models.Customer).where(models.Customer.id == user.id).values(password=new_hash))
+
+    #create a token from oauth2 using user id, and the refresh token that renews it without the password
     access_token = oauth2.create_token(data = {"user_id": user.id})
+    refresh_token = oauth2.create_refresh_token(db, user.id)
+    await db.commit()
 
     #return token and customer_id
-    return {"access_token": access_token, "token_type": "bearer", "customer_id": user.id}
\ No newline at end of file
+    return {"access_token": access_token, "token_type": "bearer", "customer_id": user.id, "refresh_token": refresh_token}
+
+
+#new access and refresh tokens for a refresh token, which can't be used again
+@router.post("/token/refresh", response_model=Token)
+async def refresh(body: RefreshRequest, db: AsyncSession = Depends(get_db)):
+    credentials_exception = HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
+                                          detail="Invalid refresh token",
+                                          headers={"WWW-Authenticate": "Bearer"})
+
+    customer_id = await oauth2.rotate_refresh_token(db, body.refresh_token, credentials_exception)
+
+    access_token = oauth2.create_token(data = {"user_id": customer_id})
+    refresh_token = oauth2.create_refresh_token(db, customer_id)
+    await db.commit()
+
+    return {"access_token": access_token, "token_type": "bearer", "customer_id": customer_id, "refresh_token": refresh_token}
+
+
+#logs the current customer out - every refresh token, on every worker, and the access tokens issued so far on this worker.
+#Other workers accept those access tokens until they expire (token_minutes), see oauth2.TokenCache
+@router.post("/token/revoke", status_code=status.HTTP_204_NO_CONTENT)
+async def revoke(db: AsyncSession = Depends(get_db), current_user: TokenData = Depends(get_current_user)):
+    await oauth2.revoke_refresh_tokens(db, current_user.id)
+    await db.commit()
+    return
@@ -0,0 +1,25 @@
+from fastapi import APIRouter
+from ..database import engine, replica_engines
+from ..pool import pool_status
+from .. import cache
+
+router = APIRouter(
+    prefix="/metrics",
+    tags=["Metrics"]
+)
+
+#checked-out/idle/overflow connections and the checkout wait-time histogram
+#the histogram is shared by every pool, the replicas' pools are listed under "replicas"
+@router.get("/pool")
+async def get_pool_metrics():
+    status = pool_status(engine)
+    if replica_engines:
+        status["replicas"] = [pool_status(replica_engine) for replica_engine in replica_engines]
+
+    return status
+
+
+#product catalog response cache - hits, misses, evictions, expirations and invalidations
+@router.get("/cache")
+async def get_cache_metrics():
+    return cache.cache.stats()
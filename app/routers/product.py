@@ -1,101 +1,196 @@
-from fastapi import status, HTTPException, Depends, APIRouter
-from sqlalchemy.orm import Session
+import io
+from fastapi import status, HTTPException, Depends, APIRouter, Query, Request, Response, UploadFile
+from sqlalchemy import select, update, delete
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
 from ..database import get_db
-from .. import models
-from typing import List
+from ..replicas import get_read_db
+from .. import models, loaders, cache, aggregates
+from typing import List, Optional
+from datetime import datetime
 from ..body import ValidProduct
 from ..update import ValidProductPatch, ValidProductPut
-from ..response import ProductResponse
-from ..status_code import validate_product_exists, exception
+from ..response import ProductResponse, CatalogImportResponse, PRODUCT_LIST, PRODUCT
+from ..catalog import CatalogFormat, import_catalog
+from ..status_code import validate_product_exists, exception, unique_violation
+from ..pagination import paginate, DEFAULT_LIMIT, MAX_LIMIT
+from ..instrumentation import query_budget
 
 router = APIRouter(
     prefix="/products",
     tags=["Products"]
 )
 
-@router.get("/", response_model=List[ProductResponse])
-def get_products(db: Session = Depends(get_db)):
-    product = db.query(models.Product).all()
-    return product
+#409 detail of the product writes
+UNIQUE_CONSTRAINTS = {"unique_product_name": "A product with this name already exists"}
+
+@router.get("/", response_model=List[ProductResponse], dependencies=[Depends(query_budget(2))])
+async def get_products(request: Request, response: Response, limit: int = Query(DEFAULT_LIMIT, ge=1, le=MAX_LIMIT), cursor: Optional[str] = None,
+                       created_after: Optional[datetime] = None, created_before: Optional[datetime] = None, in_stock: Optional[bool] = None,
+                       db: AsyncSession = Depends(get_read_db)):
+    cached = cache.lookup(request)
+    if cached:
+        return cached
+
+    query = select(models.Product).options(*loaders.PRODUCT_RESPONSE)
+
+    #created_at range filter (ix_products_created_at)
+    if created_after:
+        query = query.where(models.Product.created_at >= created_after)
+    if created_before:
+        query = query.where(models.Product.created_at < created_before)
+
+    #stock_quantity is the sum of the variants' stock, in_stock=true reads the partial index ix_products_in_stock
+    if in_stock is True:
+        query = query.where(models.Product.stock_quantity > 0)
+    elif in_stock is False:
+        query = query.where(models.Product.stock_quantity == 0)
+
+    product = await paginate(db, query, (models.Product.id,), limit, cursor, response)
+    return cache.store(request, db, PRODUCT_LIST, product, response)
 
 
 @router.post("/", status_code=status.HTTP_201_CREATED, response_model=ProductResponse)
-def create_product(product:ValidProduct, db: Session = Depends(get_db)):
+async def create_product(product:ValidProduct, db: AsyncSession = Depends(get_db)):
     try:
-        query = models.Product(**product.dict())
+        #stock_quantity is the sum of the variants' stock (aggregates.py), a new product has none
+        product_data = product.model_dump()
+        product_data["stock_quantity"] = 0
+
+        query = models.Product(**product_data)
         db.add(query)
-        db.commit()
-        db.refresh(query)
-        return query
+        cache.invalidate_product(db)
+        await db.commit()
+        return await loaders.reload(db, models.Product, query.id, loaders.PRODUCT_RESPONSE)
 
     except HTTPException as http_error:
         raise http_error
-    
+
+    except IntegrityError as e:
+        await db.rollback()
+        unique_violation(e, UNIQUE_CONSTRAINTS)
+
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         exception(e)
 
 
-@router.get("/{id}", response_model=ProductResponse)
-def get_one(id: int, db: Session = Depends(get_db)):
-    product = db.query(models.Product).filter(models.Product.id == id).first()
+#Supplier catalog upload, see catalog.py for the file layout
+@router.post("/import", response_model=CatalogImportResponse)
+async def import_products(file: UploadFile, format: CatalogFormat = CatalogFormat.csv, db: AsyncSession = Depends(get_db)):
+    try:
+        #the upload is already spooled to a temporary file, it is read from there batch by batch
+        stream = io.TextIOWrapper(file.file, encoding="utf-8-sig", newline="")
+        report = await import_catalog(db, stream, format)
+        cache.invalidate_catalog(db)
+        await db.commit()
+        return report.to_dict()
+
+    except UnicodeDecodeError:
+        await db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Catalog file must be UTF-8 encoded"
+        )
+
+    except HTTPException as http_error:
+        raise http_error
+
+    except Exception as e:
+        await db.rollback()
+        exception(e)
+
+
+@router.get("/{id}", response_model=ProductResponse, dependencies=[Depends(query_budget(2))])
+async def get_one(id: int, request: Request, db: AsyncSession = Depends(get_read_db)):
+    cached = cache.lookup(request)
+    if cached:
+        return cached
+
+    product = await db.scalar(select(models.Product).options(*loaders.PRODUCT_RESPONSE).where(models.Product.id == id))
     validate_product_exists(product, id)
 
-    return product
+    return cache.store(request, db, PRODUCT, product)
 
 
 @router.delete("/{id}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_product(id: int, db: Session = Depends(get_db)):
+async def delete_product(id: int, db: AsyncSession = Depends(get_db)):
     try:
-        delete_query = db.query(models.Product).filter(models.Product.id == id)
-        new_product = delete_query.first()
-        validate_product_exists(new_product, id)
-        
-        delete_query.delete(synchronize_session=False)
-        db.commit()
+        #the item requests of the product's variants go with it (ON DELETE CASCADE), their cost comes off the sales' totals first
+        await aggregates.remove_items_totals(db, models.ItemRequest.product_variant_id.in_(
+            select(models.ProductVariant.id).where(models.ProductVariant.product_id == id)
+            ))
+
+        #DELETE FROM products WHERE id = id RETURNING id
+        deleted = await db.scalar(delete(models.Product).where(models.Product.id == id).returning(models.Product.id).execution_options(synchronize_session=False))
+        validate_product_exists(deleted, id)
+
+        cache.invalidate_product(db, id)
+        await db.commit()
         return
 
     except HTTPException as http_error:
         raise http_error
-    
+
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         exception(e)
 
 
 @router.put("/{id}", response_model=ProductResponse)
-def update_product(id: int, product: ValidProductPut, db: Session = Depends(get_db)):
+async def update_product(id: int, product: ValidProductPut, db: AsyncSession = Depends(get_db)):
     try:
-        update_query = db.query(models.Product).filter(models.Product.id == id)
-        new_product = update_query.first()
+        #UPDATE products SET ... WHERE id = id RETURNING *
+        update_query = update(models.Product).where(models.Product.id == id)
+        product_data = product.model_dump()
+
+        new_product = await loaders.returning(db, update_query.values(product_data).returning(models.Product), loaders.PRODUCT_RELATIONSHIPS)
         validate_product_exists(new_product, id)
-        
-        update_query.update(product.dict(), synchronize_session=False)
-        db.commit()
-        return update_query.first()
+
+        cache.invalidate_product(db, id)
+        await db.commit()
+        return new_product
 
     except HTTPException as http_error:
         raise http_error
-    
+
+    except IntegrityError as e:
+        await db.rollback()
+        unique_violation(e, UNIQUE_CONSTRAINTS)
+
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         exception(e)
 
 
 @router.patch("/{id}", response_model=ProductResponse)
-def update_product(id: int, product: ValidProductPatch, db: Session = Depends(get_db)):
+async def update_product(id: int, product: ValidProductPatch, db: AsyncSession = Depends(get_db)):
     try:
-        update_query = db.query(models.Product).filter(models.Product.id == id)
-        new_product = update_query.first()
+        #UPDATE products SET ... WHERE id = id RETURNING *
+        update_query = update(models.Product).where(models.Product.id == id)
+        product_data = product.model_dump(exclude_unset=True)
+
+        # Ensure at least one field is being updated
+        if not product_data:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="No valid fields provided for update"
+            )
+
+        new_product = await loaders.returning(db, update_query.values(product_data).returning(models.Product), loaders.PRODUCT_RELATIONSHIPS)
         validate_product_exists(new_product, id)
-        
-        update_query.update(product.dict(exclude_unset=True), synchronize_session=False)
-        db.commit()
-        return update_query.first()
-    
+
+        cache.invalidate_product(db, id)
+        await db.commit()
+        return new_product
+
     except HTTPException as http_error:
         raise http_error
-    
+
+    except IntegrityError as e:
+        await db.rollback()
+        unique_violation(e, UNIQUE_CONSTRAINTS)
+
     except Exception as e:
-        db.rollback()
-        exception(e)
\ No newline at end of file
+        await db.rollback()
+        exception(e)
@@ -1,230 +1,183 @@
-from fastapi import APIRouter, status, Depends, HTTPException
-from .. import models
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, status, Depends, HTTPException, Query, Request, Response
+from .. import models, loaders, etag, repair_states
+from sqlalchemy import select, update, delete
+from sqlalchemy.ext.asyncio import AsyncSession
 from ..database import get_db
-from typing import List
-from datetime import datetime
+from ..replicas import get_read_db
+from typing import List, Optional
 from ..oauth2 import get_current_user
 from ..body import Repair, TokenData
 from ..update import RepairPatch, RepairPut
-from ..response import RepairResponse
-from ..status_code import validate_customer_exists, validate_service_exists, validate_repair_exists, validate_type_of_service, validate_customer_ownership, exception
+from ..response import RepairResponse, REPAIR_LIST, render
+from ..status_code import validate_customer_ownership, exception
+from ..dependencies import service_chain, valid_repair_service, owned_service, explain_service_write
+from ..pagination import paginate, DEFAULT_LIMIT, MAX_LIMIT
+from ..instrumentation import query_budget
 
 router = APIRouter(
     prefix="/customers/{customer_id}/services/{service_id}/repairs",
     tags=["Repairs"]
 )
 
-@router.get("/", response_model=List[RepairResponse])
-def get_all_by_url(customer_id: int, service_id: int, db: Session = Depends(get_db)):
-    # Check if customer exists in database
-    customer = db.query(models.Customer).filter(models.Customer.id == customer_id).first()
-    validate_customer_exists(customer, customer_id)
 
-    # Check if service exists and belongs to the given customer
-    service = db.query(models.ServiceRequest).filter(
-        models.ServiceRequest.id == service_id, 
-        models.ServiceRequest.customer_id == customer_id
-        ).first()
-    validate_service_exists(service, service_id)
-
-    validate_type_of_service(service.type, models.ServiceCreate.repair)
-
-    repair = db.query(models.Repair).filter(
-        models.Repair.request_id == service_id).all()
-
-    return repair
+#WHERE clause of the repair writes - the repair is under the repair service, which belongs to the current user
+def repair_write_filter(customer_id: int, service_id: int, repair_id: int, current_user_id: int):
+    return (
+        models.Repair.id == repair_id,
+        models.Repair.request_id == service_id,
+        owned_service(customer_id, service_id, current_user_id, models.ServiceCreate.repair)
+    )
+
+
+#UPDATE of a repair through the state machine (repair_states.py).
+#The current status and version are read first, the UPDATE only applies if both are still the same and increments the version.
+#version - the version the client read, None to take the current one
+async def write_repair(db: AsyncSession, customer_id: int, service_id: int, repair_id: int, current_user_id: int, repair_data: dict, version: Optional[int]):
+    current = (await db.execute(select(models.Repair.status, models.Repair.version).where(
+        *repair_write_filter(customer_id, service_id, repair_id, current_user_id)))).first()
+    if not current:
+        await explain_service_write(db, customer_id, service_id, current_user_id, models.ServiceCreate.repair, models.Repair, repair_id)
+
+    if version is not None and version != current.version:
+        raise repair_states.conflict(repair_id, current.version)
+
+    repair_data = repair_states.transition(current.status, repair_data, repair_id)
+
+    #UPDATE repairs SET ..., version = version + 1 WHERE ... AND status = current.status AND version = current.version RETURNING *
+    update_query = update(models.Repair).where(
+        *repair_write_filter(customer_id, service_id, repair_id, current_user_id),
+        models.Repair.status == current.status,
+        models.Repair.version == current.version
+        )
+    new_repair = await loaders.returning(db, update_query.values(repair_data, version=models.Repair.version + 1).returning(models.Repair), loaders.REPAIR_RELATIONSHIPS)
+    if not new_repair:
+        raise repair_states.conflict(repair_id)
+
+    return new_repair
+
+@router.get("/", response_model=List[RepairResponse], dependencies=[Depends(query_budget(3))])
+async def get_all_by_url(customer_id: int, service_id: int, request: Request, response: Response, limit: int = Query(DEFAULT_LIMIT, ge=1, le=MAX_LIMIT), cursor: Optional[str] = None,
+                         db: AsyncSession = Depends(get_read_db)):
+    #the client's copy of the page is current, nothing else is loaded (see etag.py)
+    #weak, every page of the list shares the version of the service's repairs
+    current = etag.weak(await etag.repairs_etag(db, customer_id, service_id))
+    not_modified = etag.not_modified(request, current)
+    if not_modified:
+        return not_modified
+
+    # Customer, service and service type are checked here rather than by the valid_repair_service dependency, so a 304 runs one query
+    await service_chain(db, customer_id, service_id, models.ServiceCreate.repair)
+
+    query = select(models.Repair).options(*loaders.REPAIR_RESPONSE).where(
+        models.Repair.request_id == service_id)
+    repair = await paginate(db, query, (models.Repair.id,), limit, cursor, response)
+
+    response.headers["ETag"] = current
+    return render(REPAIR_LIST, repair, response)
 
 
 @router.post("/", status_code=status.HTTP_201_CREATED, response_model=RepairResponse)
-def create_post(customer_id: int, service_id: int, repair: Repair, db: Session = Depends(get_db), current_user: TokenData = Depends(get_current_user)):
+async def create_post(customer_id: int, service_id: int, repair: Repair, service: models.ServiceRequest = Depends(valid_repair_service), db: AsyncSession = Depends(get_db), current_user: TokenData = Depends(get_current_user)):
     try:
-        # Check if customer exists in database
-        customer = db.query(models.Customer).filter(models.Customer.id == customer_id).first()
-        validate_customer_exists(customer, customer_id)
-
-        # Check if service exists and belongs to the given customer
-        service = db.query(models.ServiceRequest).filter(
-            models.ServiceRequest.id == service_id,
-            models.ServiceRequest.customer_id == customer_id
-            ).first()
-        validate_service_exists(service, service_id)
-        validate_type_of_service(service.type, models.ServiceCreate.repair)
-
         validate_customer_ownership(service.customer_id, current_user.id)
 
         #since request_id is not being passed in the postman body, set its value manually
-        repair_data = repair.dict()
+        repair_data = repair.model_dump()
         repair_data["request_id"] = service_id
 
-        new_repair = models.Repair(**repair_data)
-
-        # Automatically set the finished_date if the repair is marked as completed
-        if new_repair.status == models.Status.COMPLETED:
-            new_repair.finished_date = datetime.utcnow()
+        # Automatically set the dates of a repair created in progress or completed
+        new_repair = models.Repair(**repair_states.created(repair_data))
 
         db.add(new_repair)
-        db.commit()
-        db.refresh(new_repair)
-        return new_repair
-    
+        await db.commit()
+        return await loaders.reload(db, models.Repair, new_repair.id, loaders.REPAIR_RESPONSE)
+
     except HTTPException as http_error:
         raise http_error
-    
+
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         exception(e)
 
 
-@router.get("/{repair_id}", response_model=RepairResponse)
-def get_one_repair(customer_id: int, service_id: int, repair_id: int, db: Session = Depends(get_db)):
-    customer = db.query(models.Customer).filter(models.Customer.id == customer_id).first()
-    validate_customer_exists(customer, customer_id)
+@router.get("/{repair_id}", response_model=RepairResponse, dependencies=[Depends(query_budget(2))])
+async def get_one_repair(customer_id: int, service_id: int, repair_id: int, request: Request, response: Response, db: AsyncSession = Depends(get_read_db)):
+    current = await etag.repair_etag(db, customer_id, service_id, repair_id)
+    not_modified = etag.not_modified(request, current)
+    if not_modified:
+        return not_modified
 
-    service = db.query(models.ServiceRequest).filter(
-        models.ServiceRequest.id == service_id,
-        models.ServiceRequest.customer_id == customer_id
-    ).first()
-    validate_service_exists(service, service_id)
-
-    validate_type_of_service(service.type, models.ServiceCreate.repair)
-    
-    repair = db.query(models.Repair).filter(
-        models.Repair.id == repair_id,
-        models.Repair.request_id == service_id
-        ).first()
-    validate_repair_exists(repair, repair_id)
+    #customer, service and repair come from one query, with the service joined in for the response
+    chain = await service_chain(db, customer_id, service_id, models.ServiceCreate.repair, models.Repair, repair_id)
 
-    return repair
+    response.headers["ETag"] = current
+    return chain.child
 
 
 @router.delete("/{repair_id}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_service(customer_id: int, service_id: int, repair_id: int, db: Session = Depends(get_db), current_user: TokenData = Depends(get_current_user)):
+async def delete_service(customer_id: int, service_id: int, repair_id: int, db: AsyncSession = Depends(get_db), current_user: TokenData = Depends(get_current_user)):
     try:
-        customer = db.query(models.Customer).filter(models.Customer.id == customer_id).first()
-        validate_customer_exists(customer, customer_id)
-        
-        service = db.query(models.ServiceRequest).filter(
-            models.ServiceRequest.id == service_id,
-            models.ServiceRequest.customer_id == customer_id
-            ).first()
-        validate_service_exists(service, service_id)
-        validate_type_of_service(service.type, models.ServiceCreate.repair)
-
-        delete_query = db.query(models.Repair).filter(
-            models.Repair.id == repair_id,
-            models.Repair.request_id == service_id
-            )
-        repair = delete_query.first()
-        validate_repair_exists(repair, repair_id)
-
-        validate_customer_ownership(service.customer_id, current_user.id)
-        
-        delete_query.delete(synchronize_session=False)
-        db.commit()
+        deleted = await db.scalar(delete(models.Repair).where(
+            *repair_write_filter(customer_id, service_id, repair_id, current_user.id)
+            ).returning(models.Repair.id).execution_options(synchronize_session=False))
+        if not deleted:
+            #404 for the customer, service or repair, 400 for the service type, 403 for ownership
+            await explain_service_write(db, customer_id, service_id, current_user.id, models.ServiceCreate.repair, models.Repair, repair_id)
+
+        await db.commit()
         return
 
     except HTTPException as http_error:
         raise http_error
-    
+
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         exception(e)
-    
+
 
 @router.put("/{repair_id}", response_model=RepairResponse)
-def update_repair(customer_id: int, service_id: int, repair_id: int, repair: RepairPut, db: Session = Depends(get_db), current_user: TokenData = Depends(get_current_user)):
+async def update_repair(customer_id: int, service_id: int, repair_id: int, repair: RepairPut, request: Request, response: Response, db: AsyncSession = Depends(get_db), current_user: TokenData = Depends(get_current_user)):
     try:
-        customer = db.query(models.Customer).filter(models.Customer.id == customer_id).first()
-        validate_customer_exists(customer, customer_id)
-
-        service = db.query(models.ServiceRequest).filter(
-            models.ServiceRequest.id == service_id,
-            models.ServiceRequest.customer_id == customer_id
-            ).first()
-        validate_service_exists(service, service_id)
-        validate_type_of_service(service.type, models.ServiceCreate.repair)
-
-        update_query = db.query(models.Repair).filter(
-            models.Repair.id == repair_id,
-            models.Repair.request_id == service_id
-            )
-        new_repair = update_query.first()
-        validate_repair_exists(new_repair, repair_id)
+        #If-Match - 412 when the repair changed since the client read it, the row stays locked until the UPDATE
+        if etag.IF_MATCH in request.headers:
+            etag.check_if_match(request, await etag.repair_etag(db, customer_id, service_id, repair_id, lock=True))
 
-        validate_customer_ownership(service.customer_id, current_user.id)
-        
-        #If the update is marked as IN_PROGRESS or COMPLETED, add the current time to finished date
-        repair_data = repair.dict()
-        if repair.status == models.Status.IN_PROGRESS:
-            repair_data["start_date"] = datetime.utcnow()
-        if repair.status == models.Status.COMPLETED:
-            repair_data["finished_date"] = datetime.utcnow()
-
-        #Handles if changing from completed to either in_progres or pending (misinput).
-        elif new_repair.status == models.Status.COMPLETED and repair.status and repair.status != models.Status.COMPLETED:
-            repair_data["finished_date"] = None
-
-        #Handles changes if reverting IN_PROGRESS or COMPLETED back to PENDING
-        if new_repair.status != models.Status.PENDING and repair.status == models.Status.PENDING:
-            repair_data["start_date"] = None
-            
-        update_query.update(repair_data, synchronize_session=False)
-        db.commit()
-        return update_query.first()
+        repair_data = repair.model_dump()
+        version = repair_data.pop("version", None)
+
+        new_repair = await write_repair(db, customer_id, service_id, repair_id, current_user.id, repair_data, version)
+
+        response.headers["ETag"] = await etag.repair_etag(db, customer_id, service_id, repair_id)
+        await db.commit()
+        return new_repair
 
     except HTTPException as http_error:
         raise http_error
-    
+
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         exception(e)
 
 
 @router.patch("/{repair_id}", response_model=RepairResponse)
-def update_repair(customer_id: int, service_id: int, repair_id: int, repair: RepairPatch, db: Session = Depends(get_db), current_user: TokenData = Depends(get_current_user)):
+async def update_repair(customer_id: int, service_id: int, repair_id: int, repair: RepairPatch, request: Request, response: Response, db: AsyncSession = Depends(get_db), current_user: TokenData = Depends(get_current_user)):
     try:
-        customer = db.query(models.Customer).filter(models.Customer.id == customer_id).first()
-        validate_customer_exists(customer, customer_id)
-        
-        service = db.query(models.ServiceRequest).filter(
-            models.ServiceRequest.id == service_id,
-            models.ServiceRequest.customer_id == customer_id
-            ).first()
-        validate_service_exists(service, service_id)
-        validate_type_of_service(service.type, models.ServiceCreate.repair)
-
-        update_query = db.query(models.Repair).filter(
-            models.Repair.id == repair_id,
-            models.Repair.request_id == service_id
-            )
-        new_repair = update_query.first()
-        validate_repair_exists(new_repair, repair_id)
+        #If-Match - 412 when the repair changed since the client read it, the row stays locked until the UPDATE
+        if etag.IF_MATCH in request.headers:
+            etag.check_if_match(request, await etag.repair_etag(db, customer_id, service_id, repair_id, lock=True))
+
+        repair_data = repair.model_dump(exclude_unset=True)
+        version = repair_data.pop("version", None)
+
+        new_repair = await write_repair(db, customer_id, service_id, repair_id, current_user.id, repair_data, version)
+
+        response.headers["ETag"] = await etag.repair_etag(db, customer_id, service_id, repair_id)
+        await db.commit()
+        return new_repair
 
-        validate_customer_ownership(service.customer_id, current_user.id)
-        
-        #If the update is marked as IN_PROGRESS or COMPLETED, add the current time to finished date
-        repair_data = repair.dict(exclude_unset=True)
-        if repair.status == models.Status.IN_PROGRESS:
-            repair_data["start_date"] = datetime.utcnow()
-        if repair.status == models.Status.COMPLETED:
-            repair_data["finished_date"] = datetime.utcnow()
-
-        #Handles if changing from completed to either in_progres or pending (misinput).
-        elif new_repair.status == models.Status.COMPLETED and repair.status and repair.status != models.Status.COMPLETED:
-            repair_data["finished_date"] = None
-
-        #Handles changes if reverting IN_PROGRESS or COMPLETED back to PENDING
-        if new_repair.status != models.Status.PENDING and repair.status == models.Status.PENDING:
-            repair_data["start_date"] = None
-            
-        update_query.update(repair_data, synchronize_session=False)
-        db.commit()
-        return update_query.first()
-    
     except HTTPException as http_error:
         raise http_error
-    
+
     except Exception as e:
-        db.rollback()
-        exception(e)
\ No newline at end of file
+        await db.rollback()
+        exception(e)
@@ -1,159 +1,189 @@
 
-from fastapi import status, HTTPException, Depends, APIRouter
-from sqlalchemy.orm import Session
+from fastapi import status, HTTPException, Depends, APIRouter, Query, Request, Response
+from sqlalchemy import select, update, delete
+from sqlalchemy.ext.asyncio import AsyncSession
 from ..database import get_db
-from .. import models
-from typing import List
+from ..replicas import get_read_db
+from .. import models, loaders, inventory, aggregates, etag, fieldsets
+from typing import List, Optional
+from datetime import datetime
 from ..oauth2 import get_current_user
 from ..body import Service, TokenData
 from ..update import ServicePatch, ServicePut
 from ..response import ServiceResponse
-from ..status_code import validate_customer_exists, validate_customer_ownership, validate_service_exists, exception
+from ..status_code import validate_customer_ownership, exception
+from ..dependencies import service_chain, valid_customer, explain_service_write, owned_service
+from ..pagination import paginate, DEFAULT_LIMIT, MAX_LIMIT
+from ..instrumentation import query_budget
 
 router = APIRouter(
     prefix="/customers/{customer_id}/services",
     tags=["Services"]
 )
 
-@router.get("/", response_model=List[ServiceResponse])
-def get_service_by_customer(customer_id: int, db: Session = Depends(get_db)):
-    #verify if customer exists by checking if models.Customer.id == customer_id, 
-    #where Customer.id is the id from customers table, and customer_id comes from the URL
-    customer = db.query(models.Customer).filter(models.Customer.id == customer_id).first()
-    validate_customer_exists(customer, customer_id)
+@router.get("/", response_model=List[ServiceResponse], dependencies=[Depends(valid_customer), Depends(query_budget(4))])
+async def get_service_by_customer(customer_id: int, response: Response, limit: int = Query(DEFAULT_LIMIT, ge=1, le=MAX_LIMIT), cursor: Optional[str] = None,
+                                  type: Optional[models.ServiceCreate] = None, date_from: Optional[datetime] = None, date_to: Optional[datetime] = None,
+                                  fields: Optional[str] = None, include: Optional[str] = None, db: AsyncSession = Depends(get_read_db)):
+    #?fields= and ?include= select the columns and relationships that are loaded, see fieldsets.py
+    fieldset = fieldsets.SERVICE.parse(fields, include)
 
+    #customer is verified by the valid_customer dependency
     #filter by customer_id
-    service = db.query(models.ServiceRequest).filter(models.ServiceRequest.customer_id == customer_id).all()
-    return service
+    query = select(models.ServiceRequest).options(*fieldset.options()).where(models.ServiceRequest.customer_id == customer_id)
 
+    #type and date range filters (ix_service_requests_customer_id_type_date)
+    if type:
+        query = query.where(models.ServiceRequest.type == type)
+    if date_from:
+        query = query.where(models.ServiceRequest.date >= date_from)
+    if date_to:
+        query = query.where(models.ServiceRequest.date < date_to)
 
-@router.post("/", status_code=status.HTTP_201_CREATED, response_model=ServiceResponse)
-def create_service(customer_id: int, service: Service, db: Session = Depends(get_db), current_user: TokenData = Depends(get_current_user)):
+    service = await paginate(db, query, (models.ServiceRequest.id,), limit, cursor, response)
+    return fieldset.render_list(service, response)
+
+
+@router.post("/", status_code=status.HTTP_201_CREATED, response_model=ServiceResponse, dependencies=[Depends(valid_customer)])
+async def create_service(customer_id: int, service: Service, db: AsyncSession = Depends(get_db), current_user: TokenData = Depends(get_current_user)):
     try:
-        #verify if customer exists
-        customer = db.query(models.Customer).filter(models.Customer.id == customer_id).first()
-        validate_customer_exists(customer, customer_id)
-        validate_customer_ownership(customer.id, current_user.id)
+        validate_customer_ownership(customer_id, current_user.id)
 
         #since customer_id is not being passed in the postman body, set its value manually
-        service_data = service.dict()
+        service_data = service.model_dump()
         service_data["customer_id"] = customer_id
 
+        #a sale's total_cost comes from its item requests (aggregates.py), it has none yet
+        if service.type == models.ServiceCreate.sale:
+            service_data["total_cost"] = 0
+
         user = models.ServiceRequest(**service_data)
         db.add(user)
-        db.commit()
-        db.refresh(user)
-        return user
+        await db.commit()
+        return await loaders.reload(db, models.ServiceRequest, user.id, loaders.SERVICE_RESPONSE)
 
     except HTTPException as http_error:
         raise http_error
-    
+
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         exception(e)
 
 
-@router.get("/{service_id}", response_model=ServiceResponse)
-def get_service(customer_id: int, service_id: int, db: Session = Depends(get_db)):
-    #verify if customer exists
-    customer = db.query(models.Customer).filter(models.Customer.id == customer_id).first()
-    validate_customer_exists(customer, customer_id)
-    
-    #gets the row based on ServiceRequest id and customer_id coming from service_id and customer_id (URL)
-    #(SELECT * FROM service_requests WHERE id = service_id AND customer_id = customer_id)
-    service = db.query(models.ServiceRequest).filter(
-        models.ServiceRequest.id == service_id,
-        models.ServiceRequest.customer_id == customer_id
-        ).first()
-    validate_service_exists(service, service_id)
+@router.get("/{service_id}", response_model=ServiceResponse, dependencies=[Depends(query_budget(4))])
+async def get_service(customer_id: int, service_id: int, request: Request, response: Response, fields: Optional[str] = None, include: Optional[str] = None,
+                      db: AsyncSession = Depends(get_read_db)):
+    fieldset = fieldsets.SERVICE.parse(fields, include)
+
+    #the client's copy is current, nothing else is loaded (see etag.py)
+    current = await etag.service_etag(db, customer_id, service_id)
+    if fields is not None or include is not None:
+        current = etag.weak(current)
+    not_modified = etag.not_modified(request, current)
+    if not_modified:
+        return not_modified
 
-    return service
+    #verifies the customer and gets the row based on ServiceRequest id and customer_id coming from service_id and customer_id (URL)
+    #in one query, the user is joined in and the repairs/items collections are loaded right after
+    #the user row is joined in by service_chain either way
+    chain = await service_chain(db, customer_id, service_id, options=fieldset.options("user"))
+
+    response.headers["ETag"] = current
+    return fieldset.render(chain.service, response)
 
 
 @router.delete("/{service_id}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_service(customer_id: int, service_id: int, db: Session = Depends(get_db), current_user: TokenData = Depends(get_current_user)):
+async def delete_service(customer_id: int, service_id: int, db: AsyncSession = Depends(get_db), current_user: TokenData = Depends(get_current_user)):
     try:
-        #verify if customer exists
-        customer = db.query(models.Customer).filter(models.Customer.id == customer_id).first()
-        validate_customer_exists(customer, customer_id)
-        
-        #(SELECT * FROM service_requests WHERE id = service_id AND customer_id = customer_id)
-        delete_query = db.query(models.ServiceRequest).filter(
+        #the service is locked first, before the variants its items give stock back to
+        await aggregates.lock_deleted_rows(db, models.ServiceRequest,
             models.ServiceRequest.id == service_id,
-            models.ServiceRequest.customer_id == customer_id
+            models.ServiceRequest.customer_id == customer_id,
+            models.ServiceRequest.customer_id == current_user.id
+            )
+
+        #the item requests go with the service (ON DELETE CASCADE), their stock goes back to the variants
+        await inventory.restore_items_stock(db,
+            models.ItemRequest.request_id == service_id,
+            owned_service(customer_id, service_id, current_user.id)
             )
-        
-        service = delete_query.first()
-        validate_service_exists(service, service_id)
-        validate_customer_ownership(service.customer_id, current_user.id)
 
-        delete_query.delete(synchronize_session=False)
-        db.commit()
+        #(DELETE FROM service_requests WHERE id = service_id AND customer_id = customer_id AND customer_id = current_user.id RETURNING id)
+        deleted = await db.scalar(delete(models.ServiceRequest).where(
+            models.ServiceRequest.id == service_id,
+            models.ServiceRequest.customer_id == customer_id,
+            models.ServiceRequest.customer_id == current_user.id
+            ).returning(models.ServiceRequest.id).execution_options(synchronize_session=False))
+        if not deleted:
+            await explain_service_write(db, customer_id, service_id, current_user.id)
+
+        await db.commit()
         return
 
     except HTTPException as http_error:
         raise http_error
-    
+
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         exception(e)
 
 
 @router.put("/{service_id}", response_model=ServiceResponse)
-def update_service(customer_id: int, service_id: int, service: ServicePut, db: Session = Depends(get_db), current_user: TokenData = Depends(get_current_user)):
+async def update_service(customer_id: int, service_id: int, service: ServicePut, request: Request, response: Response, db: AsyncSession = Depends(get_db), current_user: TokenData = Depends(get_current_user)):
     try:
-        #verify if customer exists
-        customer = db.query(models.Customer).filter(models.Customer.id == customer_id).first()
-        validate_customer_exists(customer, customer_id)
-        
-        put_query = db.query(models.ServiceRequest).filter(
+        #If-Match - 412 when the service changed since the client read it, the row stays locked until the UPDATE
+        if etag.IF_MATCH in request.headers:
+            etag.check_if_match(request, await etag.service_etag(db, customer_id, service_id, lock=True))
+
+        #(UPDATE service_requests SET ... WHERE id = service_id AND customer_id = customer_id AND customer_id = current_user.id RETURNING *)
+        put_query = update(models.ServiceRequest).where(
             models.ServiceRequest.id == service_id,
-            models.ServiceRequest.customer_id == customer_id
-        )
+            models.ServiceRequest.customer_id == customer_id,
+            models.ServiceRequest.customer_id == current_user.id
+            )
 
-        new_service = put_query.first()
-        validate_service_exists(new_service, service_id)
-        validate_customer_ownership(new_service.customer_id, current_user.id)
-        
-        put_query.update(service.dict(), synchronize_session=False)
-        db.commit()
+        new_service = await loaders.returning(db, put_query.values(aggregates.service_total_values(service.model_dump())).returning(models.ServiceRequest), loaders.SERVICE_RELATIONSHIPS)
+        if not new_service:
+            await explain_service_write(db, customer_id, service_id, current_user.id)
 
-        return put_query.first()
+        response.headers["ETag"] = await etag.service_etag(db, customer_id, service_id)
+        await db.commit()
+        return new_service
 
     except HTTPException as http_error:
         raise http_error
-    
+
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         exception(e)
 
 
 @router.patch("/{service_id}", response_model=ServiceResponse)
-def update_service(customer_id: int, service_id: int, service:ServicePatch, db: Session = Depends(get_db), current_user: TokenData = Depends(get_current_user)):
+async def update_service(customer_id: int, service_id: int, service:ServicePatch, request: Request, response: Response, db: AsyncSession = Depends(get_db), current_user: TokenData = Depends(get_current_user)):
     try:
-        #verify if customer exists
-        customer = db.query(models.Customer).filter(models.Customer.id == customer_id).first()
-        validate_customer_exists(customer, customer_id)
-        
-        #(SELECT * FROM service_requests WHERE id = service_id AND customer_id = customer_id)
-        patch_query = db.query(models.ServiceRequest).filter(
+        #If-Match - 412 when the service changed since the client read it, the row stays locked until the UPDATE
+        if etag.IF_MATCH in request.headers:
+            etag.check_if_match(request, await etag.service_etag(db, customer_id, service_id, lock=True))
+
+        #(UPDATE service_requests SET ... WHERE id = service_id AND customer_id = customer_id AND customer_id = current_user.id RETURNING *)
+        patch_query = update(models.ServiceRequest).where(
             models.ServiceRequest.id == service_id,
-            models.ServiceRequest.customer_id == customer_id
+            models.ServiceRequest.customer_id == customer_id,
+            models.ServiceRequest.customer_id == current_user.id
             )
-        
-        new_service = patch_query.first()
-        validate_service_exists(new_service, service_id)
-        validate_customer_ownership(new_service.customer_id, current_user.id)
-        
-        patch_query.update(service.dict(exclude_unset=True), synchronize_session=False)
-        db.commit()
 
-        return patch_query.first()
+        new_service = await loaders.returning(db, patch_query.values(aggregates.service_total_values(service.model_dump(exclude_unset=True))).returning(models.ServiceRequest), loaders.SERVICE_RELATIONSHIPS)
+        if not new_service:
+            await explain_service_write(db, customer_id, service_id, current_user.id)
+
+        response.headers["ETag"] = await etag.service_etag(db, customer_id, service_id)
+        await db.commit()
+        return new_service
 
     except HTTPException as http_error:
         raise http_error
-    
+
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         exception(e)
 
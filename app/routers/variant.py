@@ -1,12 +1,18 @@
-from fastapi import status, HTTPException, APIRouter, Depends
-from sqlalchemy.orm import Session
+from fastapi import status, HTTPException, APIRouter, Depends, Query, Request, Response
+from sqlalchemy import select, update, delete
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
 from ..database import get_db
-from .. import models
-from typing import List
+from ..replicas import get_read_db
+from .. import models, loaders, aggregates, cache
+from typing import List, Optional
 from ..body import Variant
 from ..update import VariantPatch, VariantPut
-from ..response import VariantResponse
-from ..status_code import validate_product_exists, validate_variant_exists, exception
+from ..response import VariantResponse, VARIANT_LIST
+from ..status_code import exception, unique_violation, concurrent_write
+from ..dependencies import variant_chain, valid_product
+from ..pagination import paginate, DEFAULT_LIMIT, MAX_LIMIT
+from ..instrumentation import query_budget
 
 
 router = APIRouter(
@@ -14,137 +20,158 @@ router = APIRouter(
     tags=["Product Variants"]
 )
 
+#409 detail of the variant writes
+UNIQUE_CONSTRAINTS = {"unique_product_variant": "The product already has a variant with this size and color"}
+
+
+#PUT/PATCH - updates the variant and adds its stock difference to the product's stock (aggregates.py)
+async def write_variant(db: AsyncSession, product_id: int, variant_id: int, variant_data: dict):
+    #the stock before the update, read and locked in the UPDATE's FROM clause
+    old_variant = (select(models.ProductVariant.id, models.ProductVariant.stock_quantity)
+        .where(models.ProductVariant.id == variant_id)
+        .with_for_update(key_share=True)
+        .subquery("old_variant"))
+
+    #(UPDATE product_variants SET ... WHERE id = variant_id AND product_id = product_id RETURNING *)
+    update_query = update(models.ProductVariant).where(
+        models.ProductVariant.id == old_variant.c.id,
+        models.ProductVariant.product_id == product_id
+        )
+    row = await loaders.returning_row(db, update_query.values(variant_data).returning(models.ProductVariant, old_variant.c.stock_quantity))
+    if not row:
+        #404 for the product or the variant
+        await variant_chain(db, product_id, variant_id)
+        concurrent_write("Product variant", variant_id)
+
+    new_variant, old_stock = row
+    await aggregates.adjust_product_stock(db, product_id, new_variant.stock_quantity - old_stock)
+    cache.invalidate_product(db, product_id)
+
+    #the product is loaded after its stock moved, for the response
+    await db.refresh(new_variant, attribute_names=loaders.VARIANT_RELATIONSHIPS)
+    return new_variant
+
+
+@router.get("/", response_model=List[VariantResponse], dependencies=[Depends(query_budget(2))])
+async def get_variants_by_product(product_id: int, request: Request, response: Response, limit: int = Query(DEFAULT_LIMIT, ge=1, le=MAX_LIMIT), cursor: Optional[str] = None,
+                                  db: AsyncSession = Depends(get_read_db)):
+    cached = cache.lookup(request)
+    if cached:
+        return cached
+
+    #product is verified here rather than by the valid_product dependency, so a cache hit runs no query
+    await variant_chain(db, product_id)
 
-@router.get("/", response_model=List[VariantResponse])
-def get_variants_by_product(product_id: int, db: Session = Depends(get_db)):
-    # verify if product exists by checking if models.Product.id == product_id, 
-    # where Product.id is the id from products table, and product_id comes from the URL
-    product = db.query(models.Product).filter(models.Product.id == product_id).first()
-    validate_product_exists(product, product_id)
-    
     #filter by product_id
-    query = db.query(models.ProductVariant).filter(models.ProductVariant.product_id == product_id).all()
-    return query
+    query = select(models.ProductVariant).options(*loaders.VARIANT_RESPONSE).where(models.ProductVariant.product_id == product_id)
+    query = await paginate(db, query, (models.ProductVariant.id,), limit, cursor, response)
+    return cache.store(request, db, VARIANT_LIST, query, response)
 
 
-@router.post("/", status_code=status.HTTP_201_CREATED, response_model=VariantResponse)
-def post_variant(product_id: int, variant: Variant, db: Session = Depends(get_db)):
+@router.post("/", status_code=status.HTTP_201_CREATED, response_model=VariantResponse, dependencies=[Depends(valid_product)])
+async def post_variant(product_id: int, variant: Variant, db: AsyncSession = Depends(get_db)):
     try:
-        #verify if product exists
-        product = db.query(models.Product).filter(models.Product.id == product_id).first()
-        validate_product_exists(product, product_id)
-        
         #since product_id is not being passed in the postman body, set its value manually
-        variant_data = variant.dict()
+        variant_data = variant.model_dump()
         variant_data["product_id"] = product_id
 
         variant = models.ProductVariant(**variant_data)
         db.add(variant)
-        db.commit()
-        db.refresh(variant)
-        return variant
+        await db.flush()
+
+        await aggregates.adjust_product_stock(db, product_id, variant.stock_quantity)
+        cache.invalidate_product(db, product_id)
+        await db.commit()
+        return await loaders.reload(db, models.ProductVariant, variant.id, loaders.VARIANT_RESPONSE)
 
     except HTTPException as http_error:
         raise http_error
-    
+
+    except IntegrityError as e:
+        await db.rollback()
+        unique_violation(e, UNIQUE_CONSTRAINTS)
+
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         exception(e)
 
 
-@router.get("/{variant_id}", response_model=VariantResponse)
-def get_one_variant(product_id: int, variant_id: int, db: Session = Depends(get_db)):
-    #verify if product exists
-    product = db.query(models.Product).filter(models.Product.id == product_id).first()
-    validate_product_exists(product, product_id)
-    
-    #gets the row based on productvariant id and product_id coming from variant_id and product_id (URL)
-    #(SELECT * FROM product_variants WHERE id = variant_id AND product_id = product_id)
-    variant = db.query(models.ProductVariant).filter(
-        models.ProductVariant.id == variant_id,
-        models.ProductVariant.product_id == product_id
-        ).first()
-    validate_variant_exists(variant, variant_id)
-    
-    return variant
+@router.get("/{variant_id}", response_model=VariantResponse, dependencies=[Depends(query_budget(1))])
+async def get_one_variant(product_id: int, variant_id: int, db: AsyncSession = Depends(get_read_db)):
+    #verifies the product and gets the row based on productvariant id and product_id coming from variant_id and product_id (URL)
+    #in one query, the product is joined in for the response
+    chain = await variant_chain(db, product_id, variant_id)
+
+    return chain.variant
 
 
 @router.delete("/{variant_id}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_variant(product_id: int, variant_id: int, db: Session = Depends(get_db)):
+async def delete_variant(product_id: int, variant_id: int, db: AsyncSession = Depends(get_db)):
     try:
-        #verify if product exists
-        product = db.query(models.Product).filter(models.Product.id == product_id).first()
-        validate_product_exists(product, product_id)
-        
-        #(SELECT * FROM product_variants WHERE id = variant_id AND product_id = product_id)
-        delete_query = db.query(models.ProductVariant).filter(
+        #the variant's item requests go with it (ON DELETE CASCADE), their cost comes off the sales' totals first
+        await aggregates.remove_items_totals(db, models.ItemRequest.product_variant_id.in_(
+            select(models.ProductVariant.id).where(models.ProductVariant.id == variant_id, models.ProductVariant.product_id == product_id)
+            ))
+
+        #(DELETE FROM product_variants WHERE id = variant_id AND product_id = product_id RETURNING stock_quantity)
+        deleted = (await db.execute(delete(models.ProductVariant).where(
             models.ProductVariant.id == variant_id,
             models.ProductVariant.product_id == product_id
-            )
-        variant = delete_query.first()
-        validate_variant_exists(variant, variant_id)
-        
-        delete_query.delete(synchronize_session=False)
-        db.commit()
+            ).returning(models.ProductVariant.stock_quantity).execution_options(synchronize_session=False))).first()
+        if not deleted:
+            #404 for the product or the variant
+            await variant_chain(db, product_id, variant_id)
+            concurrent_write("Product variant", variant_id)
+
+        await aggregates.adjust_product_stock(db, product_id, -deleted.stock_quantity)
+        cache.invalidate_product(db, product_id)
+
+        await db.commit()
         return
 
     except HTTPException as http_error:
         raise http_error
-    
+
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         exception(e)
 
 
 @router.put("/{variant_id}", response_model=VariantResponse)
-def update_variant(product_id: int, variant_id: int, variant: VariantPut, db: Session = Depends(get_db)):
+async def update_variant(product_id: int, variant_id: int, variant: VariantPut, db: AsyncSession = Depends(get_db)):
     try:
-        #verify if product exists
-        product = db.query(models.Product).filter(models.Product.id == product_id).first()
-        validate_product_exists(product, product_id)
-        
-        #(SELECT * FROM product_variants WHERE id = variant_id AND product_id = product_id)
-        update_query = db.query(models.ProductVariant).filter(
-            models.ProductVariant.id == variant_id,
-            models.ProductVariant.product_id == product_id
-            )
-        new_variant = update_query.first()
-        validate_variant_exists(new_variant, variant_id)
-        
-        update_query.update(variant.dict(), synchronize_session=False)
-        db.commit()
-        return update_query.first()
+        new_variant = await write_variant(db, product_id, variant_id, variant.model_dump())
+
+        await db.commit()
+        return new_variant
 
     except HTTPException as http_error:
         raise http_error
-    
+
+    except IntegrityError as e:
+        await db.rollback()
+        unique_violation(e, UNIQUE_CONSTRAINTS)
+
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         exception(e)
 
 
 @router.patch("/{variant_id}", response_model=VariantResponse)
-def update_variant(product_id: int, variant_id: int, variant: VariantPatch, db: Session = Depends(get_db)):
+async def update_variant(product_id: int, variant_id: int, variant: VariantPatch, db: AsyncSession = Depends(get_db)):
     try:
-        #verify if product exists
-        product = db.query(models.Product).filter(models.Product.id == product_id).first()
-        validate_product_exists(product, product_id)
-        
-        #(SELECT * FROM product_variants WHERE id = variant_id AND product_id = product_id)
-        update_query = db.query(models.ProductVariant).filter(
-            models.ProductVariant.id == variant_id,
-            models.ProductVariant.product_id == product_id
-            )
-        new_variant = update_query.first()
-        validate_variant_exists(new_variant, variant_id)
-        
-        update_query.update(variant.dict(exclude_unset=True), synchronize_session=False)
-        db.commit()
-        return update_query.first()
+        new_variant = await write_variant(db, product_id, variant_id, variant.model_dump(exclude_unset=True))
+
+        await db.commit()
+        return new_variant
 
     except HTTPException as http_error:
         raise http_error
-    
+
+    except IntegrityError as e:
+        await db.rollback()
+        unique_violation(e, UNIQUE_CONSTRAINTS)
+
     except Exception as e:
-        db.rollback()
-        exception(e)
\ No newline at end of file
+        await db.rollback()
+        exception(e)
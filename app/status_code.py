@@ -4,6 +4,24 @@ def exception(e):
     print(f"Request error {e}")
     raise HTTPException(status_code=500, detail=f"Something went wrong")
 
+#409 for an IntegrityError from one of the unique constraints - {constraint name: detail}, anything else is a 500
+def unique_violation(e, constraints: dict):
+    for name, detail in constraints.items():
+        if name in str(e.orig):
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail=detail
+            )
+
+    exception(e)
+
+#a guarded write matched no row, but the row passes every check of the explanation - it changed in between
+def concurrent_write(resource: str, id: int):
+    raise HTTPException(
+        status_code=status.HTTP_409_CONFLICT,
+        detail=f"{resource} with id {id} was modified by another request, try again"
+    )
+
 #check if repair exists in database
 def validate_repair_exists(repair, repair_id: int = None):
     if not repair:
@@ -16,11 +16,11 @@ class ServicePut(BaseModel):
     type: ServiceCreate
     total_cost: float = 0
 
+#no stock_quantity in the product writes - a product's stock is the sum of its variants' (aggregates.py)
 class ValidProductPut(BaseModel):
     name: str
     description: str
     price: float
-    stock_quantity: int = 0
 
 class VariantPut(BaseModel):
     size: str
@@ -30,6 +30,7 @@ class VariantPut(BaseModel):
 class RepairPut(BaseModel):
     description: str
     status: Status
+    version: Optional[int] = None   #the version the client read, 409 when the repair changed since
 
 class ItemRequestPut(BaseModel):
     product_variant_id: int
@@ -53,7 +54,6 @@ class ValidProductPatch(BaseModel):
     name: Optional[str] = None
     description: Optional[str] = None
     price: Optional[float] = None
-    stock_quantity: Optional[int] = None
 
 class VariantPatch(BaseModel):
     size: Optional[str] = None
@@ -63,6 +63,7 @@ class VariantPatch(BaseModel):
 class RepairPatch(BaseModel):
     description: Optional[str] = None
     status: Optional[Status] = None
+    version: Optional[int] = None   #the version the client read, 409 when the repair changed since
 
 class ItemRequestPatch(BaseModel):
     product_variant_id: Optional[int] = None
@@ -1,9 +1,69 @@
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from fastapi import status, HTTPException
 from passlib.context import CryptContext
+from .config import settings
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+#new hashes use settings.bcrypt_rounds, a hash of any other cost needs an update and is rehashed at login (verify_and_update)
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto",
+                           bcrypt__default_rounds=settings.bcrypt_rounds,
+                           bcrypt__min_rounds=settings.bcrypt_rounds,
+                           bcrypt__max_rounds=settings.bcrypt_rounds)
 
 def hash(password: str):
     return pwd_context.hash(password)
 
 def verify(plain_pw, hashed_pw):
-    return pwd_context.verify(plain_pw, hashed_pw)
\ No newline at end of file
+    return pwd_context.verify(plain_pw, hashed_pw)
+
+#(matches, new hash or None)
+def verify_and_update(plain_pw, hashed_pw):
+    return pwd_context.verify_and_update(plain_pw, hashed_pw)
+
+
+#Password work pool.
+#bcrypt is CPU bound, each hash/verify runs in a process of its own pool instead of the threadpool (where it would hold
+#threadpool workers and the GIL), settings.password_workers processes at a time.
+#At most settings.password_queue_depth more calls wait for a process, past that requests are shed with a 503 right away
+#instead of piling up behind a login burst.
+
+pool = None
+slots = asyncio.Semaphore(settings.password_workers + settings.password_queue_depth)
+
+
+def password_pool():
+    global pool
+    if pool is None:
+        #spawn - the worker processes don't inherit the event loop and the connection pool of this one
+        pool = ProcessPoolExecutor(max_workers=settings.password_workers, mp_context=multiprocessing.get_context("spawn"))
+    return pool
+
+
+#called from the lifespan in main.py
+def shutdown_password_pool():
+    global pool
+    if pool is not None:
+        pool.shutdown(cancel_futures=True)
+        pool = None
+
+
+async def run_password_work(function, *args):
+    if slots.locked():
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many password requests, try again shortly",
+            headers={"Retry-After": "1"}
+        )
+
+    async with slots:
+        return await asyncio.get_running_loop().run_in_executor(password_pool(), function, *args)
+
+
+async def hash_password(password: str):
+    return await run_password_work(hash, password)
+
+
+#(matches, new hash or None) - a new hash when the stored one was made with other bcrypt rounds
+async def verify_password(plain_pw, hashed_pw):
+    return await run_password_work(verify_and_update, plain_pw, hashed_pw)
@@ -0,0 +1,108 @@
+"""baseline - the tables as created by create_all before migrations
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-17
+
+A database that was created by create_all from the original models is already at this revision:
+    alembic stamp 0001
+    alembic upgrade head
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "customers",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("name", sa.String(), nullable=False),
+        sa.Column("email", sa.String(), nullable=False),
+        sa.Column("password", sa.String(), nullable=False),
+        sa.Column("address", sa.String(), nullable=False),
+        sa.Column("created_at", sa.TIMESTAMP(timezone=True), server_default=sa.text("now()"), nullable=False),
+        sa.PrimaryKeyConstraint("id"),
+        sa.UniqueConstraint("email")
+    )
+
+    op.create_table(
+        "service_requests",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("customer_id", sa.Integer(), nullable=False),
+        sa.Column("total_cost", sa.Float(), nullable=True),
+        sa.Column("date", sa.TIMESTAMP(timezone=True), server_default=sa.text("now()"), nullable=False),
+        sa.Column("type", sa.Enum("sale", "repair", name="service_enum"), nullable=False),
+        sa.ForeignKeyConstraint(["customer_id"], ["customers.id"], ondelete="CASCADE"),
+        sa.PrimaryKeyConstraint("id")
+    )
+
+    op.create_table(
+        "products",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("name", sa.String(), nullable=False),
+        sa.Column("description", sa.String(), nullable=False),
+        sa.Column("price", sa.Float(), nullable=False),
+        sa.Column("stock_quantity", sa.Integer(), server_default=sa.text("0"), nullable=False),
+        sa.Column("created_at", sa.TIMESTAMP(timezone=True), server_default=sa.text("now()"), nullable=False),
+        sa.CheckConstraint("price >= 0", name="check_positive_price"),
+        sa.CheckConstraint("stock_quantity >= 0", name="check_stock_positive"),
+        sa.PrimaryKeyConstraint("id")
+    )
+
+    op.create_table(
+        "product_variants",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("product_id", sa.Integer(), nullable=False),
+        sa.Column("size", sa.String(), nullable=False),
+        sa.Column("color", sa.String(), nullable=False),
+        sa.Column("stock_quantity", sa.Integer(), server_default=sa.text("0"), nullable=False),
+        sa.CheckConstraint("stock_quantity >= 0", name="check_variant_stock_positive"),
+        sa.ForeignKeyConstraint(["product_id"], ["products.id"], ondelete="CASCADE"),
+        sa.PrimaryKeyConstraint("id")
+    )
+
+    op.create_table(
+        "repairs",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("request_id", sa.Integer(), nullable=False),
+        sa.Column("description", sa.String(), nullable=False),
+        sa.Column("status", sa.Enum("PENDING", "IN_PROGRESS", "COMPLETED", name="repair_enum"), nullable=True),
+        sa.Column("created_at", sa.TIMESTAMP(timezone=True), server_default=sa.text("now()"), nullable=False),
+        sa.Column("start_date", sa.TIMESTAMP(timezone=True), nullable=True),
+        sa.Column("finished_date", sa.TIMESTAMP(timezone=True), nullable=True),
+        sa.ForeignKeyConstraint(["request_id"], ["service_requests.id"], ondelete="CASCADE"),
+        sa.PrimaryKeyConstraint("id")
+    )
+
+    op.create_table(
+        "item_requests",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("request_id", sa.Integer(), nullable=False),
+        sa.Column("product_variant_id", sa.Integer(), nullable=False),
+        sa.Column("quantity", sa.Integer(), nullable=False),
+        sa.Column("unit_price", sa.Float(), nullable=False),
+        sa.Column("created_at", sa.TIMESTAMP(timezone=True), server_default=sa.text("now()"), nullable=False),
+        sa.CheckConstraint("quantity > 0", name="check_positive_quantity"),
+        sa.CheckConstraint("unit_price >= 0", name="check_positive_price"),
+        sa.ForeignKeyConstraint(["product_variant_id"], ["product_variants.id"], ondelete="CASCADE"),
+        sa.ForeignKeyConstraint(["request_id"], ["service_requests.id"], ondelete="CASCADE"),
+        sa.PrimaryKeyConstraint("id"),
+        sa.UniqueConstraint("request_id", "product_variant_id", name="unique_request_variant")
+    )
+
+
+def downgrade():
+    op.drop_table("item_requests")
+    op.drop_table("repairs")
+    op.drop_table("product_variants")
+    op.drop_table("products")
+    op.drop_table("service_requests")
+    op.drop_table("customers")
+
+    sa.Enum(name="repair_enum").drop(op.get_bind())
+    sa.Enum(name="service_enum").drop(op.get_bind())
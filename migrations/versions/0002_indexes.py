@@ -0,0 +1,92 @@
+"""foreign key, list filter and merge key indexes
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-17
+
+Every index is built with CREATE INDEX CONCURRENTLY, so the tables stay writable while it runs.
+CONCURRENTLY can't run inside a transaction, hence the autocommit blocks. A build that fails halfway leaves an
+INVALID index behind - drop it and run the upgrade again.
+Rows that would violate the unique constraints are looked for first, the upgrade stops before building anything
+and lists them - merge or rename them and run the upgrade again.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+#name, table, columns, partial index predicate
+INDEXES = [
+    #created_at range filters of GET /customers/ and GET /products/
+    ("ix_customers_created_at", "customers", ["created_at"], None),
+    ("ix_products_created_at", "products", ["created_at"], None),
+
+    #foreign keys, with id for the keyset pagination of the nested list endpoints
+    ("ix_service_requests_customer_id_id", "service_requests", ["customer_id", "id"], None),
+    ("ix_service_requests_customer_id_type_date", "service_requests", ["customer_id", "type", "date"], None),
+    ("ix_product_variants_product_id_id", "product_variants", ["product_id", "id"], None),
+    ("ix_repairs_request_id_id", "repairs", ["request_id", "id"], None),
+    ("ix_item_requests_request_id_id", "item_requests", ["request_id", "id"], None),
+    ("ix_item_requests_product_variant_id", "item_requests", ["product_variant_id"], None),
+
+    #GET /products/?in_stock=true
+    ("ix_products_in_stock", "products", ["id"], "stock_quantity > 0"),
+]
+
+#merge keys of the catalog import, the unique index is built concurrently and then attached as the constraint
+UNIQUE_CONSTRAINTS = [
+    ("unique_product_name", "products", ["name"]),
+    ("unique_product_variant", "product_variants", ["product_id", "size", "color"]),
+]
+
+#duplicate keys listed per constraint, the count is always exact
+MAX_REPORTED_DUPLICATES = 20
+
+
+#SELECT columns, count(*) FROM table GROUP BY columns HAVING count(*) > 1 - NULLs never conflict in a unique index
+def find_duplicates(table, columns):
+    keys = ", ".join(columns)
+    not_null = " AND ".join(f"{column} IS NOT NULL" for column in columns)
+    return op.get_bind().execute(sa.text(
+        f"SELECT {keys}, count(*) AS copies FROM {table} WHERE {not_null} GROUP BY {keys} HAVING count(*) > 1 ORDER BY {keys}"
+    )).all()
+
+
+def check_duplicates():
+    #offline (--sql) upgrades have no database to look at
+    if op.get_context().as_sql:
+        return
+
+    problems = []
+    for name, table, columns in UNIQUE_CONSTRAINTS:
+        duplicates = find_duplicates(table, columns)
+        if duplicates:
+            listed = "\n".join(f"    {dict(zip(columns, row[:-1]))} - {row[-1]} rows" for row in duplicates[:MAX_REPORTED_DUPLICATES])
+            problems.append(f"{name}: {len(duplicates)} duplicate {', '.join(columns)} values in {table}\n{listed}")
+
+    if problems:
+        raise RuntimeError("Duplicate rows prevent the unique constraints, resolve them and upgrade again:\n" + "\n".join(problems))
+
+
+def upgrade():
+    check_duplicates()
+
+    with op.get_context().autocommit_block():
+        for name, table, columns, where in INDEXES:
+            op.create_index(name, table, columns, postgresql_concurrently=True, postgresql_where=sa.text(where) if where else None, if_not_exists=True)
+
+        for name, table, columns in UNIQUE_CONSTRAINTS:
+            op.create_index(name, table, columns, unique=True, postgresql_concurrently=True, if_not_exists=True)
+            op.execute(f"ALTER TABLE {table} ADD CONSTRAINT {name} UNIQUE USING INDEX {name}")
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        for name, table, columns in reversed(UNIQUE_CONSTRAINTS):
+            op.drop_constraint(name, table, type_="unique")
+
+        for name, table, columns, where in reversed(INDEXES):
+            op.drop_index(name, table_name=table, postgresql_concurrently=True, if_exists=True)
@@ -0,0 +1,49 @@
+"""backfill the aggregates maintained by the API
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-17
+
+Sale totals and product stock were client-written before, they are recounted once here
+and kept up to date by the routers from then on (app/aggregates.py).
+"""
+from alembic import op
+
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    #service_requests.total_cost of a sale - sum of quantity * unit_price of its item requests
+    op.execute("""
+        UPDATE service_requests SET total_cost = COALESCE(totals.total, 0)
+        FROM service_requests AS sales
+        LEFT JOIN (
+            SELECT request_id, SUM(quantity * unit_price) AS total
+            FROM item_requests
+            GROUP BY request_id
+        ) AS totals ON totals.request_id = sales.id
+        WHERE service_requests.id = sales.id
+        AND sales.type = 'sale'
+        AND service_requests.total_cost IS DISTINCT FROM COALESCE(totals.total, 0)
+    """)
+
+    #products.stock_quantity - sum of stock_quantity of its variants
+    op.execute("""
+        UPDATE products SET stock_quantity = COALESCE(stocks.total, 0)
+        FROM products AS counted
+        LEFT JOIN (
+            SELECT product_id, SUM(stock_quantity) AS total
+            FROM product_variants
+            GROUP BY product_id
+        ) AS stocks ON stocks.product_id = counted.id
+        WHERE products.id = counted.id
+        AND products.stock_quantity != COALESCE(stocks.total, 0)
+    """)
+
+
+def downgrade():
+    #the previous values were client-written and are not kept
+    pass
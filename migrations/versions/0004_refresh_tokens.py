@@ -0,0 +1,37 @@
+"""refresh tokens
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-17
+
+Rotating refresh tokens issued by /login and /token/refresh (app/oauth2.py), stored as the SHA-256 of the token.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0004"
+down_revision = "0003"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "refresh_tokens",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("customer_id", sa.Integer(), nullable=False),
+        sa.Column("token_hash", sa.String(), nullable=False),
+        sa.Column("created_at", sa.TIMESTAMP(timezone=True), server_default=sa.text("now()"), nullable=False),
+        sa.Column("expires_at", sa.TIMESTAMP(timezone=True), nullable=False),
+        sa.Column("revoked_at", sa.TIMESTAMP(timezone=True), nullable=True),
+        sa.ForeignKeyConstraint(["customer_id"], ["customers.id"], ondelete="CASCADE"),
+        sa.PrimaryKeyConstraint("id"),
+        sa.UniqueConstraint("token_hash", name="unique_refresh_token_hash")
+    )
+
+    op.create_index("ix_refresh_tokens_customer_id", "refresh_tokens", ["customer_id"])
+
+
+def downgrade():
+    op.drop_index("ix_refresh_tokens_customer_id", table_name="refresh_tokens")
+    op.drop_table("refresh_tokens")
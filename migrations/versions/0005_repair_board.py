@@ -0,0 +1,35 @@
+"""partial indexes of the repair board
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-17
+
+GET /repairs/ lists the pending or in progress repairs by created_at. Each status has a partial index,
+so the completed repairs (most of the table) are never scanned or indexed for it.
+Built concurrently like the indexes of 0002.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0005"
+down_revision = "0004"
+branch_labels = None
+depends_on = None
+
+#name, partial index predicate - repair_enum stores the names of app.models.Status
+INDEXES = [
+    ("ix_repairs_pending_created_at", "status = 'PENDING'"),
+    ("ix_repairs_in_progress_created_at", "status = 'IN_PROGRESS'"),
+]
+
+
+def upgrade():
+    with op.get_context().autocommit_block():
+        for name, where in INDEXES:
+            op.create_index(name, "repairs", ["created_at", "id"], postgresql_concurrently=True, postgresql_where=sa.text(where), if_not_exists=True)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        for name, where in reversed(INDEXES):
+            op.drop_index(name, table_name="repairs", postgresql_concurrently=True, if_exists=True)
@@ -0,0 +1,24 @@
+"""repair version column
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-17
+
+repairs.version is incremented by every update, status changes are applied only if it is still the version they were
+computed from (app/repair_states.py). A constant default doesn't rewrite the table.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0006"
+down_revision = "0005"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column("repairs", sa.Column("version", sa.Integer(), server_default=sa.text("0"), nullable=False))
+
+
+def downgrade():
+    op.drop_column("repairs", "version")
@@ -0,0 +1,123 @@
+"""daily sales rollup
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-17
+
+sales_daily_rollup holds the sales per day and variant read by the /analytics endpoints, sales_dirty_days the days whose
+rollup is out of date. The triggers below mark the days, app/analytics.py refreshes them. Every day with sales is marked
+here, the first refresh builds the whole rollup (or python -m app.analytics refresh right after the upgrade).
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0007"
+down_revision = "0006"
+branch_labels = None
+depends_on = None
+
+#statement level - one INSERT per statement however many item requests it writes (POST .../items/bulk)
+ITEM_TRIGGER_FUNCTION = """
+    CREATE FUNCTION mark_item_sales_dirty() RETURNS trigger LANGUAGE plpgsql AS $$
+    BEGIN
+        IF TG_OP IN ('INSERT', 'UPDATE') THEN
+            INSERT INTO sales_dirty_days (day)
+            SELECT DISTINCT (service_requests.date AT TIME ZONE 'UTC')::date
+            FROM new_rows JOIN service_requests ON service_requests.id = new_rows.request_id
+            WHERE service_requests.type = 'sale';
+        END IF;
+
+        IF TG_OP IN ('UPDATE', 'DELETE') THEN
+            INSERT INTO sales_dirty_days (day)
+            SELECT DISTINCT (service_requests.date AT TIME ZONE 'UTC')::date
+            FROM old_rows JOIN service_requests ON service_requests.id = old_rows.request_id
+            WHERE service_requests.type = 'sale';
+        END IF;
+
+        RETURN NULL;
+    END $$
+"""
+
+#row level, only for the rows matching the triggers' WHEN - a deleted sale (its item requests are deleted by the cascade
+#after it, the item trigger no longer finds the service), and a sale moved to another day or type
+SERVICE_TRIGGER_FUNCTION = """
+    CREATE FUNCTION mark_service_sales_dirty() RETURNS trigger LANGUAGE plpgsql AS $$
+    BEGIN
+        IF OLD.type = 'sale' THEN
+            INSERT INTO sales_dirty_days (day) VALUES ((OLD.date AT TIME ZONE 'UTC')::date);
+        END IF;
+
+        IF TG_OP = 'UPDATE' AND NEW.type = 'sale' THEN
+            INSERT INTO sales_dirty_days (day) VALUES ((NEW.date AT TIME ZONE 'UTC')::date);
+        END IF;
+
+        RETURN NULL;
+    END $$
+"""
+
+TRIGGERS = [
+    """CREATE TRIGGER item_requests_sales_insert AFTER INSERT ON item_requests
+        REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION mark_item_sales_dirty()""",
+    """CREATE TRIGGER item_requests_sales_update AFTER UPDATE ON item_requests
+        REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION mark_item_sales_dirty()""",
+    """CREATE TRIGGER item_requests_sales_delete AFTER DELETE ON item_requests
+        REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT EXECUTE FUNCTION mark_item_sales_dirty()""",
+    """CREATE TRIGGER service_requests_sales_update AFTER UPDATE OF date, type ON service_requests
+        FOR EACH ROW WHEN (OLD.date IS DISTINCT FROM NEW.date OR OLD.type IS DISTINCT FROM NEW.type)
+        EXECUTE FUNCTION mark_service_sales_dirty()""",
+    """CREATE TRIGGER service_requests_sales_delete AFTER DELETE ON service_requests
+        FOR EACH ROW WHEN (OLD.type = 'sale')
+        EXECUTE FUNCTION mark_service_sales_dirty()""",
+]
+
+
+def upgrade():
+    op.create_table(
+        "sales_daily_rollup",
+        sa.Column("day", sa.Date(), nullable=False),
+        sa.Column("product_variant_id", sa.Integer(), nullable=False),
+        sa.Column("product_id", sa.Integer(), nullable=False),
+        sa.Column("quantity", sa.BigInteger(), nullable=False),
+        sa.Column("revenue", sa.Float(), nullable=False),
+        sa.Column("items", sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint("day", "product_variant_id")
+    )
+    op.create_index("ix_sales_daily_rollup_product_id_day", "sales_daily_rollup", ["product_id", "day"])
+
+    op.create_table(
+        "sales_dirty_days",
+        sa.Column("id", sa.BigInteger(), sa.Identity(), nullable=False),
+        sa.Column("day", sa.Date(), nullable=False),
+        sa.PrimaryKeyConstraint("id")
+    )
+
+    op.execute(ITEM_TRIGGER_FUNCTION)
+    op.execute(SERVICE_TRIGGER_FUNCTION)
+    for trigger in TRIGGERS:
+        op.execute(trigger)
+
+    op.execute("""
+        INSERT INTO sales_dirty_days (day)
+        SELECT DISTINCT (service_requests.date AT TIME ZONE 'UTC')::date FROM service_requests WHERE service_requests.type = 'sale'
+    """)
+
+    #the refresh reads the sales of a day by date, built concurrently like the indexes of 0002
+    with op.get_context().autocommit_block():
+        op.create_index("ix_service_requests_date", "service_requests", ["date"], postgresql_concurrently=True, if_not_exists=True)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index("ix_service_requests_date", table_name="service_requests", postgresql_concurrently=True, if_exists=True)
+
+    op.execute("DROP TRIGGER service_requests_sales_delete ON service_requests")
+    op.execute("DROP TRIGGER service_requests_sales_update ON service_requests")
+    op.execute("DROP TRIGGER item_requests_sales_delete ON item_requests")
+    op.execute("DROP TRIGGER item_requests_sales_update ON item_requests")
+    op.execute("DROP TRIGGER item_requests_sales_insert ON item_requests")
+    op.execute("DROP FUNCTION mark_service_sales_dirty()")
+    op.execute("DROP FUNCTION mark_item_sales_dirty()")
+
+    op.drop_table("sales_dirty_days")
+    op.drop_index("ix_sales_daily_rollup_product_id_day", table_name="sales_daily_rollup")
+    op.drop_table("sales_daily_rollup")
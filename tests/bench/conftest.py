@@ -0,0 +1,31 @@
+import os
+import time
+import pytest
+
+#Benchmarks, run on demand - they take a while and their numbers only mean something on a quiet machine:
+#   RUN_BENCHMARKS=1 python -m pytest -q -s tests/bench
+#Each one prints what it measured and asserts a loose bound, so a regression fails without the test being flaky.
+
+
+@pytest.fixture
+def benchmark():
+    if not os.environ.get("RUN_BENCHMARKS"):
+        pytest.skip("benchmarks run with RUN_BENCHMARKS=1")
+
+
+def percentile(samples, fraction: float):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+#(seconds per call, calls per second) of calls runs of function
+def time_calls(function, calls: int):
+    start = time.perf_counter()
+    for _ in range(calls):
+        function()
+    seconds = time.perf_counter() - start
+    return seconds / calls, calls / seconds
+
+
+def report(name: str, **numbers):
+    print(f"\n{name}: " + ", ".join(f"{key}={value:.4g}" if isinstance(value, float) else f"{key}={value}" for key, value in numbers.items()))
@@ -0,0 +1,67 @@
+import asyncio
+import time
+import anyio
+from fastapi import FastAPI
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine
+from app.database import SQLALCHEMY_DATABASE_URL
+from ..conftest import run, api_client, check
+from .conftest import report
+
+#Concurrent-request throughput of the async routers against the sync path they replaced.
+#The sync handlers are gone, what capped them is recreated: a def handler runs in Starlette's threadpool
+#(40 workers) and holds its worker for the whole query. Both handlers run the same slow query on one engine whose pool
+#doesn't cap either of them, so the threadpool is the only difference.
+CLIENTS = 80
+ROUNDS = 3
+QUERY_SECONDS = 0.05
+#async throughput over sync throughput, about CLIENTS / 40 with nothing else in the way
+SPEEDUP = 1.5
+
+engine = create_async_engine(SQLALCHEMY_DATABASE_URL, pool_size=CLIENTS, max_overflow=0)
+bench_app = FastAPI()
+
+
+async def slow_query():
+    async with engine.connect() as connection:
+        await connection.execute(text("SELECT pg_sleep(:seconds)"), {"seconds": QUERY_SECONDS})
+
+
+@bench_app.get("/async")
+async def async_handler():
+    await slow_query()
+    return {}
+
+
+@bench_app.get("/sync")
+def sync_handler():
+    #blocks its threadpool worker until the query is done, like a sync Session did
+    anyio.from_thread.run(slow_query)
+    return {}
+
+
+def test_async_throughput_against_sync(database, benchmark):
+    async def scenario():
+        try:
+            async with api_client(bench_app) as client:
+                async def requests_per_second(path: str):
+                    start = time.perf_counter()
+                    for _ in range(ROUNDS):
+                        responses = await asyncio.gather(*(client.get(path) for _ in range(CLIENTS)))
+                        for response in responses:
+                            check(response, 200)
+                    return CLIENTS * ROUNDS / (time.perf_counter() - start)
+
+                #the pool's connections are opened before anything is timed
+                await asyncio.gather(*(client.get("/async") for _ in range(CLIENTS)))
+
+                sync = await requests_per_second("/sync")
+                asynchronous = await requests_per_second("/async")
+
+                report("sync handlers", clients=CLIENTS, query_ms=QUERY_SECONDS * 1000, requests_per_second=sync)
+                report("async handlers", clients=CLIENTS, query_ms=QUERY_SECONDS * 1000, requests_per_second=asynchronous, speedup=asynchronous / sync)
+                assert asynchronous >= sync * SPEEDUP
+        finally:
+            await engine.dispose()
+
+    run(scenario)
@@ -0,0 +1,51 @@
+import asyncio
+import time
+from ..conftest import run, api_client, check, create_customer, create_service, create_variant
+from .conftest import percentile, report
+
+#CLIENTS sales at once on one hot variant, against the same number spread over a variant each.
+#The hot variant's row lock is held from the stock reservation to the commit only (inventory.py), so the sales queue
+#on it briefly instead of convoying - the hot run stays within CONVOY_FACTOR of the spread one.
+CLIENTS = 100
+CONVOY_FACTOR = 4
+UNIT_PRICE = 100
+
+
+def test_hot_variant_throughput(database, benchmark):
+    async def scenario():
+        async with api_client() as client:
+            customer_id, headers = await create_customer(client)
+            hot_product_id, hot_variant_id = await create_variant(client, CLIENTS)
+            spread = [variant_id for product_id, variant_id in [await create_variant(client, 1) for _ in range(CLIENTS)]]
+
+            async def sell(variant_ids):
+                sales = [await create_service(client, customer_id, headers, "sale") for _ in variant_ids]
+                latencies = []
+
+                async def one(sale: int, variant_id: int):
+                    start = time.perf_counter()
+                    response = await client.post(f"/customers/{customer_id}/services/{sale}/items/",
+                                                 json={"product_variant_id": variant_id, "quantity": 1, "unit_price": UNIT_PRICE}, headers=headers)
+                    latencies.append(time.perf_counter() - start)
+                    check(response, 201)
+
+                start = time.perf_counter()
+                await asyncio.gather(*(one(sale, variant_id) for sale, variant_id in zip(sales, variant_ids)))
+                return time.perf_counter() - start, latencies
+
+            #the pool's connections are opened before anything is timed
+            await asyncio.gather(*(client.get(f"/products/{hot_product_id}") for _ in range(CLIENTS)))
+
+            spread_seconds, spread_latencies = await sell(spread)
+            hot_seconds, hot_latencies = await sell([hot_variant_id] * CLIENTS)
+
+            report("spread variants", clients=CLIENTS, requests_per_second=CLIENTS / spread_seconds,
+                   p50_ms=percentile(spread_latencies, 0.5) * 1000, p99_ms=percentile(spread_latencies, 0.99) * 1000)
+            report("hot variant", clients=CLIENTS, requests_per_second=CLIENTS / hot_seconds,
+                   p50_ms=percentile(hot_latencies, 0.5) * 1000, p99_ms=percentile(hot_latencies, 0.99) * 1000)
+
+            variant = check(await client.get(f"/products/{hot_product_id}/variants/{hot_variant_id}"), 200)
+            assert variant["stock_quantity"] == 0
+            assert hot_seconds <= spread_seconds * CONVOY_FACTOR
+
+    run(scenario)
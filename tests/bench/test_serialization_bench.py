@@ -0,0 +1,52 @@
+import json
+import time
+from datetime import datetime
+from typing import List
+from fastapi.encoders import jsonable_encoder
+from pydantic import TypeAdapter
+from app import models
+from app.response import ServiceResponse, dump
+from .conftest import report
+
+#10k ServiceResponse rows with their customer, repairs and items, serialized the way the list endpoints do now
+#(a prebuilt TypeAdapter validating the ORM rows and dumping JSON bytes in pydantic-core, response.dump)
+#against the path they replaced (a model per row, jsonable_encoder, json.dumps).
+SERVICES = 10000
+NESTED = 3
+SPEEDUP = 2
+
+SERVICE_LIST = TypeAdapter(List[ServiceResponse])
+
+
+#detached ORM rows, nothing is loaded from the database
+def services():
+    now = datetime(2026, 1, 1, 12, 30)
+    customer = models.Customer(id=1, name="Test Customer", email="customer@example.com", address="Test Street", created_at=now)
+    return [
+        models.ServiceRequest(
+            id=id, customer_id=1, type=models.ServiceCreate.sale, total_cost=NESTED * 100.0, date=now, user=customer,
+            repairs=[models.Repair(id=id * NESTED + index, request_id=id, description="Sole repair", status=models.Status.PENDING,
+                                   created_at=now, version=0) for index in range(NESTED)],
+            items=[models.ItemRequest(id=id * NESTED + index, request_id=id, product_variant_id=index + 1, quantity=1,
+                                      unit_price=100.0, created_at=now) for index in range(NESTED)]
+        )
+        for id in range(1, SERVICES + 1)
+    ]
+
+
+def test_service_list_serialization(benchmark):
+    rows = services()
+
+    start = time.perf_counter()
+    encoded = json.dumps(jsonable_encoder([ServiceResponse.model_validate(row) for row in rows])).encode()
+    encoder_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    dumped = dump(SERVICE_LIST, rows)
+    adapter_seconds = time.perf_counter() - start
+
+    assert json.loads(dumped) == json.loads(encoded)
+
+    report("model per row + jsonable_encoder + json.dumps", services=SERVICES, ms=encoder_seconds * 1000)
+    report("TypeAdapter dump_json", services=SERVICES, ms=adapter_seconds * 1000, bytes=len(dumped), speedup=encoder_seconds / adapter_seconds)
+    assert adapter_seconds * SPEEDUP <= encoder_seconds
@@ -0,0 +1,28 @@
+from app import oauth2
+from .conftest import time_calls, report
+
+#get_current_user with the decoded token cache (oauth2.TokenCache) against a full jwt.decode on every call,
+#the same token reused the way a client does until it expires
+CALLS = 20000
+SPEEDUP = 5
+
+
+def test_token_cache_saves_decode(benchmark):
+    token = oauth2.create_token({"user_id": 1})
+    key = oauth2.token_digest(token)
+
+    def decoded():
+        oauth2.token_cache.evict(key)
+        return oauth2.get_current_user(token)
+
+    def cached():
+        return oauth2.get_current_user(token)
+
+    assert decoded().id == cached().id == 1
+
+    decode_seconds, decode_rate = time_calls(decoded, CALLS)
+    cached_seconds, cached_rate = time_calls(cached, CALLS)
+
+    report("jwt.decode per call", calls=CALLS, us_per_call=decode_seconds * 1e6, calls_per_second=decode_rate)
+    report("token cache", calls=CALLS, us_per_call=cached_seconds * 1e6, calls_per_second=cached_rate, speedup=decode_seconds / cached_seconds)
+    assert cached_seconds * SPEEDUP <= decode_seconds
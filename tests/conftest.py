@@ -0,0 +1,88 @@
+import asyncio
+import os
+import uuid
+from contextlib import asynccontextmanager
+import pytest
+
+#The tests run the API in process against the database of the DATABASE_* settings (.env), upgraded to head with
+#alembic upgrade head. They create their own rows under random names and leave them behind, use a disposable database.
+#   pip install pytest
+#   python -m pytest -q
+#
+#Read before the app is imported - catalog reads skip the cache, the cheapest bcrypt cost, a route over its query budget
+#fails the request, and no background refresh of the sales rollup
+os.environ.setdefault("CACHE_ENABLED", "false")
+os.environ.setdefault("BCRYPT_ROUNDS", "4")
+os.environ.setdefault("SQL_QUERY_BUDGET_STRICT", "true")
+os.environ.setdefault("ANALYTICS_REFRESH_SECONDS", "0")
+
+import httpx
+from sqlalchemy import text
+from app.main import app
+from app.database import engine
+from app.utils import shutdown_password_pool
+
+PASSWORD = "password"
+
+
+#runs scenario() on an event loop of its own, the pooled connections belong to that loop and are closed with it
+def run(scenario):
+    async def main():
+        try:
+            return await scenario()
+        finally:
+            await engine.dispose()
+
+    return asyncio.run(main())
+
+
+@pytest.fixture(scope="session")
+def database():
+    async def check():
+        async with engine.connect() as connection:
+            return await connection.scalar(text("SELECT version_num FROM alembic_version"))
+
+    try:
+        version = run(check)
+    except Exception as e:
+        pytest.skip(f"No migrated test database: {e}")
+    if not version:
+        pytest.skip("Test database has no alembic version, run alembic upgrade head")
+
+    yield
+    shutdown_password_pool()
+
+
+#application - the API by default, the benchmarks pass apps of their own
+@asynccontextmanager
+async def api_client(application=app):
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=application), base_url="http://test", timeout=60) as client:
+        yield client
+
+
+def unique(name: str):
+    return f"{name}-{uuid.uuid4().hex[:12]}"
+
+
+def check(response, status_code: int):
+    assert response.status_code == status_code, f"{response.request.method} {response.request.url} - {response.status_code} {response.text}"
+    return response.json() if response.content else None
+
+
+#(customer id, Authorization header) of a new customer that is logged in
+async def create_customer(client):
+    email = f"{unique('customer')}@example.com"
+    customer = check(await client.post("/customers/", json={"name": "Test Customer", "email": email, "password": PASSWORD, "address": "Test Street"}), 201)
+    token = check(await client.post("/login", data={"username": email, "password": PASSWORD}), 200)
+    return customer["id"], {"Authorization": f"Bearer {token['access_token']}"}
+
+
+async def create_service(client, customer_id: int, headers: dict, type: str):
+    return check(await client.post(f"/customers/{customer_id}/services/", json={"type": type}, headers=headers), 201)["id"]
+
+
+#(product id, variant id) of a new product with one variant holding stock
+async def create_variant(client, stock: int):
+    product = check(await client.post("/products/", json={"name": unique("product"), "description": "Test product", "price": 100}), 201)
+    variant = check(await client.post(f"/products/{product['id']}/variants/", json={"size": "42", "color": unique("color"), "stock_quantity": stock}), 201)
+    return product["id"], variant["id"]
@@ -0,0 +1,47 @@
+import json
+from .conftest import run, api_client, check, unique
+
+
+#pages through GET /products/ for the product named name
+async def find_product(client, name: str):
+    params = {"limit": 1000}
+    while True:
+        response = await client.get("/products/", params=params)
+        for product in check(response, 200):
+            if product["name"] == name:
+                return product
+        params["cursor"] = response.headers["X-Next-Cursor"]
+
+
+def upload(records):
+    return {"file": ("catalog.ndjson", "".join(json.dumps(record) + "\n" for record in records).encode(), "application/x-ndjson")}
+
+
+#a field of the wrong JSON type rejects its row, the other rows are still imported
+def test_non_string_fields_are_rejected_rows(database):
+    async def scenario():
+        async with api_client() as client:
+            name = unique("product")
+            records = [
+                {"name": name, "description": "Test product", "price": 100, "size": 42, "color": "black", "stock_quantity": 3},
+                {"name": ["x"], "description": "Test product", "price": 100},
+                {"name": unique("product"), "description": "Test product", "price": 100, "size": "42", "color": {"hex": "000"}},
+                {"name": unique("product"), "description": "Test product", "price": 100, "size": "42", "color": "black", "stock_quantity": [1]},
+            ]
+
+            report = check(await client.post("/products/import", params={"format": "ndjson"}, files=upload(records)), 200)
+
+            assert report["rows"] == 4
+            assert report["products"]["inserted"] == 1
+            assert report["variants"]["inserted"] == 1
+            assert report["rejects"] == [
+                {"line": 2, "reason": "name must be a string"},
+                {"line": 3, "reason": "color must be a string"},
+                {"line": 4, "reason": "stock_quantity must be an integer"},
+            ]
+
+            #a numeric size is taken as its text
+            product = await find_product(client, name)
+            assert [(variant["size"], variant["stock_quantity"]) for variant in product["variants"]] == [("42", 3)]
+
+    run(scenario)
@@ -0,0 +1,30 @@
+from .conftest import run, api_client, check, create_customer, create_service
+
+
+#the tag of a ?fields= read is weak but names the same version, it is accepted by If-Match on the bare path
+def test_if_match_accepts_tag_of_partial_representation(database):
+    async def scenario():
+        async with api_client() as client:
+            customer_id, headers = await create_customer(client)
+            service_id = await create_service(client, customer_id, headers, "repair")
+            path = f"/customers/{customer_id}/services/{service_id}"
+
+            full = await client.get(path, headers=headers)
+            check(full, 200)
+            partial = await client.get(path, params={"fields": "total_cost"}, headers=headers)
+            check(partial, 200)
+            assert partial.headers["ETag"] == f"W/{full.headers['ETag']}"
+
+            #the weak tag is current for the full representation too
+            response = await client.get(path, headers={**headers, "If-None-Match": partial.headers["ETag"]})
+            check(response, 304)
+
+            updated = await client.patch(path, json={"total_cost": 10}, headers={**headers, "If-Match": partial.headers["ETag"]})
+            check(updated, 200)
+            assert updated.headers["ETag"] != full.headers["ETag"]
+
+            #the tag read before the write is stale now
+            check(await client.patch(path, json={"total_cost": 20}, headers={**headers, "If-Match": partial.headers["ETag"]}), 412)
+            check(await client.patch(path, json={"total_cost": 20}, headers={**headers, "If-Match": updated.headers["ETag"]}), 200)
+
+    run(scenario)
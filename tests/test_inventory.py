@@ -0,0 +1,78 @@
+import asyncio
+from collections import Counter
+from .conftest import run, api_client, check, create_customer, create_service, create_variant
+
+#many clients selling the same hot variant at once, one sale each
+CLIENTS = 100
+STOCK = 10
+UNIT_PRICE = 100
+
+
+def items_path(customer_id: int, service_id: int):
+    return f"/customers/{customer_id}/services/{service_id}/items/"
+
+
+def test_hot_variant_is_not_oversold(database):
+    async def scenario():
+        async with api_client() as client:
+            customer_id, headers = await create_customer(client)
+            product_id, variant_id = await create_variant(client, STOCK)
+            sales = [await create_service(client, customer_id, headers, "sale") for _ in range(CLIENTS)]
+
+            responses = await asyncio.gather(*(
+                client.post(items_path(customer_id, sale), json={"product_variant_id": variant_id, "quantity": 1, "unit_price": UNIT_PRICE}, headers=headers)
+                for sale in sales
+            ))
+
+            #every sale either got one of the pairs or a clean 409, none failed on a deadlock or a lock timeout
+            assert Counter(response.status_code for response in responses) == {201: STOCK, 409: CLIENTS - STOCK}
+
+            variant = check(await client.get(f"/products/{product_id}/variants/{variant_id}"), 200)
+            assert variant["stock_quantity"] == 0
+            assert variant["product"]["stock_quantity"] == 0
+
+            #only the sales that got their item were charged for it
+            for sale, response in zip(sales, responses):
+                service = check(await client.get(f"/customers/{customer_id}/services/{sale}", headers=headers), 200)
+                assert service["total_cost"] == (UNIT_PRICE if response.status_code == 201 else 0)
+
+    run(scenario)
+
+
+def test_bulk_and_single_sales_share_stock(database):
+    async def scenario():
+        async with api_client() as client:
+            customer_id, headers = await create_customer(client)
+            variants = [await create_variant(client, STOCK) for _ in range(2)]
+            sales = [await create_service(client, customer_id, headers, "sale") for _ in range(CLIENTS // 2)]
+
+            #bulk sales take both variants (in both orders), single sales one of them - they lock the sale, the variants
+            #and the products in the same order and can't deadlock each other
+            def request(index: int, sale: int):
+                ordered = variants if index % 2 else variants[::-1]
+                if index % 3:
+                    body = [{"product_variant_id": variant_id, "quantity": 1, "unit_price": UNIT_PRICE} for product_id, variant_id in ordered]
+                    return client.post(f"{items_path(customer_id, sale)}bulk", json=body, headers=headers)
+                return client.post(items_path(customer_id, sale), json={"product_variant_id": ordered[0][1], "quantity": 1, "unit_price": UNIT_PRICE}, headers=headers)
+
+            responses = await asyncio.gather(*(request(index, sale) for index, sale in enumerate(sales)))
+            assert all(response.status_code in (200, 201, 409) for response in responses), [response.text for response in responses if response.status_code >= 500]
+
+            sold = Counter()
+            for response in responses:
+                if response.status_code == 201:
+                    sold[response.json()["product_variant_id"]] += 1
+                elif response.status_code == 200:
+                    for result in response.json():
+                        if result["status"] == "created":
+                            sold[result["item"]["product_variant_id"]] += 1
+                        else:
+                            assert result["status"] == "insufficient_stock", result
+
+            for product_id, variant_id in variants:
+                variant = check(await client.get(f"/products/{product_id}/variants/{variant_id}"), 200)
+                assert sold[variant_id] == STOCK
+                assert variant["stock_quantity"] == 0
+                assert variant["product"]["stock_quantity"] == 0
+
+    run(scenario)
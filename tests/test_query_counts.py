@@ -0,0 +1,66 @@
+import re
+from .conftest import run, api_client, check, unique, create_customer, create_service, create_variant
+
+#Every list endpoint loads its nested response models with explicit loader strategies (loaders.py, fieldsets.py),
+#so the number of statements it runs doesn't depend on how many rows it returns.
+#The routes run with SQL_QUERY_BUDGET_STRICT (conftest.py), a route over its query_budget fails with a 500.
+
+ROWS = 5
+
+
+#Server-Timing: db;dur=12.4;desc="5 queries", db-slowest;dur=6.1 (instrumentation.py)
+def query_count(response):
+    return int(re.search(r'desc="(\d+) queries"', response.headers["Server-Timing"]).group(1))
+
+
+#count more items under the sale and repairs under the repair service, each with a service and a variant of its own
+#so the customer's services and the product's variants grow along
+async def add_rows(client, customer_id: int, headers: dict, product_id: int, sale: int, repair: int, count: int):
+    for _ in range(count):
+        await create_service(client, customer_id, headers, "sale")
+        await create_service(client, customer_id, headers, "repair")
+        variant = check(await client.post(f"/products/{product_id}/variants/", json={"size": "42", "color": unique("color"), "stock_quantity": 1}), 201)
+        check(await client.post(f"/customers/{customer_id}/services/{sale}/items/", json={"product_variant_id": variant["id"], "quantity": 1, "unit_price": 100}, headers=headers), 201)
+        check(await client.post(f"/customers/{customer_id}/services/{repair}/repairs/", json={"description": "Sole repair"}, headers=headers), 201)
+
+
+def test_list_query_count_is_fixed(database):
+    async def scenario():
+        async with api_client() as client:
+            customer_id, headers = await create_customer(client)
+            product_id, variant_id = await create_variant(client, 1)
+            sale = await create_service(client, customer_id, headers, "sale")
+            repair = await create_service(client, customer_id, headers, "repair")
+
+            async def query_counts():
+                paths = [
+                    "/customers/",
+                    f"/customers/{customer_id}",
+                    f"/customers/{customer_id}/services/",
+                    f"/customers/{customer_id}/services/{sale}",
+                    f"/customers/{customer_id}/services/{sale}/items/",
+                    f"/customers/{customer_id}/services/{repair}/repairs/",
+                    "/products/",
+                    f"/products/{product_id}",
+                    f"/products/{product_id}/variants/",
+                ]
+                counts = {}
+                for path in paths:
+                    response = await client.get(path, headers=headers)
+                    check(response, 200)
+                    counts[path] = query_count(response)
+                return counts
+
+            #one row under every list, then ROWS + 1
+            await add_rows(client, customer_id, headers, product_id, sale, repair, 1)
+            one = await query_counts()
+            await add_rows(client, customer_id, headers, product_id, sale, repair, ROWS)
+            many = await query_counts()
+
+            items = check(await client.get(f"/customers/{customer_id}/services/{sale}/items/", headers=headers), 200)
+            repairs = check(await client.get(f"/customers/{customer_id}/services/{repair}/repairs/", headers=headers), 200)
+            assert len(items) == len(repairs) == ROWS + 1
+
+            assert [path for path in one if one[path] != many[path]] == [], (one, many)
+
+    run(scenario)
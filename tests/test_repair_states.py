@@ -0,0 +1,68 @@
+import asyncio
+from collections import Counter
+from .conftest import run, api_client, check, create_customer, create_service
+
+CLIENTS = 10
+
+
+async def create_repair(client, customer_id: int, headers: dict):
+    service_id = await create_service(client, customer_id, headers, "repair")
+    repair = check(await client.post(f"/customers/{customer_id}/services/{service_id}/repairs/", json={"description": "Sole repair"}, headers=headers), 201)
+    return f"/customers/{customer_id}/services/{service_id}/repairs/{repair['id']}"
+
+
+#clients that read version 0 all try to start the repair - exactly one transition applies, the others get 409
+def test_concurrent_transitions_apply_once(database):
+    async def scenario():
+        async with api_client() as client:
+            customer_id, headers = await create_customer(client)
+            path = await create_repair(client, customer_id, headers)
+
+            responses = await asyncio.gather(*(
+                client.patch(path, json={"status": "in_progress", "version": 0}, headers=headers) for _ in range(CLIENTS)
+            ))
+            assert Counter(response.status_code for response in responses) == {200: 1, 409: CLIENTS - 1}
+
+            repair = check(await client.get(path, headers=headers), 200)
+            assert repair["status"] == "in_progress"
+            assert repair["version"] == 1
+            assert repair["start_date"] is not None
+
+    run(scenario)
+
+
+#writes without a version aren't lost either - each one applied increments the version, the others get 409
+def test_concurrent_writes_are_counted(database):
+    async def scenario():
+        async with api_client() as client:
+            customer_id, headers = await create_customer(client)
+            path = await create_repair(client, customer_id, headers)
+
+            responses = await asyncio.gather(*(
+                client.patch(path, json={"description": f"Sole repair {index}"}, headers=headers) for index in range(CLIENTS)
+            ))
+            statuses = Counter(response.status_code for response in responses)
+            assert set(statuses) <= {200, 409}
+
+            repair = check(await client.get(path, headers=headers), 200)
+            assert repair["version"] == statuses[200]
+
+    run(scenario)
+
+
+#a completed repair can be reverted to pending (a misinput), only a stale version is refused
+def test_completed_repair_reverts_to_pending(database):
+    async def scenario():
+        async with api_client() as client:
+            customer_id, headers = await create_customer(client)
+            path = await create_repair(client, customer_id, headers)
+
+            completed = check(await client.patch(path, json={"status": "completed", "version": 0}, headers=headers), 200)
+            check(await client.patch(path, json={"status": "pending", "version": 0}, headers=headers), 409)
+
+            reverted = check(await client.patch(path, json={"status": "pending", "version": completed["version"]}, headers=headers), 200)
+            assert reverted["start_date"] is None
+            assert reverted["finished_date"] is None
+            assert reverted["version"] == completed["version"] + 1
+
+    run(scenario)